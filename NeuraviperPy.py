@@ -63,6 +63,8 @@ from sys import platform as _platform
 from types import FunctionType
 from typing import List, Tuple
 
+import numpy as np
+
 # logger = logging.getLogger(__name__)
 logger = logging.getLogger("NVP")
 logger.setLevel(logging.DEBUG)
@@ -289,6 +291,47 @@ class Packet:
         self.data = data
 
 
+# NumPy view of a PacketInfo array, offsets are taken from the ctypes struct so the
+# padding added by the compiler is respected.
+PACKETINFO_DTYPE = np.dtype(
+    {
+        "names": [field[0] for field in PacketInfo._fields_],
+        "formats": ["<u4", "<u2", "<u2", "u1"],
+        "offsets": [
+            getattr(PacketInfo, field[0]).offset for field in PacketInfo._fields_
+        ],
+        "itemsize": sizeof(PacketInfo),
+    }
+)
+
+CHANNEL_COUNT = 64  # Channel count must be 64
+
+
+def _packet_arrays(
+    info_arr, data_arr, packets_read: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Returns (timestamps, status, session_id, data) as NumPy views over the
+    ctypes buffers filled by the API, data has shape (packets_read, 64)."""
+    info = np.frombuffer(info_arr, dtype=PACKETINFO_DTYPE, count=packets_read)
+    data = np.frombuffer(
+        data_arr, dtype=np.int16, count=packets_read * CHANNEL_COUNT
+    ).reshape(packets_read, CHANNEL_COUNT)
+    return info["Timestamp"], info["Status"], info["session_id"], data
+
+
+def _packet_list(info_arr, data_arr, packets_read: int) -> list[Packet]:
+    """Builds the list of "Packet" objects from the ctypes buffers."""
+    packets = [None] * packets_read
+    for i in range(0, packets_read):
+        info = info_arr[i]
+        offset = i * CHANNEL_COUNT
+        data = data_arr[offset : offset + CHANNEL_COUNT]
+        packets[i] = Packet(
+            info.Timestamp, info.Status, info.payloadlength, info.session_id, data
+        )
+    return packets
+
+
 class DiagStats(Struct):
     "DiagStats"
     _fields_ = [
@@ -661,38 +704,49 @@ def getTriggerMode(handle: DeviceHandle) -> TriggerMode:
         POINTER(c_int),
     ],
 )
-def readElectrodeData(
-    handle: DeviceHandle, probe: int, packet_count: int
-) -> list[Packet]:
-    # Read electrode data
-    # handle: device handle got by createHandle()
-    # probe: number of focussed probe: 0...3
-    # packet_count: number of packets to read (the number actually read can be lower)
-    # Return: list of "Packet"
-
-    channel_count = 64  # Channel count must be 64
+def _readElectrodeData(handle: DeviceHandle, probe: int, packet_count: int):
+    # Read electrode data into freshly allocated ctypes buffers
+    # Return: (info_arr, data_arr, packets_read)
     packets_read = c_int(0)  # Class constructor; packets_read.value = 0
     info_arr = (
         PacketInfo * packet_count
     )()  # Ctypes way of defining an array of packet_count times a PacketInfo element;
     # (): empty
-    data_arr = (c_int16 * (packet_count * channel_count))()
+    data_arr = (c_int16 * (packet_count * CHANNEL_COUNT))()
 
     __assertnvperror(
         _c_fn(
-            handle, probe, info_arr, data_arr, channel_count, packet_count, packets_read
+            handle, probe, info_arr, data_arr, CHANNEL_COUNT, packet_count, packets_read
         )
     )
+    return info_arr, data_arr, packets_read.value
 
-    packets = [None] * packets_read.value
-    for i in range(0, packets_read.value):
-        info = info_arr[i]
-        offset = i * channel_count
-        data = data_arr[offset : offset + channel_count]
-        packets[i] = Packet(
-            info.Timestamp, info.Status, info.payloadlength, info.session_id, data
-        )
-    return packets
+
+def readElectrodeDataArray(
+    handle: DeviceHandle, probe: int, packet_count: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Read electrode data as NumPy arrays.
+
+    :param handle: device handle got by createHandle()
+    :param probe: number of focussed probe: 0...3
+    :param packet_count: number of packets to read (the number actually read can be
+        lower)
+    :return: (timestamps, status, session_id, data) where data has shape (N, 64) and
+        dtype int16. The arrays are views over the buffers filled by the API, no
+        per-packet Python objects are created.
+    """
+    return _packet_arrays(*_readElectrodeData(handle, probe, packet_count))
+
+
+def readElectrodeData(
+    handle: DeviceHandle, probe: int, packet_count: int
+) -> list[Packet]:
+    # Read electrode data
+    # handle: device handle got by createHandle()
+    # probe: number of focussed probe: 0...3
+    # packet_count: number of packets to read (the number actually read can be lower)
+    # Return: list of "Packet"
+    return _packet_list(*_readElectrodeData(handle, probe, packet_count))
 
 
 @_wrap_function("readDiagStats", NVP_ErrorCode, [DeviceHandle, POINTER(DiagStats)])
@@ -768,36 +822,173 @@ def streamClose(handle: StreamHandle) -> None:
     NVP_ErrorCode,
     [DeviceHandle, POINTER(PacketInfo), POINTER(c_int16), c_int, c_int, POINTER(c_int)],
 )
-def streamReadData(handle: StreamHandle, packet_count: int) -> list[Packet]:
-    # Read stream data
-    # StreamHandle: handle of the stream buffer
-    # packet_count: number of packets to read
-    # Return: list of "Packet"
+def _streamReadInto(
+    handle: StreamHandle, info_arr, data_ptr, packet_count: int, packets_read: c_int
+) -> int:
+    # Read stream data into caller owned buffers
+    # info_arr: ctypes array of at least packet_count PacketInfo elements
+    # data_ptr: buffer of at least packet_count * 64 int16 values
+    # Return: number of packets read
+    error_code = _c_fn(
+        handle, info_arr, data_ptr, CHANNEL_COUNT, packet_count, packets_read
+    )
+    # STREAM_EOF = 26
+    if error_code != 26 and error_code != 0:
+        raise NeuraviperAPIError(error_code)
+    return packets_read.value
 
-    channel_count = 64  # Channel count must be 64
+
+def _streamReadData(handle: StreamHandle, packet_count: int):
+    # Read stream data into freshly allocated ctypes buffers
+    # Return: (info_arr, data_arr, packets_read)
     packets_read = c_int(0)  # Class constructor; packets_read.value = 0
     info_arr = (
         PacketInfo * packet_count
     )()  # Ctypes way of defining an array of packet_count times a PacketInfo element;
     # (): empty
-    data_arr = (c_int16 * (packet_count * channel_count))()
+    data_arr = (c_int16 * (packet_count * CHANNEL_COUNT))()
 
-    error_code = _c_fn(
-        handle, info_arr, data_arr, channel_count, packet_count, packets_read
-    )
-    # STREAM_EOF = 26
-    if error_code != 26 and error_code != 0:
-        raise NeuraviperAPIError(error_code)
+    _streamReadInto(handle, info_arr, data_arr, packet_count, packets_read)
+    return info_arr, data_arr, packets_read.value
 
-    packets = [None] * packets_read.value
-    for i in range(0, packets_read.value):
-        info = info_arr[i]
-        offset = i * channel_count
-        data = data_arr[offset : offset + channel_count]
-        packets[i] = Packet(
-            info.Timestamp, info.Status, info.payloadlength, info.session_id, data
+
+def streamReadDataArray(
+    handle: StreamHandle, packet_count: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Read stream data as NumPy arrays.
+
+    :param handle: handle of the stream buffer
+    :param packet_count: number of packets to read
+    :return: (timestamps, status, session_id, data) where data has shape (N, 64) and
+        dtype int16. The arrays are views over the buffers filled by the API, no
+        per-packet Python objects are created.
+    """
+    return _packet_arrays(*_streamReadData(handle, packet_count))
+
+
+def streamReadData(handle: StreamHandle, packet_count: int) -> list[Packet]:
+    # Read stream data
+    # StreamHandle: handle of the stream buffer
+    # packet_count: number of packets to read
+    # Return: list of "Packet"
+    return _packet_list(*_streamReadData(handle, packet_count))
+
+
+class StreamReader:
+    """Reads the packets of one probe from a datastream file into buffers that are
+    allocated once.
+
+    The reader owns the stream handle and the ctypes buffers for its lifetime, so
+    reading in a loop does not allocate. Use it as a context manager to close the
+    stream handle deterministically:
+
+        with StreamReader(filename, probe, 500) as reader:
+            data = np.empty((500, 64), dtype=np.int16)
+            count = reader.readinto(data)
+
+    :param filename: datastream file written by setFileStream()
+    :param probe: number of focussed probe: 0...3
+    :param packet_count: maximum number of packets per read
+    """
+
+    def __init__(self, filename: str, probe: int, packet_count: int):
+        self.filename = filename
+        self.probe = probe
+        self.packet_count = packet_count
+        self._info_arr = (PacketInfo * packet_count)()
+        self._data_arr = (c_int16 * (packet_count * CHANNEL_COUNT))()
+        self._packets_read = c_int(0)
+        (
+            self._timestamps,
+            self._status,
+            self._session_id,
+            self._data,
+        ) = _packet_arrays(self._info_arr, self._data_arr, packet_count)
+        self.handle = streamOpenFile(filename, probe)
+
+    def __enter__(self) -> "StreamReader":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.handle is None
+
+    def close(self) -> None:
+        """Closes the stream handle, calling it more than once is allowed."""
+        if self.handle is not None:
+            handle, self.handle = self.handle, None
+            streamClose(handle)
+
+    def readinto(
+        self,
+        data: np.ndarray,
+        timestamps: np.ndarray | None = None,
+        status: np.ndarray | None = None,
+        session_id: np.ndarray | None = None,
+    ) -> int:
+        """Reads up to len(data) packets into caller supplied arrays.
+
+        If data is a C-contiguous int16 array of shape (N, 64) the API writes into
+        it directly, otherwise the packets are read into the internal buffer and
+        copied (with unsafe casting) into data.
+
+        :param data: output array of shape (N, 64)
+        :param timestamps: optional output array of length >= N
+        :param status: optional output array of length >= N
+        :param session_id: optional output array of length >= N
+        :return: number of packets read, lower than N when the end of the file was
+            reached
+        """
+        if self.handle is None:
+            raise ValueError("I/O operation on closed StreamReader")
+        count = min(len(data), self.packet_count)
+        direct = (
+            data.dtype == np.int16
+            and data.flags.c_contiguous
+            and data.shape[1:] == (CHANNEL_COUNT,)
+        )
+        if direct:
+            data_ptr = data.ctypes.data_as(POINTER(c_int16))
+        else:
+            data_ptr = self._data_arr
+        n = _streamReadInto(
+            self.handle, self._info_arr, data_ptr, count, self._packets_read
+        )
+        if not direct:
+            np.copyto(data[:n], self._data[:n], casting="unsafe")
+        if timestamps is not None:
+            np.copyto(timestamps[:n], self._timestamps[:n], casting="unsafe")
+        if status is not None:
+            np.copyto(status[:n], self._status[:n], casting="unsafe")
+        if session_id is not None:
+            np.copyto(session_id[:n], self._session_id[:n], casting="unsafe")
+        return n
+
+    def read(
+        self, packet_count: int | None = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Reads up to packet_count packets into the internal buffers.
+
+        :return: (timestamps, status, session_id, data) views over the internal
+            buffers, only valid until the next read.
+        """
+        if self.handle is None:
+            raise ValueError("I/O operation on closed StreamReader")
+        if packet_count is None:
+            packet_count = self.packet_count
+        count = min(packet_count, self.packet_count)
+        n = _streamReadInto(
+            self.handle, self._info_arr, self._data_arr, count, self._packets_read
+        )
+        return (
+            self._timestamps[:n],
+            self._status[:n],
+            self._session_id[:n],
+            self._data[:n],
         )
-    return packets
 
 
 @_wrap_function("setDeviceEmulatorMode", NVP_ErrorCode, [DeviceHandle, c_int])
@@ -64,6 +64,11 @@ class ChanSettings:
     def hash(self):
         return hash(f"{self.references}{self.gain}{self.input}")
 
+    @property
+    def fingerprint(self):
+        # Only the settings that are uploaded to the probe
+        return (self.get_refs, self.gain)
+
 
 @dataclass
 class SUSettings:
@@ -127,6 +132,32 @@ class ProbeSettings:
     _sus: int = 8
     _elecs: int = 128
 
+    def changed_channels(
+        self, uploaded: "ProbeSettings | None"
+    ) -> Dict[int, List[str]]:
+        """
+        Returns the channels of which the settings differ from uploaded, with the
+        settings that changed: "references" and/or "gain". Channels that weren't
+        uploaded yet also need their "electrode" selected.
+        """
+        uploaded_channels = uploaded.channel if uploaded is not None else {}
+        changes = {}
+        for channel, settings in self.channel.items():
+            previous = uploaded_channels.get(channel)
+            if previous is None:
+                changes[channel] = ["electrode", "references", "gain"]
+            elif settings.fingerprint != previous.fingerprint:
+                changes[channel] = [
+                    name
+                    for name, value, previous_value in zip(
+                        ["references", "gain"],
+                        settings.fingerprint,
+                        previous.fingerprint,
+                    )
+                    if value != previous_value
+                ]
+        return changes
+
     def SUs_connected(self, stim_unit: int):
         # return binary string of SU's for a particular SU that have uploaded settings
         pass
@@ -0,0 +1,828 @@
+import argparse
+import bisect
+import json
+import logging
+import logging.handlers
+import os
+import time
+import traceback
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, Tuple
+
+import numpy as np
+
+import NeuraviperPy as NVP
+from defaults.defaults import Mappings
+from VB_recordings import (
+    PREVIEW_FACTORS,
+    IntegrityScanner,
+    PreviewPyramid,
+    TimeIndex,
+    append_zarr_preview,
+    clear_zarr_preview,
+    create_sidecar,
+    create_zarr_recording,
+    events_to_samples,
+    index_path,
+    open_sidecar,
+    open_zarr_recording,
+    preview_path,
+    resize_zarr_recording,
+    sidecar_paths,
+    write_zarr_chunk,
+    write_zarr_events,
+    zarr,
+)
+from VB_streaming import ChannelRemap
+from XML_handler import read_stimrec_events
+
+logger = logging.getLogger("VB_convert")
+logger.setLevel(logging.DEBUG)
+socketHandler = logging.handlers.SocketHandler(
+    "localhost", logging.handlers.DEFAULT_TCP_LOGGING_PORT
+)
+logger.addHandler(socketHandler)
+
+
+def checkpoint_path(zarr_path: str | Path) -> Path:
+    """Returns the path of the ConversionCheckpoint of a Zarr store."""
+    return Path(f"{zarr_path}.checkpoint.json")
+
+
+class ConversionCheckpoint:
+    """
+    Progress of a conversion to Zarr, saved next to the store as
+    <store>.checkpoint.json, so that an interrupted conversion can resume.
+
+    The worker processes write the chunks out of order, samples[probe] is the number
+    of samples from the start of the probe up to the first chunk that isn't written.
+    complete are the probes that are written entirely. The checkpoint is removed
+    when the conversion is done.
+    """
+
+    def __init__(self, zarr_path: str | Path, chunk_samples: int):
+        self.path = checkpoint_path(zarr_path)
+        self.chunk_samples = chunk_samples
+        self.samples: dict = {}
+        self.complete: list = []
+        self._written: dict = {}
+        self._totals: dict = {}
+
+    @classmethod
+    def load(cls, zarr_path: str | Path, chunk_samples: int):
+        """Returns the checkpoint of zarr_path, or None if there is none or it used
+        another chunk size."""
+        checkpoint = cls(zarr_path, chunk_samples)
+        if not checkpoint.path.exists() or not Path(zarr_path).exists():
+            return None
+        try:
+            state = json.loads(checkpoint.path.read_text())
+        except (OSError, ValueError) as e:
+            logger.error(f"Couldn't load checkpoint {checkpoint.path}: {e}")
+            return None
+        if state["chunk_samples"] != chunk_samples:
+            return None
+        checkpoint.samples = {int(probe): n for probe, n in state["samples"].items()}
+        checkpoint.complete = state["complete"]
+        return checkpoint
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps(
+                {
+                    "chunk_samples": self.chunk_samples,
+                    "samples": self.samples,
+                    "complete": self.complete,
+                }
+            )
+        )
+        os.replace(tmp_path, self.path)
+
+    def written(self, probe: int, start: int, count: int) -> None:
+        """Marks the chunk of count samples from start of probe as written."""
+        written = self._written.setdefault(probe, {})
+        written[start] = count
+        samples = self.samples.get(probe, 0)
+        while samples in written:
+            samples += written.pop(samples)
+        self.samples[probe] = samples
+        self._check_complete(probe)
+
+    def read(self, probe: int, total: int) -> None:
+        """Sets the number of samples of probe, once it is read entirely."""
+        self._totals[probe] = total
+        self._check_complete(probe)
+
+    def _check_complete(self, probe: int) -> None:
+        if self._totals.get(probe) == self.samples.get(probe, 0):
+            if probe not in self.complete:
+                self.complete.append(probe)
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def convert_to_zarr(
+    rec_path: str | Path,
+    zarr_path: str | Path,
+    probes: list,
+    remap: ChannelRemap,
+    FREQ: int = 20000,
+    chunk_samples: int = 20000,
+    max_workers: int | None = None,
+    attrs: dict | None = None,
+    progress: Callable[[float], None] | None = None,
+    resume: bool = False,
+) -> dict:
+    """
+    Converts a raw recording (.bin) into a chunked, compressed Zarr store, see
+    VB_recordings.create_zarr_recording for the layout.
+
+    The recording is read in chunks of chunk_samples packets per probe, remapped to
+    electrodes and summarized in the preview pyramid in this process. Compressing
+    and writing the chunks is done by a pool of max_workers processes, at most two
+    chunks per worker are waiting, which bounds the memory that is used. The
+    written chunks are recorded in a ConversionCheckpoint.
+
+    The arrays are sized once before the workers start, for more packets than the
+    file can hold, and trimmed after they are done: resizing rewrites the array
+    metadata, which fails on Windows while a worker has it open.
+
+    Arguments:
+    - rec_path: raw recording from NVP.setFileStream
+    - zarr_path: Zarr store that is created, an existing store is overwritten
+    unless the conversion is resumed
+    - probes: probes to convert
+    - remap: channel remap of the probes
+    - chunk_samples: number of samples per Zarr chunk
+    - progress: called with the fraction of the probes that is read
+    - resume: continue an interrupted conversion to zarr_path from its checkpoint.
+    The recording is read again up to the checkpoint to rebuild the previews, but
+    the chunks that were written aren't written again.
+
+    Returns the number of samples per probe, duration and throughput.
+    """
+    start_time = time.perf_counter()
+    checkpoint = ConversionCheckpoint.load(zarr_path, chunk_samples) if resume else None
+    if checkpoint is None:
+        create_zarr_recording(
+            zarr_path,
+            probes,
+            remap.num_channels,
+            chunk_samples,
+            {
+                "FREQ": FREQ,
+                "source": str(rec_path),
+                "electrode_mapping": remap.index.tolist(),
+                **(attrs or {}),
+            },
+            preview_factors=PREVIEW_FACTORS,
+        )
+        checkpoint = ConversionCheckpoint(zarr_path, chunk_samples)
+        checkpoint.save()
+    else:
+        logger.info(
+            f"Resuming conversion of {rec_path} at {checkpoint.samples} samples"
+        )
+    samples = {}
+    nbytes = 0
+    databuffer = np.empty((chunk_samples, NVP.CHANNEL_COUNT), dtype="int16")
+    timestamps = np.empty(chunk_samples, dtype="uint32")
+    max_workers = max_workers or os.cpu_count() or 1
+    # A packet has at least the samples of all channels
+    max_samples = os.path.getsize(rec_path) // (NVP.CHANNEL_COUNT * 2)
+    for probe in probes:
+        if probe not in checkpoint.complete:
+            resize_zarr_recording(zarr_path, probe, max_samples)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        max_in_flight = 2 * max_workers
+        # future: (probe, start, count) of the chunk it writes
+        pending: dict = {}
+
+        def collect(done) -> int:
+            # Only the chunks that were written are recorded, the first error is
+            # raised after the checkpoint is saved
+            nbytes, error = 0, None
+            for future in done:
+                chunk = pending.pop(future)
+                try:
+                    nbytes += future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                checkpoint.written(*chunk)
+            checkpoint.save()
+            if error is not None:
+                raise error
+            return nbytes
+
+        for i, probe in enumerate(probes):
+            if probe in checkpoint.complete:
+                samples[probe] = checkpoint.samples[probe]
+                logger.info(f"Probe {probe} of {rec_path} was already converted")
+                continue
+            written = checkpoint.samples.get(probe, 0)
+            if written:
+                # The previews are rebuilt from the start
+                clear_zarr_preview(zarr_path, probe)
+            start = 0
+            pyramid = PreviewPyramid(remap.num_channels)
+            with NVP.StreamReader(str(rec_path), probe, chunk_samples) as reader:
+                while True:
+                    count = reader.readinto(databuffer, timestamps)
+                    if count == 0:
+                        break
+                    # The arrays are copied, the buffers are reused while the
+                    # chunk waits to be sent to a worker
+                    data = remap.apply(databuffer[:count])
+                    append_zarr_preview(zarr_path, probe, pyramid.update(data))
+                    if start + count > written:
+                        if len(pending) >= max_in_flight:
+                            nbytes += collect(
+                                wait(pending, return_when=FIRST_COMPLETED).done
+                            )
+                        future = executor.submit(
+                            write_zarr_chunk,
+                            zarr_path,
+                            probe,
+                            start,
+                            data,
+                            timestamps[:count].copy(),
+                        )
+                        pending[future] = (probe, start, count)
+                    start += count
+                    if count < chunk_samples:
+                        break
+            samples[probe] = start
+            checkpoint.read(probe, start)
+            logger.info(f"Read {start} samples of probe {probe} from {rec_path}")
+            if progress:
+                progress((i + 1) / len(probes))
+        nbytes += collect(wait(pending).done)
+    for probe in probes:
+        resize_zarr_recording(zarr_path, probe, samples[probe])
+    checkpoint.remove()
+
+    duration = time.perf_counter() - start_time
+    return {
+        "samples": samples,
+        "duration": duration,
+        "realtime_factor": max(samples.values(), default=0) / FREQ / duration,
+        "bytes": nbytes,
+        "MB/s": nbytes / 1e6 / duration,
+    }
+
+
+def _count_packets(rec_path: str | Path, probe: int, chunk_samples: int) -> int:
+    count = 0
+    with NVP.StreamReader(str(rec_path), probe, chunk_samples) as reader:
+        while True:
+            read = len(reader.read()[0])
+            count += read
+            if read < chunk_samples:
+                return count
+
+
+def convert_to_sidecar(
+    rec_path: str | Path,
+    base_path: str | Path,
+    probes: list,
+    remap: ChannelRemap,
+    FREQ: int = 20000,
+    chunk_samples: int = 20000,
+    attrs: dict | None = None,
+    progress: Callable[[float], None] | None = None,
+) -> dict:
+    """
+    Converts a raw recording (.bin) into one memory-mappable recording per probe,
+    <base>_probe<probe>, see VB_recordings.create_sidecar for the files.
+
+    The file is read twice per probe: once to count the packets, so that the
+    channel-contiguous samples file can be allocated, and once to fill it. The
+    preview pyramid is written next to it, see VB_recordings.open_preview.
+
+    Returns the number of samples per probe, duration and throughput.
+    """
+    start_time = time.perf_counter()
+    base_path = Path(base_path)
+    samples = {}
+    databuffer = np.empty((chunk_samples, NVP.CHANNEL_COUNT), dtype="int16")
+    for i, probe in enumerate(probes):
+        total = _count_packets(rec_path, probe, chunk_samples)
+        data, timestamps = create_sidecar(
+            base_path.with_name(f"{base_path.stem}_probe{probe}"),
+            remap.num_channels,
+            total,
+            {
+                "FREQ": FREQ,
+                "probe": probe,
+                "source": str(rec_path),
+                "electrode_mapping": remap.index.tolist(),
+                **(attrs or {}),
+            },
+        )
+        start = 0
+        pyramid = PreviewPyramid(remap.num_channels)
+        with ExitStack() as stack:
+            reader = stack.enter_context(
+                NVP.StreamReader(str(rec_path), probe, chunk_samples)
+            )
+            previews = {
+                factor: stack.enter_context(
+                    open(preview_path(base_path, probe, factor), "wb")
+                )
+                for factor in PREVIEW_FACTORS
+            }
+            while start < total:
+                count = reader.readinto(
+                    databuffer[: total - start], timestamps[start:]
+                )
+                if count == 0:
+                    break
+                data[:, start : start + count] = remap.apply(databuffer[:count])
+                for factor, bins in pyramid.update(
+                    data[:, start : start + count]
+                ).items():
+                    previews[factor].write(bins.tobytes())
+                start += count
+        data.flush()
+        timestamps.flush()
+        del data, timestamps
+        samples[probe] = start
+        logger.info(f"Wrote {start} samples of probe {probe} from {rec_path}")
+        if progress:
+            progress((i + 1) / len(probes))
+
+    duration = time.perf_counter() - start_time
+    nbytes = sum(samples.values()) * (remap.num_channels * 2 + 4)
+    return {
+        "samples": samples,
+        "duration": duration,
+        "realtime_factor": max(samples.values(), default=0) / FREQ / duration,
+        "MB/s": nbytes / 1e6 / duration,
+    }
+
+
+def scan_recording(
+    rec_path: str | Path,
+    probe: int,
+    chunk_samples: int = 20000,
+    status_mask: int = 0,
+) -> IntegrityScanner:
+    """Checks the packet headers of probe in a raw recording (.bin) for dropped
+    packets, zero timestamps and wrong session ids, see IntegrityScanner."""
+    scanner = IntegrityScanner(status_mask=status_mask)
+    with NVP.StreamReader(str(rec_path), probe, chunk_samples) as reader:
+        while True:
+            timestamps, status, session_id, _ = reader.read()
+            scanner.update(timestamps, status, session_id)
+            if len(timestamps) < chunk_samples:
+                break
+    logger.info(f"Scanned probe {probe} of {rec_path}: {scanner.summary()}")
+    return scanner
+
+
+def build_time_index(
+    rec_path: str | Path,
+    probe: int,
+    chunk_samples: int = 20000,
+    stride: int = 20000,
+) -> TimeIndex:
+    """Builds the time index of probe of a raw recording (.bin) and saves it next
+    to the recording, see VB_recordings.index_path."""
+    index = TimeIndex(stride)
+    with NVP.StreamReader(str(rec_path), probe, chunk_samples) as reader:
+        while True:
+            timestamps = reader.read()[0]
+            index.update(timestamps)
+            if len(timestamps) < chunk_samples:
+                break
+    index.save(index_path(rec_path, probe))
+    return index
+
+
+def read_samples(
+    rec_path: str | Path,
+    probe: int,
+    start: int,
+    stop: int,
+    chunk_samples: int = 20000,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads packets start:stop of probe from a raw recording (.bin).
+
+    The API has no seek, so the packets before start are read in chunks and
+    dropped without being converted.
+
+    Returns (timestamps, data) with data of shape (stop - start, 64).
+    """
+    data = np.empty((max(stop - start, 0), NVP.CHANNEL_COUNT), dtype="int16")
+    timestamps = np.empty(len(data), dtype="uint32")
+    with NVP.StreamReader(str(rec_path), probe, chunk_samples) as reader:
+        skipped = 0
+        while skipped < start:
+            read = len(reader.read(min(chunk_samples, start - skipped))[0])
+            if read == 0:
+                break
+            skipped += read
+        count = 0
+        while count < len(data):
+            read = reader.readinto(data[count:], timestamps[count:])
+            if read == 0:
+                break
+            count += read
+    return timestamps[:count], data[:count]
+
+
+def zarr_outputs(rec_path: str | Path) -> list:
+    """Returns the paths of the Zarr conversions of a raw recording: <name>.zarr
+    and the <name>_bundle.zarr of the background jobs."""
+    rec_path = Path(rec_path)
+    return [
+        rec_path.with_suffix(".zarr"),
+        rec_path.with_name(f"{rec_path.stem}_bundle.zarr"),
+    ]
+
+
+def open_converted(rec_path: str | Path, probe: int) -> tuple | None:
+    """
+    Opens probe of a finished conversion of a raw recording, in its default place
+    next to it: the memmap files (<name>_probe<probe>), <name>.zarr or
+    <name>_bundle.zarr.
+
+    Returns the data (channels, samples) and timestamps, which are only read where
+    they are sliced, or None if probe isn't converted.
+    """
+    rec_path = Path(rec_path)
+    sidecar = sidecar_paths(rec_path.with_name(f"{rec_path.stem}_probe{probe}"))
+    if sidecar["header"].exists():
+        data, timestamps, _ = open_sidecar(sidecar["header"])
+        return data, timestamps
+    if zarr is None:
+        return None
+    for zarr_path in zarr_outputs(rec_path):
+        if zarr_path.exists() and not checkpoint_path(zarr_path).exists():
+            arrays = open_zarr_recording(zarr_path, probe)
+            if arrays is not None:
+                return arrays
+    return None
+
+
+def _scan_time_range(
+    rec_path: str | Path,
+    probe: int,
+    start_time: float,
+    stop_time: float,
+    FREQ: int = 20000,
+    chunk_samples: int = 20000,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Reads the packets of probe in a time range from a raw recording in one pass,
+    without a time index, up to the first packet after the range."""
+    kept_timestamps, kept_data = [], []
+    with NVP.StreamReader(str(rec_path), probe, chunk_samples) as reader:
+        while True:
+            timestamps, _, _, data = reader.read()
+            if len(timestamps) == 0:
+                break
+            if not kept_timestamps:
+                first = int(timestamps[0])
+                low = first + round(start_time * FREQ)
+                high = first + round(stop_time * FREQ)
+            keep = (timestamps >= low) & (timestamps < high)
+            kept_timestamps.append(timestamps[keep])
+            kept_data.append(data[keep])
+            if timestamps[-1] >= high or len(timestamps) < chunk_samples:
+                break
+    if not kept_timestamps:
+        return np.empty(0, "uint32"), np.empty((0, NVP.CHANNEL_COUNT), "int16")
+    return np.concatenate(kept_timestamps), np.concatenate(kept_data)
+
+
+def read_time_range(
+    rec_path: str | Path,
+    probe: int,
+    start_time: float,
+    stop_time: float,
+    FREQ: int = 20000,
+    remap: ChannelRemap | None = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads the samples of probe between start_time and stop_time (seconds from the
+    first packet) of a raw recording.
+
+    If the recording is converted (see open_converted), only the range is read
+    from the conversion: the packet offsets are looked up in the time index, or
+    without one by binary search in the converted timestamps. Otherwise the
+    packets are read from the raw recording, which the API can't seek in, up to
+    the range: with the time index up to its offsets, without it in one pass
+    that keeps the packets in the range.
+
+    Returns (timestamps, data) with data of shape (channels, samples): the
+    electrodes of the conversion, or of the raw packets remapped with remap, all
+    64 channels without it.
+    """
+    converted = open_converted(rec_path, probe)
+    path = index_path(rec_path, probe)
+    if path.exists():
+        start, stop = TimeIndex.load(path).sample_range(start_time, stop_time, FREQ)
+        if converted is not None:
+            data, timestamps = converted
+            return timestamps[start:stop], data[:, start:stop]
+        timestamps, data = read_samples(rec_path, probe, start, stop)
+    elif converted is not None:
+        data, timestamps = converted
+        if len(timestamps) == 0:
+            return timestamps[:0], data[:, :0]
+        first = int(timestamps[0])
+        start = bisect.bisect_left(timestamps, first + round(start_time * FREQ))
+        stop = bisect.bisect_left(timestamps, first + round(stop_time * FREQ))
+        return timestamps[start:stop], data[:, start:stop]
+    else:
+        timestamps, data = _scan_time_range(
+            rec_path, probe, start_time, stop_time, FREQ
+        )
+    if remap is None:
+        return timestamps, data.T
+    return timestamps, remap.apply(data)
+
+
+def write_bundle(
+    rec_path: str | Path,
+    bundle_path: str | Path,
+    probes: list,
+    remap: ChannelRemap,
+    FREQ: int = 20000,
+    stimrec_path: str | Path | None = None,
+    settings: dict | None = None,
+    attrs: dict | None = None,
+    progress: Callable[[float], None] | None = None,
+    resume: bool = False,
+) -> dict:
+    """
+    Writes a recording bundle: a Zarr store with the samples of every probe (see
+    convert_to_zarr), the settings snapshot in its attributes and the events of
+    the stimulation record on the sample clock of the recording in the group
+    events (see VB_recordings.events_to_samples).
+
+    Returns the statistics of convert_to_zarr and the number of events.
+    """
+    stats = convert_to_zarr(
+        rec_path,
+        bundle_path,
+        probes,
+        remap,
+        FREQ,
+        attrs={**(attrs or {}), "settings": settings or {}},
+        progress=progress,
+        resume=resume,
+    )
+    events = read_stimrec_events(stimrec_path) if stimrec_path else []
+    arrays, names = events_to_samples(events, FREQ)
+    write_zarr_events(
+        bundle_path, arrays, names, {"stimrec": str(stimrec_path or "")}
+    )
+    return {**stats, "events": len(events)}
+
+
+def convert_recording(
+    rec_path: str | Path,
+    output_path: str | Path,
+    output_format: str,
+    probes: list,
+    electrode_mapping: dict,
+    FREQ: int = 20000,
+    num_channels: int = 60,
+    stimrec_path: str | Path | None = None,
+    settings: dict | None = None,
+    attrs: dict | None = None,
+    progress: Callable[[float], None] | None = None,
+    resume: bool = False,
+) -> dict:
+    """
+    Converts a raw recording to output_format: 'zarr' (convert_to_zarr), 'memmap'
+    (convert_to_sidecar) or 'bundle' (write_bundle). Takes the electrode mapping
+    instead of a ChannelRemap, so that the arguments can be stored as JSON, see
+    VB_jobs.JobQueue. resume only applies to the Zarr formats.
+    """
+    remap = ChannelRemap(electrode_mapping, num_channels)
+    if output_format == "zarr":
+        return convert_to_zarr(
+            rec_path,
+            output_path,
+            probes,
+            remap,
+            FREQ,
+            attrs=attrs,
+            progress=progress,
+            resume=resume,
+        )
+    if output_format == "memmap":
+        return convert_to_sidecar(
+            rec_path, output_path, probes, remap, FREQ, attrs=attrs, progress=progress
+        )
+    if output_format == "bundle":
+        return write_bundle(
+            rec_path,
+            output_path,
+            probes,
+            remap,
+            FREQ,
+            stimrec_path=stimrec_path,
+            settings=settings,
+            attrs=attrs,
+            progress=progress,
+            resume=resume,
+        )
+    raise ValueError("output_format must be 'zarr', 'memmap' or 'bundle'")
+
+
+def find_unconverted(folder: str | Path) -> list:
+    """Returns the raw recordings (.bin) in folder, oldest first, that don't have a
+    Zarr conversion (<name>.zarr or the <name>_bundle.zarr of the background jobs)
+    or of which the conversion was interrupted."""
+    unconverted = []
+    for rec_path in sorted(Path(folder).glob("*.bin"), key=os.path.getmtime):
+        if not any(
+            output.exists() and not checkpoint_path(output).exists()
+            for output in zarr_outputs(rec_path)
+        ):
+            unconverted.append(rec_path)
+    return unconverted
+
+
+def recorded_probes(rec_path: str | Path, probes=range(4)) -> list:
+    """Returns the probes that have packets in a raw recording."""
+    recorded = []
+    for probe in probes:
+        with NVP.StreamReader(str(rec_path), probe, 1) as reader:
+            if len(reader.read()[0]):
+                recorded.append(probe)
+    return recorded
+
+
+def _load_jobs(jobs_path: str | Path) -> list:
+    """Returns the jobs in the JSON file of a VB_jobs.JobQueue, none if it doesn't
+    exist."""
+    try:
+        return json.loads(Path(jobs_path).read_text())
+    except (OSError, ValueError):
+        return []
+
+
+def _convert_recording(
+    rec_path: Path,
+    remap: ChannelRemap,
+    chunk_samples: int,
+    max_workers: int,
+    jobs: list,
+) -> Tuple[list, dict | None]:
+    """
+    Converts the recorded probes of rec_path for main, returns the probes and the
+    stats, None if there are no packets.
+
+    An interrupted conversion is resumed in the store that has the checkpoint: an
+    interrupted <name>_bundle.zarr of a background job with the arguments of that
+    job, so that it also gets its events, otherwise <name>.zarr.
+    """
+    probes = recorded_probes(rec_path)
+    if not probes:
+        return probes, None
+    zarr_path, bundle_path = zarr_outputs(rec_path)
+    if (
+        checkpoint_path(bundle_path).exists()
+        and not checkpoint_path(zarr_path).exists()
+    ):
+        bundle_jobs = [
+            job["args"]
+            for job in jobs
+            if job["kind"] == "convert"
+            and Path(job["args"]["output_path"]).resolve() == bundle_path.resolve()
+        ]
+        if bundle_jobs:
+            job_args = {**bundle_jobs[-1], "resume": True}
+            return job_args["probes"], convert_recording(**job_args)
+        logger.warning(
+            f"No job of {bundle_path}, only its samples are converted, not its events"
+        )
+        zarr_path = bundle_path
+    return probes, convert_to_zarr(
+        rec_path,
+        zarr_path,
+        probes,
+        remap,
+        chunk_samples=chunk_samples,
+        max_workers=max_workers,
+        attrs={"recording_name": rec_path.stem},
+        resume=True,
+    )
+
+
+def main(argv: list | None = None) -> None:
+    """Converts the recordings in a folder that aren't converted yet, see
+    python VB_convert.py --help."""
+    parser = argparse.ArgumentParser(
+        description="Converts the raw recordings (.bin) in a folder that aren't "
+        "converted yet to Zarr (<name>.zarr). Interrupted conversions are resumed "
+        "from their checkpoint. Recordings that a background job of ViperBox is "
+        "converting are skipped."
+    )
+    parser.add_argument("folder", nargs="?", default="Recordings")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of processes that compress and write chunks",
+    )
+    parser.add_argument(
+        "-r",
+        "--recordings",
+        type=int,
+        default=2,
+        help="number of recordings that are converted at the same time, the "
+        "workers are divided between them",
+    )
+    parser.add_argument(
+        "--mapping", default="defaults/electrode_mapping_short_cables.xlsx"
+    )
+    parser.add_argument("--chunk-samples", type=int, default=20000)
+    parser.add_argument(
+        "--jobs",
+        help="JSON file of the background jobs of ViperBox, by default jobs.json "
+        "in the folder",
+    )
+    args = parser.parse_args(argv)
+
+    remap = ChannelRemap(Mappings(args.mapping).electrode_mapping)
+    jobs = _load_jobs(args.jobs or Path(args.folder) / "jobs.json")
+    # Conversions that a background job will do or is doing
+    converting = {
+        Path(job["args"]["rec_path"]).resolve()
+        for job in jobs
+        if job["kind"] == "convert" and job["state"] in ("queued", "running")
+    }
+    recordings = []
+    for rec_path in find_unconverted(args.folder):
+        if rec_path.resolve() in converting:
+            print(f"{rec_path.name}: converted by a background job, skipped")
+        else:
+            recordings.append(rec_path)
+    print(f"Converting {len(recordings)} recordings in {args.folder}")
+    start_time = time.perf_counter()
+    nbytes = 0
+    failed = 0
+    # Reading and remapping a recording is done in this process, so recordings
+    # are converted at the same time to keep the workers busy
+    parallel = max(1, min(args.recordings, len(recordings)))
+    max_workers = max(1, (args.workers or 1) // parallel)
+    with ThreadPoolExecutor(parallel, thread_name_prefix="convert") as executor:
+        futures = {
+            executor.submit(
+                _convert_recording,
+                rec_path,
+                remap,
+                args.chunk_samples,
+                max_workers,
+                jobs,
+            ): rec_path
+            for rec_path in recordings
+        }
+        for i, future in enumerate(as_completed(futures)):
+            rec_path = futures[future]
+            try:
+                probes, stats = future.result()
+            except Exception as e:
+                # The other recordings are still converted
+                failed += 1
+                logger.error(
+                    f"Conversion of {rec_path} failed: {traceback.format_exc()}"
+                )
+                print(f"[{i + 1}/{len(recordings)}] {rec_path.name}: failed, {e!r}")
+                continue
+            if stats is None:
+                print(
+                    f"[{i + 1}/{len(recordings)}] {rec_path.name}: no packets, "
+                    "skipped"
+                )
+                continue
+            nbytes += stats["bytes"]
+            print(
+                f"[{i + 1}/{len(recordings)}] {rec_path.name}: probes {probes}, "
+                f"{stats['duration']:.1f} s, {stats['MB/s']:.1f} MB/s, total "
+                f"{nbytes / 1e6 / (time.perf_counter() - start_time):.1f} MB/s"
+            )
+    if failed:
+        print(f"{failed} of {len(recordings)} conversions failed, see the log")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import psutil
+
+from VB_convert import build_time_index, convert_recording, scan_recording
+
+logger = logging.getLogger("VB_jobs")
+logger.setLevel(logging.DEBUG)
+socketHandler = logging.handlers.SocketHandler(
+    "localhost", logging.handlers.DEFAULT_TCP_LOGGING_PORT
+)
+logger.addHandler(socketHandler)
+
+
+def _scan_probes(
+    rec_path: str, probes: list, progress: Callable[[float], None] | None = None
+) -> dict:
+    """Runs the integrity scan of every probe, see VB_convert.scan_recording."""
+    summaries = {}
+    for i, probe in enumerate(probes):
+        summaries[str(probe)] = scan_recording(rec_path, probe).summary()
+        if progress:
+            progress((i + 1) / len(probes))
+    return summaries
+
+
+def _index_probes(
+    rec_path: str, probes: list, progress: Callable[[float], None] | None = None
+) -> dict:
+    """Builds the time index of every probe, see VB_convert.build_time_index."""
+    packets = {}
+    for i, probe in enumerate(probes):
+        packets[str(probe)] = build_time_index(rec_path, probe).packets
+        if progress:
+            progress((i + 1) / len(probes))
+    return packets
+
+
+# Functions that can run as a job, by kind. They are called with the arguments of
+# the job and progress, a function that takes the fraction that is done, and
+# return something that can be stored as JSON.
+JOB_FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    "convert": convert_recording,
+    "scan": _scan_probes,
+    "index": _index_probes,
+}
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+@dataclass
+class Job:
+    """A job of the JobQueue, lower priority values run first."""
+
+    id: int
+    kind: str
+    args: dict
+    priority: int = 0
+    state: str = QUEUED
+    progress: float = 0.0
+    result: Any = None
+    created: float = 0.0
+    started: float | None = None
+    finished: float | None = None
+
+
+def _lower_priority() -> None:
+    """Lowers the CPU and disk priority of this process, so that acquisition and
+    streaming are not slowed down by the job. Child processes inherit it."""
+    process = psutil.Process()
+    try:
+        if os.name == "nt":
+            process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+            process.ionice(psutil.IOPRIO_LOW)
+        else:
+            process.nice(10)
+            process.ionice(psutil.IOPRIO_CLASS_IDLE)
+    except (AttributeError, psutil.Error) as e:
+        # ionice is not available on every platform
+        logger.debug(f"Couldn't lower the priority of job process: {e}")
+
+
+def _run_job(job_id: int, kind: str, args: dict, messages) -> None:
+    """Target of the job processes, reports progress and the result to messages."""
+    _lower_priority()
+
+    def progress(fraction: float) -> None:
+        messages.put((job_id, "progress", fraction))
+
+    try:
+        result = JOB_FUNCTIONS[kind](**args, progress=progress)
+        messages.put((job_id, DONE, result))
+    except Exception:
+        messages.put((job_id, FAILED, traceback.format_exc()))
+
+
+def _process_tree(process: multiprocessing.Process) -> List[psutil.Process]:
+    try:
+        parent = psutil.Process(process.pid)
+        return [parent, *parent.children(recursive=True)]
+    except psutil.NoSuchProcess:
+        return []
+
+
+def _kill(process: multiprocessing.Process) -> None:
+    """Kills a job process and the processes it started."""
+    for child in reversed(_process_tree(process)):
+        try:
+            child.kill()
+        except psutil.NoSuchProcess:
+            pass
+    process.join()
+
+
+class JobQueue:
+    """
+    Persistent queue of background jobs, like converting a recording after it is
+    stopped.
+
+    The jobs are stored in a JSON file, jobs that were queued or running when the
+    program stopped are queued again when the file is loaded. A dispatcher thread
+    starts the queued jobs by priority, each in its own process with lowered CPU
+    and disk priority, at most max_workers at a time. While the queue is paused,
+    e.g. during a recording, no jobs are started and the running jobs are
+    suspended.
+
+    Arguments:
+    - path: JSON file of the jobs
+    - max_workers: maximum number of jobs that run at the same time
+    - poll_interval: seconds between checks of the job processes
+    """
+
+    def __init__(self, path: str | Path, max_workers: int = 1, poll_interval=0.2):
+        self.path = Path(path)
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.jobs: Dict[int, Job] = {}
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._messages: Any = multiprocessing.Queue()
+        self._lock = threading.Lock()
+        self._paused = False
+        self._load()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            jobs = json.loads(self.path.read_text())
+        except (OSError, ValueError) as e:
+            logger.error(f"Couldn't load jobs from {self.path}: {e}")
+            return
+        for fields in jobs:
+            job = Job(**fields)
+            if job.state == RUNNING:
+                job.state = QUEUED
+                job.progress = 0.0
+            self.jobs[job.id] = job
+        logger.info(f"Loaded {len(self.jobs)} jobs from {self.path}")
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps([asdict(job) for job in self.jobs.values()], indent=2)
+        )
+        os.replace(tmp_path, self.path)
+
+    def submit(self, kind: str, args: dict, priority: int = 0) -> Job:
+        """Queues a job of one of the kinds of JOB_FUNCTIONS, args must be
+        JSON serializable."""
+        if kind not in JOB_FUNCTIONS:
+            raise ValueError(f"kind must be one of {list(JOB_FUNCTIONS)}")
+        with self._lock:
+            job = Job(
+                id=max(self.jobs, default=0) + 1,
+                kind=kind,
+                args=json.loads(json.dumps(args, default=str)),
+                priority=priority,
+                created=time.time(),
+            )
+            self.jobs[job.id] = job
+            self._save()
+        logger.info(f"Queued job {job.id}: {job.kind} {job.args}")
+        return job
+
+    def cancel(self, job_id: int) -> Tuple[bool, str]:
+        """Cancels a queued job or stops a running job."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False, f"Job {job_id} doesn't exist"
+            if job.state not in [QUEUED, RUNNING]:
+                return False, f"Job {job_id} is already {job.state}"
+            if job_id in self._processes:
+                _kill(self._processes.pop(job_id))
+            job.state = CANCELLED
+            job.finished = time.time()
+            self._save()
+        logger.info(f"Cancelled job {job_id}")
+        return True, f"Job {job_id} cancelled"
+
+    def pause(self) -> None:
+        """Stops starting jobs and suspends the running jobs."""
+        with self._lock:
+            self._paused = True
+            self._signal_processes("suspend")
+
+    def resume(self) -> None:
+        """Resumes the running jobs and starts starting queued jobs again."""
+        with self._lock:
+            self._paused = False
+            self._signal_processes("resume")
+
+    def _signal_processes(self, action: str) -> None:
+        for process in self._processes.values():
+            for child in _process_tree(process):
+                try:
+                    getattr(child, action)()
+                except psutil.NoSuchProcess:
+                    pass
+
+    def list_jobs(self) -> List[dict]:
+        """Returns all jobs, newest first."""
+        with self._lock:
+            return [asdict(self.jobs[job_id]) for job_id in sorted(self.jobs)[::-1]]
+
+    def get_job(self, job_id: int) -> dict | None:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return asdict(job) if job else None
+
+    def close(self) -> None:
+        """Stops the dispatcher and the running jobs, which are queued again the
+        next time the jobs are loaded."""
+        self._stop_event.set()
+        self._thread.join()
+        with self._lock:
+            for job_id, process in self._processes.items():
+                _kill(process)
+                self.jobs[job_id].state = QUEUED
+                self.jobs[job_id].progress = 0.0
+            self._processes.clear()
+            self._save()
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            # Processes that exited have put all their messages in the queue
+            exited = [
+                job_id
+                for job_id, process in self._processes.items()
+                if not process.is_alive()
+            ]
+            try:
+                self._handle_message(self._messages.get(timeout=self.poll_interval))
+                while True:
+                    self._handle_message(self._messages.get_nowait())
+            except queue.Empty:
+                pass
+            with self._lock:
+                for job_id in exited:
+                    process = self._processes.pop(job_id, None)
+                    if process is None:
+                        continue
+                    process.join()
+                    job = self.jobs[job_id]
+                    if job.state == RUNNING:
+                        job.state = FAILED
+                        job.result = f"Job process exited with code {process.exitcode}"
+                        job.finished = time.time()
+                        logger.error(f"Job {job_id} failed: {job.result}")
+                        self._save()
+                self._start_jobs()
+
+    def _handle_message(self, message: tuple) -> None:
+        job_id, kind, value = message
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state != RUNNING:
+                return
+            if kind == "progress":
+                job.progress = value
+                return
+            job.state = kind
+            job.result = value
+            job.finished = time.time()
+            if kind == DONE:
+                job.progress = 1.0
+                logger.info(f"Job {job_id} done: {value}")
+            else:
+                logger.error(f"Job {job_id} failed: {value}")
+            self._save()
+
+    def _start_jobs(self) -> None:
+        if self._paused:
+            return
+        queued = sorted(
+            (job for job in self.jobs.values() if job.state == QUEUED),
+            key=lambda job: (job.priority, job.id),
+        )
+        for job in queued[: self.max_workers - len(self._processes)]:
+            process = multiprocessing.Process(
+                target=_run_job,
+                args=(job.id, job.kind, job.args, self._messages),
+                name=f"job-{job.id}",
+            )
+            process.start()
+            self._processes[job.id] = process
+            job.state = RUNNING
+            job.started = time.time()
+            logger.info(f"Started job {job.id}: {job.kind}")
+            self._save()
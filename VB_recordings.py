@@ -0,0 +1,765 @@
+import json
+import logging
+import logging.handlers
+import struct
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+try:
+    import zarr
+    from numcodecs import Blosc
+except ImportError:
+    zarr = None
+
+logger = logging.getLogger("VB_recordings")
+logger.setLevel(logging.DEBUG)
+socketHandler = logging.handlers.SocketHandler(
+    "localhost", logging.handlers.DEFAULT_TCP_LOGGING_PORT
+)
+logger.addHandler(socketHandler)
+
+
+def _require_zarr() -> None:
+    if zarr is None:
+        raise ImportError("Zarr output needs the zarr package: pip install 'zarr<3'")
+
+
+def create_zarr_recording(
+    zarr_path: str | Path,
+    probes: list,
+    num_channels: int,
+    chunk_samples: int,
+    attrs: dict | None = None,
+    clevel: int = 5,
+    preview_factors: tuple = (),
+) -> None:
+    """
+    Creates an empty Zarr store for a converted recording, with for every probe a
+    group probe_<probe> that contains:
+    - data: int16 (num_channels, samples), chunked per chunk_samples samples
+    - timestamps: uint32 (samples,), the Timestamp of every packet
+    - preview_<factor>: PREVIEW_DTYPE (bins, num_channels) for every factor of
+    preview_factors, see PreviewPyramid
+
+    Data and timestamps start with 0 samples and are sized with
+    resize_zarr_recording, the previews are grown by append_zarr_preview.
+    The chunks are compressed with zstd after a byte shuffle.
+    """
+    _require_zarr()
+    compressor = Blosc(cname="zstd", clevel=clevel, shuffle=Blosc.SHUFFLE)
+    root = zarr.open_group(str(zarr_path), mode="w")
+    root.attrs.update(attrs or {})
+    for probe in probes:
+        group = root.create_group(f"probe_{probe}")
+        group.create_dataset(
+            "data",
+            shape=(num_channels, 0),
+            chunks=(num_channels, chunk_samples),
+            dtype="int16",
+            compressor=compressor,
+        )
+        group.create_dataset(
+            "timestamps",
+            shape=(0,),
+            chunks=(chunk_samples,),
+            dtype="uint32",
+            compressor=compressor,
+        )
+        for factor in preview_factors:
+            group.create_dataset(
+                f"preview_{factor}",
+                shape=(0, num_channels),
+                chunks=(max(chunk_samples // 10, 1), num_channels),
+                dtype=PREVIEW_DTYPE,
+                compressor=compressor,
+            )
+
+
+def open_zarr_recording(zarr_path: str | Path, probe: int) -> tuple | None:
+    """Returns the data (channels, samples) and timestamps arrays of probe in a
+    Zarr recording, which are only read where they are sliced, or None if the
+    recording doesn't have probe."""
+    _require_zarr()
+    root = zarr.open_group(str(zarr_path), mode="r")
+    if f"probe_{probe}" not in root:
+        return None
+    group = root[f"probe_{probe}"]
+    return group["data"], group["timestamps"]
+
+
+def resize_zarr_recording(zarr_path: str | Path, probe: int, samples: int) -> None:
+    """Sets the number of samples of the arrays of probe."""
+    _require_zarr()
+    group = zarr.open_group(str(zarr_path), mode="r+")[f"probe_{probe}"]
+    group["data"].resize(group["data"].shape[0], samples)
+    group["timestamps"].resize(samples)
+
+
+def write_zarr_chunk(
+    zarr_path: str | Path,
+    probe: int,
+    start: int,
+    data: np.ndarray,
+    timestamps: np.ndarray,
+) -> int:
+    """Compresses and writes the samples from start of probe. start has to be a
+    multiple of the chunk size, so that concurrent writers never write to the same
+    chunk. The arrays have to be resized to include the samples first.
+
+    Runs in the worker processes of the converter, returns the number of bytes of
+    samples written."""
+    _require_zarr()
+    group = zarr.open_group(str(zarr_path), mode="r+")[f"probe_{probe}"]
+    stop = start + data.shape[1]
+    group["data"][:, start:stop] = data
+    group["timestamps"][start:stop] = timestamps
+    return data.nbytes + timestamps.nbytes
+
+
+SIDECAR_VERSION = 1
+
+
+def sidecar_paths(base_path: str | Path) -> dict:
+    """Returns the paths of the files of a sidecar recording: the JSON header, the
+    samples and the timestamps."""
+    base_path = Path(base_path)
+    return {
+        "header": base_path.with_suffix(".json"),
+        "data": base_path.with_suffix(".dat"),
+        "timestamps": base_path.with_name(base_path.stem + "_timestamps.npy"),
+    }
+
+
+def create_sidecar(
+    base_path: str | Path,
+    num_channels: int,
+    samples: int,
+    attrs: dict | None = None,
+) -> tuple:
+    """
+    Creates a memory-mappable recording of one probe:
+    - <base>.json: header with the shape, dtype and attrs (rate, gain, mapping)
+    - <base>.dat: flat int16 samples, channel-contiguous (num_channels, samples)
+    - <base>_timestamps.npy: uint32 Timestamp of every sample
+
+    Returns writable memmaps of the samples and the timestamps.
+    """
+    paths = sidecar_paths(base_path)
+    header = {
+        "version": SIDECAR_VERSION,
+        "dtype": "int16",
+        "order": "C",
+        "shape": [num_channels, samples],
+        "data_file": paths["data"].name,
+        "timestamps_file": paths["timestamps"].name,
+        **(attrs or {}),
+    }
+    paths["header"].write_text(json.dumps(header, indent=2))
+    data = np.memmap(
+        paths["data"], dtype="int16", mode="w+", shape=(num_channels, max(samples, 1))
+    )[:, :samples]
+    timestamps = np.lib.format.open_memmap(
+        paths["timestamps"], mode="w+", dtype="uint32", shape=(samples,)
+    )
+    return data, timestamps
+
+
+def open_sidecar(path: str | Path, mode: str = "r") -> tuple:
+    """
+    Opens a recording that was written by create_sidecar, without reading it.
+
+    Arguments:
+    - path: the header (.json) or any path with the same base name
+
+    Returns (data, timestamps, header): data is a memmap of shape (channels,
+    samples), so data[:, start:stop] only reads that time window.
+    """
+    paths = sidecar_paths(path)
+    header = json.loads(paths["header"].read_text())
+    if header["version"] > SIDECAR_VERSION:
+        raise ValueError(f"Unsupported sidecar version {header['version']}")
+    shape = tuple(header["shape"])
+    data = np.memmap(
+        paths["header"].with_name(header["data_file"]),
+        dtype=header["dtype"],
+        mode=mode,
+        shape=(shape[0], max(shape[1], 1)),
+        order=header["order"],
+    )[:, : shape[1]]
+    timestamps = np.load(
+        paths["header"].with_name(header["timestamps_file"]), mmap_mode=mode
+    )
+    return data, timestamps, header
+
+
+# Kinds of anomalies of IntegrityScanner
+GAP = 0  # packets missing before start, Timestamp jumped forward
+BACKWARDS = 1  # Timestamp repeated or went back at start
+ZERO_TIMESTAMP = 2  # packets start:stop have Timestamp 0
+SESSION = 3  # packets start:stop have another session id
+STATUS = 4  # packets start:stop have a status bit of status_mask set
+ANOMALY_KINDS = ["gap", "backwards", "zero_timestamp", "session", "status"]
+
+ANOMALY_DTYPE = np.dtype(
+    [("kind", "u1"), ("start", "i8"), ("stop", "i8"), ("missing", "i8")]
+)
+
+
+def _mask_ranges(mask: np.ndarray, kind: int, offset: int) -> np.ndarray:
+    """Returns the runs of True in mask as anomalies."""
+    edges = np.diff(mask.view("i1"), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ranges = np.zeros(len(starts), dtype=ANOMALY_DTYPE)
+    ranges["kind"] = kind
+    ranges["start"] = starts + offset
+    ranges["stop"] = np.flatnonzero(edges == -1) + offset
+    return ranges
+
+
+class IntegrityScanner:
+    """
+    Finds dropped packets and packets with a wrong header in a recording or
+    stream, block by block. Every block is checked with a few vectorized NumPy
+    operations over its headers.
+
+    The anomalies are kept as a compact index of packet ranges, see ANOMALY_DTYPE:
+    kind (see ANOMALY_KINDS), start and stop packet (index in the stream), and
+    for gaps the number of missing packets.
+
+    Arguments:
+    - session_id: expected session id, by default that of the first packet
+    - status_mask: status bits that mark a packet as faulty
+    """
+
+    def __init__(self, session_id: int | None = None, status_mask: int = 0):
+        self.session_id = session_id
+        self.status_mask = status_mask
+        self.packets = 0
+        self._last_timestamp: int | None = None
+        self._ranges: List[np.ndarray] = []
+
+    def update(
+        self,
+        timestamps: np.ndarray,
+        status: np.ndarray | None = None,
+        session_id: np.ndarray | None = None,
+    ) -> int:
+        """Checks the headers of the next block of packets, returns the number of
+        anomalies found in it."""
+        n = len(timestamps)
+        if n == 0:
+            return 0
+        offset = self.packets
+        timestamps = timestamps.astype("i8")
+        previous = timestamps[0] - 1
+        if self._last_timestamp is not None:
+            previous = self._last_timestamp
+        step = np.diff(timestamps, prepend=previous)
+        zero = timestamps == 0
+        # Zero timestamps are reported as such, not as the jumps around them
+        valid = ~(zero | np.concatenate(([False], zero[:-1])))
+        if self._last_timestamp == 0:
+            valid[0] = False
+        found = []
+        gaps = np.flatnonzero((step > 1) & valid)
+        gap_ranges = np.zeros(len(gaps), dtype=ANOMALY_DTYPE)
+        gap_ranges["kind"] = GAP
+        gap_ranges["start"] = gap_ranges["stop"] = gaps + offset
+        gap_ranges["missing"] = step[gaps] - 1
+        found.append(gap_ranges)
+        found.append(_mask_ranges((step < 1) & valid, BACKWARDS, offset))
+        found.append(_mask_ranges(zero, ZERO_TIMESTAMP, offset))
+        if session_id is not None:
+            if self.session_id is None:
+                self.session_id = int(session_id[0])
+            found.append(_mask_ranges(session_id != self.session_id, SESSION, offset))
+        if status is not None and self.status_mask:
+            found.append(
+                _mask_ranges((status & self.status_mask) != 0, STATUS, offset)
+            )
+        found = np.concatenate(found)
+        if len(found):
+            self._ranges.append(found)
+        self.packets += n
+        self._last_timestamp = int(timestamps[-1])
+        return len(found)
+
+    def index(self) -> np.ndarray:
+        """Returns the anomalies sorted by kind and start, ranges that continue
+        over the border of two blocks are merged."""
+        if not self._ranges:
+            return np.zeros(0, dtype=ANOMALY_DTYPE)
+        ranges = np.concatenate(self._ranges)
+        ranges = ranges[np.lexsort((ranges["start"], ranges["kind"]))]
+        join = (
+            (ranges["kind"][1:] == ranges["kind"][:-1])
+            & (ranges["start"][1:] == ranges["stop"][:-1])
+            & (ranges["kind"][1:] != GAP)
+        )
+        first = np.flatnonzero(np.concatenate(([True], ~join)))
+        merged = ranges[first].copy()
+        merged["stop"] = np.maximum.reduceat(ranges["stop"], first)
+        self._ranges = [merged]
+        return merged
+
+    def summary(self) -> dict:
+        """Returns the number of anomalies and affected packets of every kind."""
+        index = self.index()
+        summary = {"packets": self.packets}
+        for kind, name in enumerate(ANOMALY_KINDS):
+            ranges = index[index["kind"] == kind]
+            if kind == GAP:
+                affected = int(ranges["missing"].sum())
+            else:
+                affected = int((ranges["stop"] - ranges["start"]).sum())
+            summary[name] = {"count": len(ranges), "packets": affected}
+        return summary
+
+
+INDEX_DTYPE = np.dtype([("timestamp", "i8"), ("offset", "i8")])
+
+
+def index_path(rec_path: str | Path, probe: int) -> Path:
+    """Returns the path of the time index of probe next to a recording."""
+    rec_path = Path(rec_path)
+    return rec_path.with_name(f"{rec_path.stem}_probe{probe}_index.npy")
+
+
+class TimeIndex:
+    """
+    Sparse table of packet Timestamp to packet offset in the stream of a probe, so
+    that a time or sample range can be found by binary search.
+
+    An entry is kept every stride packets and at every packet where the Timestamp
+    doesn't increase by one, so the offset of any timestamp follows exactly from
+    the entry before it. Timestamps count samples, they are assumed to increase.
+
+    Arguments:
+    - stride: number of packets between entries
+    - offset: offset of the first packet that is passed to update
+    """
+
+    def __init__(self, stride: int = 20000, offset: int = 0):
+        self.stride = stride
+        self.packets = offset
+        self._last_timestamp: int | None = None
+        self._entries: List[np.ndarray] = []
+
+    def update(self, timestamps: np.ndarray) -> None:
+        """Adds the entries of the next block of packets."""
+        n = len(timestamps)
+        if n == 0:
+            return
+        timestamps = timestamps.astype("i8")
+        previous = timestamps[0] - 1
+        if self._last_timestamp is not None:
+            previous = self._last_timestamp
+        offsets = np.arange(self.packets, self.packets + n)
+        keep = (offsets % self.stride == 0) | (
+            np.diff(timestamps, prepend=previous) != 1
+        )
+        if self._last_timestamp is None:
+            keep[0] = True
+        entries = np.empty(np.count_nonzero(keep), dtype=INDEX_DTYPE)
+        entries["timestamp"] = timestamps[keep]
+        entries["offset"] = offsets[keep]
+        self._entries.append(entries)
+        self.packets += n
+        self._last_timestamp = int(timestamps[-1])
+
+    @property
+    def entries(self) -> np.ndarray:
+        if not self._entries:
+            return np.empty(0, dtype=INDEX_DTYPE)
+        if len(self._entries) > 1:
+            self._entries = [np.concatenate(self._entries)]
+        return self._entries[0]
+
+    def save(self, path: str | Path) -> None:
+        """Saves the entries as .npy, with an entry for the last packet so that the
+        number of packets is known when it is loaded."""
+        entries = self.entries
+        if len(entries) and entries["offset"][-1] != self.packets - 1:
+            last = np.array([(self._last_timestamp, self.packets - 1)], INDEX_DTYPE)
+            entries = np.concatenate((entries, last))
+        np.save(path, entries)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "TimeIndex":
+        entries = np.load(path)
+        index = cls()
+        index._entries = [entries]
+        if len(entries):
+            index.packets = int(entries["offset"][-1]) + 1
+            index._last_timestamp = int(entries["timestamp"][-1])
+        return index
+
+    def offset(self, timestamp: int) -> int:
+        """Returns the offset of the packet with timestamp, or of the first packet
+        after it if it was dropped."""
+        entries = self.entries
+        if len(entries) == 0:
+            raise ValueError("Time index is empty")
+        i = np.searchsorted(entries["timestamp"], timestamp, side="right") - 1
+        if i < 0:
+            return int(entries["offset"][0])
+        offset = int(entries["offset"][i] + timestamp - entries["timestamp"][i])
+        if i + 1 < len(entries):
+            offset = min(offset, int(entries["offset"][i + 1]))
+        return min(offset, self.packets)
+
+    def sample_range(
+        self, start_time: float, stop_time: float, FREQ: int = 20000
+    ) -> Tuple[int, int]:
+        """Returns the (start, stop) packet offsets of a time range in seconds
+        from the first packet."""
+        first = int(self.entries["timestamp"][0])
+        return (
+            self.offset(first + round(start_time * FREQ)),
+            self.offset(first + round(stop_time * FREQ)),
+        )
+
+
+EVENT_FIELDS = ["box", "probe", "stimunit", "SU_bitmask"]
+
+
+def events_to_samples(events: list, FREQ: int = 20000) -> Tuple[dict, List[str]]:
+    """
+    Converts events from read_stimrec_events, timed in seconds since the start of
+    the recording, to the sample clock of the recording.
+
+    Returns a dictionary of arrays with one element per event, sorted by sample:
+    - sample: sample index of start_time
+    - duration: delta_time in samples
+    - event: index in the returned list of event names
+    - box, probe, stimunit, SU_bitmask: -1 if the event doesn't have it
+    """
+    names = sorted({event["event"] for event in events})
+    events = sorted(events, key=lambda event: event["start_time"])
+    arrays = {
+        "sample": np.array(
+            [round(event["start_time"] * FREQ) for event in events], dtype="i8"
+        ),
+        "duration": np.array(
+            [round(event["delta_time"] * FREQ) for event in events], dtype="i8"
+        ),
+        "event": np.array([names.index(event["event"]) for event in events], "u1"),
+    }
+    for field in EVENT_FIELDS:
+        arrays[field] = np.array(
+            [int(event.get(field, -1)) for event in events], dtype="i4"
+        )
+    return arrays, names
+
+
+def write_zarr_events(
+    zarr_path: str | Path, events: dict, names: List[str], attrs: dict | None = None
+) -> None:
+    """Writes the arrays of events_to_samples to the group events of a Zarr
+    recording, and attrs to the attributes of the recording."""
+    _require_zarr()
+    root = zarr.open_group(str(zarr_path), mode="r+")
+    root.attrs.update(attrs or {})
+    group = root.create_group("events", overwrite=True)
+    group.attrs["names"] = names
+    for name, array in events.items():
+        group.array(name, array, chunks=(max(len(array), 1),))
+
+
+def event_windows(
+    data: np.ndarray, samples: np.ndarray, before: int, after: int
+) -> np.ndarray:
+    """Returns the samples from before samples before to after samples after every
+    event, as an array of shape (channels, events, before + after). data is an
+    array or memmap of shape (channels, samples), of a memmap only the windows are
+    read. Events too close to the start or end of data are left out."""
+    samples = np.asarray(samples)
+    samples = samples[(samples >= before) & (samples + after <= data.shape[1])]
+    return data[:, samples[:, None] + np.arange(-before, after)]
+
+
+PREVIEW_FACTORS = (10, 100, 1000)
+PREVIEW_DTYPE = np.dtype([("min", "i2"), ("max", "i2"), ("rms", "f4")])
+
+
+def preview_path(rec_path: str | Path, probe: int, factor: int) -> Path:
+    """Returns the path of the preview of probe at factor next to a recording."""
+    rec_path = Path(rec_path)
+    return rec_path.with_name(f"{rec_path.stem}_probe{probe}_preview{factor}.dat")
+
+
+def reduce_preview(bins: np.ndarray, group: int) -> np.ndarray:
+    """Combines every group consecutive bins of a preview (bins, channels) into one
+    bin, the last bin can combine fewer bins."""
+    starts = np.arange(0, len(bins), group)
+    counts = np.diff(np.append(starts, len(bins)))[:, None]
+    reduced = np.empty((len(starts), bins.shape[1]), PREVIEW_DTYPE)
+    if len(starts) == 0:
+        return reduced
+    reduced["min"] = np.minimum.reduceat(bins["min"], starts)
+    reduced["max"] = np.maximum.reduceat(bins["max"], starts)
+    reduced["rms"] = np.sqrt(
+        np.add.reduceat(np.square(bins["rms"], dtype="f8"), starts) / counts
+    )
+    return reduced
+
+
+class PreviewPyramid:
+    """
+    Min, max and RMS of the samples of a probe in bins of every factor samples, so
+    that any zoom level of a recording can be drawn from about one bin per pixel
+    instead of from all samples.
+
+    The first level is computed from the samples and every next level from the
+    level below it, so factors have to be multiples of each other. Samples can be
+    added in blocks of any size while recording, samples and bins that don't fill
+    a bin of a level yet are kept until the next update.
+    """
+
+    def __init__(self, num_channels: int, factors: tuple = PREVIEW_FACTORS):
+        if any(factor % lower for lower, factor in zip(factors, factors[1:])):
+            raise ValueError("Every factor has to be a multiple of the one before")
+        self.num_channels = num_channels
+        self.factors = factors
+        self._samples = np.empty((num_channels, 0), dtype="int16")
+        self._pending = {
+            factor: np.empty((0, num_channels), PREVIEW_DTYPE) for factor in factors
+        }
+
+    def update(self, data: np.ndarray) -> dict:
+        """Adds samples (channels, samples), returns the bins that were completed
+        as {factor: array (bins, channels)}."""
+        samples = np.concatenate([self._samples, data.astype("int16", copy=False)], 1)
+        factor = self.factors[0]
+        n = samples.shape[1] // factor
+        binned = samples[:, : n * factor].reshape(self.num_channels, n, factor)
+        self._samples = samples[:, n * factor :]
+        bins = np.empty((n, self.num_channels), PREVIEW_DTYPE)
+        bins["min"] = binned.min(axis=2).T
+        bins["max"] = binned.max(axis=2).T
+        bins["rms"] = np.sqrt(np.square(binned, dtype="f4").mean(axis=2)).T
+        levels = {factor: bins}
+        for lower, factor in zip(self.factors, self.factors[1:]):
+            group = factor // lower
+            bins = np.concatenate([self._pending[factor], bins])
+            n = len(bins) // group
+            self._pending[factor] = bins[n * group :]
+            bins = reduce_preview(bins[: n * group], group)
+            levels[factor] = bins
+        return levels
+
+
+def open_preview(
+    rec_path: str | Path,
+    probe: int,
+    num_channels: int,
+    factors: tuple = PREVIEW_FACTORS,
+) -> dict:
+    """Memory-maps the preview files of probe next to a recording, as written
+    while recording. Returns {factor: memmap (bins, channels)} of the complete bins
+    at the time of opening."""
+    levels = {}
+    for factor in factors:
+        path = preview_path(rec_path, probe, factor)
+        if not path.exists():
+            continue
+        bins = path.stat().st_size // (PREVIEW_DTYPE.itemsize * num_channels)
+        if bins > 0:
+            levels[factor] = np.memmap(
+                path, PREVIEW_DTYPE, "r", shape=(bins, num_channels)
+            )
+    return levels
+
+
+def preview_window(
+    levels: dict, start: int, stop: int, width: int, data=None
+) -> Tuple[int, np.ndarray]:
+    """
+    Summarizes samples start:stop in at most width bins.
+
+    The bins are read from the coarsest level of levels ({factor: array (bins,
+    channels)}, see open_preview or the preview_<factor> arrays of a Zarr
+    recording) that still has width bins in the range, and combined to width bins.
+    If no level is fine enough the samples are read from data (channels, samples),
+    or the finest level is used if data is None.
+
+    Returns the number of samples per bin and the bins (bins, channels).
+    """
+    fine_enough = [
+        factor for factor in sorted(levels) if (stop - start) // factor >= width
+    ]
+    if fine_enough:
+        factor = fine_enough[-1]
+        bins = np.asarray(levels[factor][start // factor : -(-stop // factor)])
+    elif data is not None:
+        factor = 1
+        samples = np.asarray(data[:, start:stop]).astype("int16", copy=False).T
+        bins = np.empty(samples.shape, PREVIEW_DTYPE)
+        bins["min"] = bins["max"] = samples
+        bins["rms"] = np.abs(samples)
+    elif levels:
+        factor = min(levels)
+        bins = np.asarray(levels[factor][start // factor : -(-stop // factor)])
+    else:
+        raise ValueError("No preview levels or samples to summarize")
+    group = max(-(-len(bins) // width), 1)
+    return factor * group, reduce_preview(bins, group)
+
+
+def append_zarr_preview(zarr_path: str | Path, probe: int, levels: dict) -> None:
+    """Appends the bins of PreviewPyramid.update to the previews of probe."""
+    _require_zarr()
+    group = zarr.open_group(str(zarr_path), mode="r+")[f"probe_{probe}"]
+    for factor, bins in levels.items():
+        group[f"preview_{factor}"].append(bins)
+
+
+def clear_zarr_preview(zarr_path: str | Path, probe: int) -> None:
+    """Removes the bins of the previews of probe."""
+    _require_zarr()
+    group = zarr.open_group(str(zarr_path), mode="r+")[f"probe_{probe}"]
+    for name, array in group.arrays():
+        if name.startswith("preview_"):
+            array.resize(0, array.shape[1])
+
+
+def open_zarr_preview(zarr_path: str | Path, probe: int) -> dict:
+    """Returns the previews of probe in a Zarr recording as {factor: array}."""
+    _require_zarr()
+    group = zarr.open_group(str(zarr_path), mode="r")[f"probe_{probe}"]
+    return {
+        int(name.split("_")[1]): array
+        for name, array in group.arrays()
+        if name.startswith("preview_")
+    }
+
+
+# Threshold crossings of VB_streaming.SpikeDetector
+SPIKE_DTYPE = np.dtype([("sample", "i8"), ("channel", "u2"), ("amplitude", "f4")])
+
+
+def spikes_path(rec_path: str | Path, probe: int) -> Path:
+    """Returns the path of the spikes of probe next to a recording."""
+    rec_path = Path(rec_path)
+    return rec_path.with_name(f"{rec_path.stem}_probe{probe}_spikes.dat")
+
+
+def open_spikes(rec_path: str | Path, probe: int) -> np.ndarray:
+    """Memory-maps the spikes of probe that are written while streaming, as
+    SPIKE_DTYPE. sample is the packet offset of the spike in the stream of the
+    probe, see TimeIndex."""
+    path = spikes_path(rec_path, probe)
+    count = path.stat().st_size // SPIKE_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, SPIKE_DTYPE)
+    return np.memmap(path, SPIKE_DTYPE, "r", shape=(count,))
+
+
+ARCHIVE_MAGIC = b"VBARCHV1"
+# probe, packet offset of the first packet, packets, flags, compression level and
+# the compressed size of the data, timestamps, status and session id arrays
+ARCHIVE_CHUNK = struct.Struct("<HqIBBIIII")
+ARCHIVE_DELTA = 1  # flag: data is delta encoded along the packets
+ARCHIVE_FIELDS = [
+    ("data", "int16"),
+    ("timestamps", "uint32"),
+    ("status", "uint16"),
+    ("session_id", "uint8"),
+]
+
+
+def archive_path(rec_path: str | Path) -> Path:
+    """Returns the path of the compressed archive next to a recording."""
+    return Path(rec_path).with_suffix(".vbarch")
+
+
+def archive_codec() -> str:
+    """Returns the codec of new archives: zstd (Blosc) if numcodecs is installed,
+    zlib otherwise."""
+    return "zstd" if zarr is not None else "zlib"
+
+
+def _compress(array: np.ndarray, codec: str, level: int) -> bytes:
+    if codec == "zstd":
+        return Blosc(cname="zstd", clevel=level, shuffle=Blosc.SHUFFLE).encode(array)
+    # Byte shuffle: all first bytes, then all second bytes, etc.
+    shuffled = np.ascontiguousarray(array).view("u1").reshape(-1, array.itemsize)
+    return zlib.compress(shuffled.T.tobytes(), level)
+
+
+def _decompress(buffer: bytes, codec: str, dtype: str, shape: tuple) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    if codec == "zstd":
+        return np.frombuffer(Blosc().decode(buffer), dtype).reshape(shape)
+    shuffled = np.frombuffer(zlib.decompress(buffer), "u1")
+    return shuffled.reshape(dtype.itemsize, -1).T.copy().view(dtype).reshape(shape)
+
+
+def encode_archive_chunk(
+    probe: int, offset: int, arrays: tuple, codec: str, level: int
+) -> bytes:
+    """
+    Compresses the packets of a probe (data, timestamps, status, session id, see
+    ARCHIVE_FIELDS) into a chunk of an archive.
+
+    Timestamps are always delta encoded. The data is delta encoded if the
+    differences between packets are smaller than the deviations from the mean,
+    i.e. if the signal is smooth compared to its noise.
+    """
+    data, timestamps, status, session_id = arrays
+    flags = 0
+    head = data[:256].astype("float32")
+    if np.abs(np.diff(head, axis=0)).mean() < np.abs(head - head.mean(axis=0)).mean():
+        flags |= ARCHIVE_DELTA
+        data = np.diff(data, axis=0, prepend=np.zeros_like(data[:1]))
+    timestamps = np.diff(timestamps, prepend=np.zeros_like(timestamps[:1]))
+    buffers = [
+        _compress(array, codec, level)
+        for array in (data, timestamps, status, session_id)
+    ]
+    header = ARCHIVE_CHUNK.pack(
+        probe, offset, len(timestamps), flags, level, *map(len, buffers)
+    )
+    return header + b"".join(buffers)
+
+
+def write_archive_header(
+    file, probes: list, FREQ: int, codec: str, channels: int = 64
+) -> None:
+    """Writes the magic and the JSON header of an archive."""
+    header = json.dumps(
+        {"probes": probes, "FREQ": FREQ, "codec": codec, "channels": channels}
+    ).encode()
+    file.write(ARCHIVE_MAGIC + struct.pack("<I", len(header)) + header)
+
+
+def read_archive(path: str | Path) -> Iterator[tuple]:
+    """Reads the chunks of an archive written by VB_streaming.ArchiveWriter.
+    Yields the probe, the packet offset of the first packet and the arrays of
+    ARCHIVE_FIELDS of every chunk. An incomplete last chunk is skipped."""
+    with open(path, "rb") as file:
+        if file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            raise ValueError(f"{path} is not an archive")
+        (size,) = struct.unpack("<I", file.read(4))
+        header = json.loads(file.read(size))
+        codec, channels = header["codec"], header["channels"]
+        while True:
+            header = file.read(ARCHIVE_CHUNK.size)
+            if len(header) < ARCHIVE_CHUNK.size:
+                return
+            probe, offset, packets, flags, _, *sizes = ARCHIVE_CHUNK.unpack(header)
+            buffers = [file.read(size) for size in sizes]
+            if len(buffers[-1]) < sizes[-1]:
+                return
+            shapes = [(packets, channels), (packets,), (packets,), (packets,)]
+            data, timestamps, status, session_id = (
+                _decompress(buffer, codec, dtype, shape)
+                for buffer, (_, dtype), shape in zip(buffers, ARCHIVE_FIELDS, shapes)
+            )
+            if flags & ARCHIVE_DELTA:
+                data = np.cumsum(data, axis=0, dtype="int16")
+            timestamps = np.cumsum(timestamps, dtype="uint32")
+            yield probe, offset, (data, timestamps, status, session_id)
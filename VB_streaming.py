@@ -0,0 +1,1081 @@
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, List, Tuple
+
+import numpy as np
+from scipy import signal
+
+from VB_recordings import (
+    SPIKE_DTYPE,
+    archive_codec,
+    encode_archive_chunk,
+    write_archive_header,
+)
+
+logger = logging.getLogger("VB_streaming")
+logger.setLevel(logging.DEBUG)
+socketHandler = logging.handlers.SocketHandler(
+    "localhost", logging.handlers.DEFAULT_TCP_LOGGING_PORT
+)
+logger.addHandler(socketHandler)
+
+
+class ChannelRemap:
+    """
+    Reorders the 64 chip channels of a block of packets into the probe electrode
+    layout that is sent to Open Ephys.
+
+    The mapping {chip channel: electrode} (Mappings.electrode_mapping) is compiled
+    once into an index array, applying it is a gather instead of the matrix product
+    with a one-hot (64, NUM_CHANNELS) matrix. Electrodes without a chip channel are
+    zero, like they are with the matrix product.
+
+    Arguments:
+    - electrode_mapping: dict of chip channel (0 indexed) to electrode (0 indexed)
+    - num_channels: number of electrodes in the output
+    - chip_channels: number of channels in a packet
+    """
+
+    def __init__(
+        self, electrode_mapping: dict, num_channels: int = 60, chip_channels: int = 64
+    ):
+        self.num_channels = num_channels
+        self.chip_channels = chip_channels
+        self.electrode_mapping = {
+            int(chan): int(elec)
+            for chan, elec in electrode_mapping.items()
+            if 0 <= int(elec) < num_channels and 0 <= int(chan) < chip_channels
+        }
+        electrodes = np.fromiter(self.electrode_mapping.values(), dtype=np.intp)
+        # index[electrode] = chip channel, unmapped electrodes read channel 0 and
+        # are zeroed afterwards
+        self.index = np.zeros(num_channels, dtype=np.intp)
+        self.index[electrodes] = np.fromiter(
+            self.electrode_mapping.keys(), dtype=np.intp
+        )
+        self.unmapped = np.setdiff1d(np.arange(num_channels), electrodes)
+        # An electrode that is fed by multiple chip channels is the sum of these
+        # channels, which can't be expressed as a gather.
+        self._mtx = None
+        if len(np.unique(electrodes)) != len(electrodes):
+            logger.warning(
+                "Electrode mapping connects multiple channels to one electrode, "
+                "falling back to matrix remapping"
+            )
+            self._mtx = self.matrix()
+
+    def matrix(self, dtype="uint16") -> np.ndarray:
+        """Returns the equivalent one-hot (chip_channels, num_channels) matrix."""
+        mtx = np.zeros((self.chip_channels, self.num_channels), dtype=dtype)
+        for k, v in self.electrode_mapping.items():
+            mtx[k][v] = 1
+        return mtx
+
+    def apply(self, databuffer: np.ndarray, out: np.ndarray | None = None):
+        """Remaps a block of packets.
+
+        Arguments:
+        - databuffer: array of shape (samples, chip_channels)
+        - out: optional C-contiguous array of shape (num_channels, samples) with the
+            same dtype as databuffer, it is filled and returned
+
+        Returns:
+        - array of shape (num_channels, samples)
+        """
+        if self._mtx is not None:
+            remapped = (databuffer @ self._mtx).T
+            if out is None:
+                return remapped
+            out[...] = remapped
+            return out
+        if out is None:
+            out = np.empty((self.num_channels, len(databuffer)), databuffer.dtype)
+        np.take(databuffer.T, self.index, axis=0, out=out)
+        if self.unmapped.size:
+            out[self.unmapped] = 0
+        return out
+
+
+@dataclass
+class FilterSettings:
+    """
+    Filters that are applied to the data that is sent to Open Ephys, in this order.
+
+    Arguments:
+    - highpass: cutoff frequency (Hz) of the high-pass filter, None to disable
+    - bandpass: (low, high) cutoff frequencies (Hz) of the band-pass filter, None to
+    disable
+    - order: order of the high-pass and band-pass Butterworth filters
+    - line_frequency: frequency (Hz) of the mains, 50 or 60, None to disable the
+    notch filters
+    - harmonics: number of notch filters, at the line frequency and its harmonics
+    - Q: quality factor of the notch filters
+    """
+
+    highpass: float | None = None
+    bandpass: Tuple[float, float] | None = None
+    order: int = 2
+    line_frequency: float | None = 50.0
+    harmonics: int = 1
+    Q: float = 30.0
+
+    def __post_init__(self):
+        if self.highpass is not None and self.highpass <= 0:
+            raise ValueError("highpass must be positive")
+        if self.bandpass is not None and not 0 < self.bandpass[0] < self.bandpass[1]:
+            raise ValueError("bandpass must be (low, high) with 0 < low < high")
+        if self.order < 1:
+            raise ValueError("order must be at least 1")
+        if self.line_frequency not in (None, 50.0, 60.0):
+            raise ValueError("line_frequency must be 50 or 60 Hz")
+        if self.harmonics < 1:
+            raise ValueError("harmonics must be at least 1")
+        if self.Q <= 0:
+            raise ValueError("Q must be positive")
+
+    @property
+    def removes_dc(self) -> bool:
+        """The output is centered around zero, it doesn't fit an unsigned type."""
+        return self.highpass is not None or self.bandpass is not None
+
+    def sos(self, FREQ: int) -> np.ndarray:
+        """Returns the cascade as second-order sections, shape (n_sections, 6)."""
+        sections = []
+        if self.highpass is not None:
+            sections.append(
+                signal.butter(
+                    self.order, self.highpass, "highpass", fs=FREQ, output="sos"
+                )
+            )
+        if self.bandpass is not None:
+            sections.append(
+                signal.butter(
+                    self.order, self.bandpass, "bandpass", fs=FREQ, output="sos"
+                )
+            )
+        if self.line_frequency is not None:
+            for harmonic in range(1, self.harmonics + 1):
+                f0 = harmonic * self.line_frequency
+                if f0 >= FREQ / 2:
+                    break
+                sections.append(signal.tf2sos(*signal.iirnotch(f0, self.Q, FREQ)))
+        if not sections:
+            return np.empty((0, 6))
+        return np.vstack(sections)
+
+
+class FilterBank:
+    """
+    Runs the cascade of FilterSettings as second-order sections over blocks of
+    (channels, samples), keeping the filter state of every channel between blocks.
+
+    The default settings are the 50 Hz notch filter with Q=30 that was applied with
+    lfilter before.
+    """
+
+    def __init__(
+        self,
+        settings: FilterSettings,
+        num_channels: int,
+        FREQ: int = 20000,
+        dtype: str = "float32",
+    ):
+        self.settings = settings
+        self.FREQ = FREQ
+        self.dtype = np.dtype(dtype)
+        self.sos = settings.sos(FREQ).astype(self.dtype)
+        self.reset(num_channels)
+
+    def reset(self, num_channels: int | None = None) -> None:
+        """Clears the filter state, optionally for a different number of channels."""
+        if num_channels is not None:
+            self.num_channels = num_channels
+        self.zi = np.zeros((len(self.sos), self.num_channels, 2), dtype=self.dtype)
+
+    def apply(self, databuffer: np.ndarray, rows: slice = slice(None)) -> np.ndarray:
+        """Filters databuffer (channels, samples) along the samples.
+
+        Arguments:
+        - databuffer: block of the channels in rows
+        - rows: the channels of the filter state that belong to databuffer
+        """
+        if len(self.sos) == 0:
+            return databuffer.astype(self.dtype)
+        filtered, self.zi[:, rows] = signal.sosfilt(
+            self.sos, databuffer, axis=1, zi=self.zi[:, rows]
+        )
+        return filtered
+
+
+# Element types of the Open Ephys socket header, name: (dataType enum, dtype)
+OE_TRANSPORTS = {
+    "U16": (2, np.dtype("uint16")),
+    "S16": (3, np.dtype("int16")),
+    "F32": (5, np.dtype("float32")),
+}
+
+
+def convert_block(databuffer: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Converts the filter output into the preallocated out in a single pass.
+    Integer types saturate instead of wrapping around."""
+    if out.dtype.kind in "iu":
+        info = np.iinfo(out.dtype)
+        return np.clip(databuffer, info.min, info.max, out=out, casting="unsafe")
+    np.copyto(out, databuffer, casting="unsafe")
+    return out
+
+
+@dataclass
+class SpikeSettings:
+    """
+    Settings of the threshold crossing detection of SpikeDetector.
+
+    Arguments:
+    - threshold: a spike is a crossing below -threshold times the noise level
+    - refractory: seconds after a crossing in which crossings on the same channel
+    are ignored
+    - time_constant: seconds over which the noise level is averaged
+    - send_events: also send one channel per probe to Open Ephys, that is the
+    channel (1 indexed) of a spike at its first sample and 0 otherwise. Of spikes
+    at the same sample the highest channel is sent.
+    - band: (low, high) cutoff frequencies (Hz) of the band-pass filter of the
+    detection, independent of the FilterSettings of the stream
+    - order: order of that Butterworth band-pass filter
+    """
+
+    threshold: float = 5.0
+    refractory: float = 0.001
+    time_constant: float = 1.0
+    send_events: bool = False
+    band: Tuple[float, float] = (300.0, 3000.0)
+    order: int = 2
+
+    @property
+    def filter_settings(self) -> FilterSettings:
+        """The band-pass filter of the detection, without notch filters."""
+        return FilterSettings(
+            bandpass=tuple(self.band), order=self.order, line_frequency=None
+        )
+
+
+class SpikeDetector:
+    """
+    Detects threshold crossings in the blocks of one probe, for all channels at
+    once.
+
+    The blocks are first band-pass filtered with the band of the settings, with
+    their own filter state: the filters of the stream are only a notch filter by
+    default, on which the thresholds would fire on the LFP.
+
+    The noise level of every channel is the median absolute deviation of a block
+    scaled to a standard deviation (/0.6745), averaged over blocks with an
+    exponential moving average. A crossing is the first sample below -threshold
+    times the noise level, crossings within refractory samples after the previous
+    crossing on the same channel are dropped. The amplitude is the minimum in the
+    refractory period after the crossing, within the block.
+    """
+
+    def __init__(self, settings: SpikeSettings, num_channels: int, FREQ: int):
+        self.settings = settings
+        self.refractory = max(round(settings.refractory * FREQ), 1)
+        self.time_constant = settings.time_constant * FREQ
+        self.filters = FilterBank(settings.filter_settings, num_channels, FREQ)
+        self.noise: np.ndarray | None = None
+        self._below = np.zeros(num_channels, dtype=bool)
+        # Sample of the last crossing of every channel
+        self._last = np.full(num_channels, -self.refractory, dtype="i8")
+
+    def detect(self, databuffer: np.ndarray, offset: int) -> np.ndarray:
+        """Returns the spikes in databuffer (channels, samples), of which the first
+        sample is sample offset of the probe, as SPIKE_DTYPE sorted by sample. The
+        amplitude is that of the band-pass filtered data."""
+        databuffer = self.filters.apply(databuffer)
+        middle = databuffer.shape[1] // 2
+        # np.partition is several times faster than np.median along an axis
+        median = np.partition(databuffer, middle, axis=1)[:, middle : middle + 1]
+        centered = databuffer - median
+        noise = np.partition(np.abs(centered), middle, axis=1)[:, middle] / 0.6745
+        if self.noise is None:
+            self.noise = noise
+        else:
+            alpha = min(databuffer.shape[1] / self.time_constant, 1.0)
+            self.noise += alpha * (noise - self.noise)
+
+        below = centered < -self.settings.threshold * self.noise[:, None]
+        onsets = below.copy()
+        onsets[:, 1:] &= ~below[:, :-1]
+        onsets[:, 0] &= ~self._below
+        self._below = below[:, -1].copy()
+
+        # Sorted by channel, then by sample
+        channels, samples = np.nonzero(onsets)
+        previous = self._last[channels]
+        same_channel = channels[1:] == channels[:-1]
+        previous[1:][same_channel] = samples[:-1][same_channel] + offset
+        np.maximum.at(self._last, channels, samples + offset)
+        keep = samples + offset - previous >= self.refractory
+        channels, samples = channels[keep], samples[keep]
+
+        window = np.minimum(
+            samples[:, None] + np.arange(self.refractory), databuffer.shape[1] - 1
+        )
+        spikes = np.empty(len(samples), SPIKE_DTYPE)
+        spikes["sample"] = samples + offset
+        spikes["channel"] = channels
+        spikes["amplitude"] = centered[channels[:, None], window].min(axis=1)
+        return spikes[np.argsort(spikes["sample"], kind="stable")]
+
+
+# Sentinel that is passed down the pipeline once the source is exhausted
+_END = object()
+
+
+class BufferPool:
+    """
+    Fixed set of preallocated buffers that are passed between pipeline stages.
+
+    A stage that needs a buffer blocks until a downstream stage releases one, which
+    bounds the memory of the pipeline and provides backpressure towards the source.
+    """
+
+    def __init__(self, buffers: List[Any]):
+        self.size = len(buffers)
+        self._free: queue.Queue = queue.Queue()
+        for buffer in buffers:
+            self._free.put(buffer)
+
+    def acquire(self, stop_event: threading.Event, poll: float = 0.05) -> Any:
+        """Returns a free buffer, or None if stop_event is set while waiting."""
+        while not stop_event.is_set():
+            try:
+                return self._free.get(timeout=poll)
+            except queue.Empty:
+                continue
+        return None
+
+    def release(self, buffer: Any) -> None:
+        self._free.put(buffer)
+
+    @property
+    def available(self) -> int:
+        return self._free.qsize()
+
+
+@dataclass
+class StageStats:
+    processed: int = 0
+    last_latency: float = 0.0
+    max_latency: float = 0.0
+    total_latency: float = 0.0
+    # time spent waiting for room in the output queue
+    blocked: float = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.processed if self.processed else 0.0
+
+    def add(self, latency: float) -> None:
+        self.processed += 1
+        self.last_latency = latency
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+
+
+class PipelineStage(threading.Thread):
+    """
+    Runs one step of a StreamPipeline in its own thread.
+
+    A stage without inbox is the source, its work function is called without
+    arguments and returns None once there is no more data. Other stages call work
+    with every item from the inbox. The result is put on the outbox, a stage
+    without outbox is the sink. If pace is given it is called before every call of
+    work, the time spent in it doesn't count as latency.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        work: Callable,
+        stop_event: threading.Event,
+        inbox: queue.Queue | None = None,
+        outbox: queue.Queue | None = None,
+        pace: Callable | None = None,
+        poll: float = 0.05,
+    ):
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.pace = pace
+        self.stop_event = stop_event
+        self.inbox = inbox
+        self.outbox = outbox
+        self.poll = poll
+        self.stats = StageStats()
+        self.error: Exception | None = None
+
+    def _get(self) -> Any:
+        while not self.stop_event.is_set():
+            try:
+                return self.inbox.get(timeout=self.poll)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _put(self, item: Any) -> None:
+        start = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                self.outbox.put(item, timeout=self.poll)
+                break
+            except queue.Full:
+                continue
+        self.stats.blocked += time.perf_counter() - start
+
+    def run(self) -> None:
+        try:
+            while not self.stop_event.is_set():
+                if self.pace is not None:
+                    self.pace()
+                if self.inbox is None:
+                    start = time.perf_counter()
+                    result = self.work()
+                    if result is None:
+                        break
+                else:
+                    item = self._get()
+                    if item is _END:
+                        break
+                    start = time.perf_counter()
+                    result = self.work(item)
+                self.stats.add(time.perf_counter() - start)
+                if self.outbox is not None:
+                    self._put(result)
+        except Exception as e:
+            self.error = e
+            logger.error(f"Pipeline stage {self.name} failed: {e}")
+            # Without this stage the others would wait forever
+            self.stop_event.set()
+        finally:
+            if self.outbox is not None:
+                self._put(_END)
+
+    @property
+    def queue_depth(self) -> int:
+        return self.inbox.qsize() if self.inbox is not None else 0
+
+    def status(self) -> dict:
+        return {
+            "processed": self.stats.processed,
+            "queue_depth": self.queue_depth,
+            "mean_latency": self.stats.mean_latency,
+            "last_latency": self.stats.last_latency,
+            "max_latency": self.stats.max_latency,
+            "blocked": self.stats.blocked,
+        }
+
+
+class StreamPipeline:
+    """
+    Chain of PipelineStage threads connected by bounded queues.
+
+    Arguments:
+    - stages: list of (name, work function), the first stage is the source and the
+        last stage the sink
+    - depth: maximum number of items waiting between two stages, a stage blocks
+        when its output queue is full
+    - stop_event: stops all stages when set
+    - pace: optional function that is called before the source reads a block
+    """
+
+    def __init__(
+        self,
+        stages: List[Tuple[str, Callable]],
+        depth: int,
+        stop_event: threading.Event,
+        pace: Callable | None = None,
+    ):
+        self.stop_event = stop_event
+        self.queues = [queue.Queue(maxsize=depth) for _ in stages[1:]]
+        self.stages = [
+            PipelineStage(
+                name,
+                work,
+                stop_event,
+                inbox=self.queues[i - 1] if i > 0 else None,
+                outbox=self.queues[i] if i < len(self.queues) else None,
+                pace=pace if i == 0 else None,
+            )
+            for i, (name, work) in enumerate(stages)
+        ]
+
+    def start(self) -> None:
+        for stage in self.stages:
+            stage.start()
+
+    def join(self) -> None:
+        for stage in self.stages:
+            stage.join()
+
+    def run(self) -> None:
+        """Runs the pipeline until the source is exhausted or it is stopped."""
+        self.start()
+        self.join()
+
+    @property
+    def errors(self) -> List[Exception]:
+        return [stage.error for stage in self.stages if stage.error is not None]
+
+    def status(self) -> dict:
+        return {stage.name: stage.status() for stage in self.stages}
+
+
+class Pacer:
+    """
+    Paces a loop at a fixed interval without keeping a CPU core busy.
+
+    Deadlines are t0 + n * interval on the monotonic time.perf_counter clock, so the
+    error of a single wake-up does not accumulate. wait() sleeps until spin seconds
+    before the deadline and only busy-waits for the last part.
+
+    When the loop falls behind by more than max_lag intervals the catch_up policy
+    decides what happens:
+    - "burst": the missed deadlines are run back-to-back until the loop is on
+        schedule again
+    - "skip": the missed deadlines are dropped, the loop continues at the next
+        deadline of the original schedule
+    - "reset": the schedule restarts from the current time
+
+    Arguments:
+    - interval: time between deadlines in seconds
+    - spin: time before the deadline in seconds that is busy-waited instead of slept
+    - catch_up: "burst", "skip" or "reset"
+    - max_lag: number of intervals the loop can lag before catch_up is applied
+    """
+
+    CATCH_UP_POLICIES = ("burst", "skip", "reset")
+
+    def __init__(
+        self,
+        interval: float,
+        spin: float = 0.002,
+        catch_up: str = "burst",
+        max_lag: float = 4.0,
+    ):
+        if catch_up not in self.CATCH_UP_POLICIES:
+            raise ValueError(
+                f"catch_up should be one of {self.CATCH_UP_POLICIES}, not {catch_up}"
+            )
+        self.interval = interval
+        self.spin = spin
+        self.catch_up = catch_up
+        self.max_lag = max_lag
+        self.start()
+
+    def start(self) -> None:
+        """(Re)starts the schedule, the first deadline is now."""
+        self._t0 = time.perf_counter()
+        self._n = 0
+        self.count = 0
+        self.late = 0
+        self.skipped = 0
+        self.resets = 0
+        self._jitter_sum = 0.0
+        self._jitter_sq_sum = 0.0
+        self.max_jitter = 0.0
+
+    def wait(self) -> float:
+        """Waits for the next deadline.
+
+        Returns:
+        - the time in seconds the wake-up was after the deadline
+        """
+        deadline = self._t0 + self._n * self.interval
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        now = time.perf_counter()
+        while now < deadline:
+            now = time.perf_counter()
+        jitter = now - deadline
+        self._n += 1
+
+        self.count += 1
+        self._jitter_sum += jitter
+        self._jitter_sq_sum += jitter * jitter
+        if jitter > self.max_jitter:
+            self.max_jitter = jitter
+        if jitter > self.interval:
+            self.late += 1
+            if jitter > self.max_lag * self.interval:
+                self._catch_up(now)
+        return jitter
+
+    def _catch_up(self, now: float) -> None:
+        if self.catch_up == "skip":
+            missed = int((now - self._t0) / self.interval) + 1 - self._n
+            self.skipped += missed
+            self._n += missed
+        elif self.catch_up == "reset":
+            self.resets += 1
+            self._t0 = now
+            self._n = 1
+
+    def stats(self) -> dict:
+        """Returns the wake-up jitter statistics in seconds."""
+        mean = self._jitter_sum / self.count if self.count else 0.0
+        var = self._jitter_sq_sum / self.count - mean * mean if self.count else 0.0
+        return {
+            "interval": self.interval,
+            "catch_up": self.catch_up,
+            "count": self.count,
+            "late": self.late,
+            "skipped": self.skipped,
+            "resets": self.resets,
+            "mean_jitter": mean,
+            "std_jitter": max(var, 0.0) ** 0.5,
+            "max_jitter": self.max_jitter,
+        }
+
+
+class TailReader:
+    """
+    Follows a recording file that is still being written, like tail -f.
+
+    Reads of the wrapped NVP.StreamReader that come back short are kept and
+    retried after a wait that doubles from min_wait up to max_wait while the file
+    doesn't grow, and is reset once it does. A read only returns less than asked
+    for at the end of the file once writer_done is set, or when stop_event is set.
+
+    Arguments:
+    - reader: NVP.StreamReader of the recording file
+    - stop_event: event that ends waiting for data
+    - FREQ: sample rate of the writer
+    - start_time: time.time() at which the writer started, if not given the time
+    of the first packet that is read is used
+    - writer_done: event that is set once the writer has closed the file, after
+    which the rest of the file is read
+    """
+
+    def __init__(
+        self,
+        reader,
+        stop_event: threading.Event,
+        FREQ: int = 20000,
+        start_time: float | None = None,
+        writer_done: threading.Event | None = None,
+        min_wait: float = 0.001,
+        max_wait: float = 0.05,
+        chip_channels: int = 64,
+    ):
+        self.reader = reader
+        self.probe = reader.probe
+        self.stop_event = stop_event
+        self.writer_done = writer_done
+        self.FREQ = FREQ
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.chip_channels = chip_channels
+        self._wait = min_wait
+        self._start_time = start_time
+        # packets that were written before _start_time
+        self._start_packets = 0
+        self.packets = 0
+        self.waits = 0
+        self.waited = 0.0
+
+    def readinto(self, data: np.ndarray, timestamps=None, status=None, session_id=None):
+        """Reads len(data) packets, see NVP.StreamReader.readinto, waiting for the
+        file to grow if needed. Returns the number of packets read."""
+        arrays = (timestamps, status, session_id)
+        count = 0
+        while count < len(data):
+            # Checked before reading, so the read sees everything that was written
+            done = self.writer_done is not None and self.writer_done.is_set()
+            read = self.reader.readinto(
+                data[count:], *(a if a is None else a[count:] for a in arrays)
+            )
+            if read:
+                if self._start_time is None:
+                    self._start_time = time.time()
+                    self._start_packets = self.packets
+                count += read
+                self.packets += read
+                self._wait = self.min_wait
+            elif done or self.stop_event.wait(self._wait):
+                break
+            else:
+                self.waits += 1
+                self.waited += self._wait
+                self._wait = min(2 * self._wait, self.max_wait)
+        return count
+
+    def read(
+        self, packet_count: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Reads packet_count packets, returns (timestamps, status, session_id,
+        data), shorter only at the end of the finished file or if stop_event was
+        set."""
+        data = np.empty((packet_count, self.chip_channels), dtype="int16")
+        timestamps = np.empty(packet_count, dtype="uint32")
+        status = np.empty(packet_count, dtype="uint16")
+        session_id = np.empty(packet_count, dtype="uint8")
+        n = self.readinto(data, timestamps, status, session_id)
+        return timestamps[:n], status[:n], session_id[:n], data[:n]
+
+    @property
+    def behind(self) -> int:
+        """Estimate of the number of samples that the writer is ahead, from the
+        time since start_time."""
+        if self._start_time is None:
+            return 0
+        written = (time.time() - self._start_time) * self.FREQ + self._start_packets
+        return max(0, int(written) - self.packets)
+
+    def status(self) -> dict:
+        return {
+            "packets": self.packets,
+            "behind": self.behind,
+            "waits": self.waits,
+            "waited": self.waited,
+        }
+
+
+def align_streams(
+    readers: list, max_skip: int = 20000
+) -> Tuple[List[Tuple], List[int]]:
+    """
+    Drops the packets at the start of every stream that were recorded before the
+    first packet of the stream that started last, so that the n-th packet of every
+    stream has the same Timestamp.
+
+    The packet that every stream is aligned on has been read already, it is
+    returned as (data, timestamp, status, session_id) so that it can be put in
+    front of the first block, together with its offset in every stream.
+
+    Arguments:
+    - readers: NVP.StreamReader for every stream
+    - max_skip: maximum number of packets that are dropped from a stream
+    """
+    heads = []
+    offsets = []
+    for reader in readers:
+        timestamps, status, session_id, data = reader.read(1)
+        if len(timestamps) == 0:
+            raise ValueError(f"No packets in stream of probe {reader.probe}")
+        heads.append((data[0].copy(), int(timestamps[0]), status[0], session_id[0]))
+    start = max(head[1] for head in heads)
+    for i, reader in enumerate(readers):
+        skipped = 0
+        while heads[i][1] < start:
+            if skipped == max_skip:
+                raise ValueError(
+                    f"Could not align probe {reader.probe} on timestamp {start}"
+                )
+            timestamps, status, session_id, data = reader.read(1)
+            if len(timestamps) == 0:
+                raise ValueError(
+                    f"Stream of probe {reader.probe} ended before timestamp {start}"
+                )
+            heads[i] = (data[0].copy(), int(timestamps[0]), status[0], session_id[0])
+            skipped += 1
+        offsets.append(skipped)
+        if skipped:
+            logger.info(f"Skipped {skipped} packets of probe {reader.probe}")
+        if heads[i][1] != start:
+            logger.warning(
+                f"Probe {reader.probe} has no packet with timestamp {start}, it starts \
+at {heads[i][1]}"
+            )
+    return heads, offsets
+
+
+def align_block(
+    timestamps: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    """
+    Aligns a block of n packets per stream on Timestamp again after a stream
+    dropped packets. The block is put on the first n timestamps of all streams
+    together: a stream that has no packet at one of them repeats its previous
+    packet (or its first packet, at the start of the block), and the packets after
+    the last of them are left for the next block.
+
+    Returns the n timestamps, the index of the packet at every timestamp for every
+    stream (streams, n) and the number of packets of every stream that are used,
+    or None if the timestamps of a stream don't increase.
+
+    Arguments:
+    - timestamps: Timestamp of the packets, shape (streams, n)
+    """
+    if (np.diff(timestamps.astype("i8"), axis=1) <= 0).any():
+        return None
+    n = timestamps.shape[1]
+    timeline = np.unique(timestamps)[:n]
+    used = np.array([np.searchsorted(row, timeline[-1], "right") for row in timestamps])
+    take = np.stack(
+        [np.searchsorted(row, timeline, "right") - 1 for row in timestamps]
+    )
+    np.maximum(take, 0, out=take)
+    return timeline, take, used
+
+
+@dataclass
+class ArchiveSettings:
+    """
+    Settings of the compressed archive of ArchiveWriter.
+
+    Arguments:
+    - cpu_budget: fraction of one core that the writer may use
+    - chunk_samples: packets per probe that are compressed together
+    - max_level: highest compression level
+    - queue_depth: blocks that can wait for the writer
+    """
+
+    cpu_budget: float = 0.25
+    chunk_samples: int = 20000
+    max_level: int = 5
+    queue_depth: int = 64
+
+
+class ArchiveWriter(threading.Thread):
+    """
+    Writes the packets of a stream to a compressed archive on a background thread,
+    see VB_recordings.encode_archive_chunk and VB_recordings.read_archive.
+
+    submit copies a block into a queue of queue_depth blocks and never waits: a
+    block that doesn't fit is left out of the archive and counted as dropped, the
+    recording itself is complete. The writer compresses chunk_samples packets per
+    probe at a time. After every chunk the compression level is lowered if
+    compressing took more than cpu_budget of the duration of the chunk and raised
+    if it took less than a quarter of that, and the writer sleeps so that it
+    doesn't use more than cpu_budget of a core.
+    """
+
+    def __init__(
+        self,
+        path,
+        probes: List[int],
+        FREQ: int,
+        settings: ArchiveSettings | None = None,
+    ):
+        super().__init__(name="archive", daemon=True)
+        self.path = path
+        self.probes = probes
+        self.FREQ = FREQ
+        self.settings = settings or ArchiveSettings()
+        self.codec = archive_codec()
+        self.level = self.settings.max_level
+        self.dropped = 0
+        self.archived = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.cpu_time = 0.0
+        self._queue: queue.Queue = queue.Queue(self.settings.queue_depth)
+        self._closing = threading.Event()
+        self._blocks: list = []
+        self._offsets: list = []
+        self._next_offsets: list = []
+        self._start_time = time.perf_counter()
+
+    def submit(
+        self, block: tuple, offsets: List[int], counts: List[int] | None = None
+    ) -> None:
+        """Queues a block (arrays of shape (probes, packets, ...)) of which the
+        first packets are at offsets in the streams of the probes. With counts,
+        only the first counts packets of every probe are archived."""
+        if counts is None:
+            counts = [block[1].shape[1]] * len(offsets)
+        rows = [
+            tuple(array[i, :count].copy() for array in block)
+            for i, count in enumerate(counts)
+        ]
+        try:
+            self._queue.put_nowait((rows, offsets, counts))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Writes the queued blocks and waits for the writer to finish."""
+        if self.is_alive():
+            # Stop keeping to the CPU budget, to finish the archive quickly
+            self._closing.set()
+            self._queue.put(_END)
+            self.join()
+
+    def run(self) -> None:
+        with open(self.path, "wb") as file:
+            write_archive_header(file, self.probes, self.FREQ, self.codec)
+            while True:
+                item = self._queue.get()
+                if item is _END:
+                    break
+                rows, offsets, counts = item
+                if self._blocks and offsets != self._next_offsets:
+                    # Blocks were dropped, a chunk is contiguous
+                    self._write_chunk(file)
+                if not self._blocks:
+                    self._offsets = offsets
+                self._blocks.append(rows)
+                self._next_offsets = [
+                    offset + count for offset, count in zip(offsets, counts)
+                ]
+                chunk_packets = self._next_offsets[0] - self._offsets[0]
+                if chunk_packets >= self.settings.chunk_samples:
+                    self._write_chunk(file)
+            if self._blocks:
+                self._write_chunk(file)
+        logger.info(f"Archive {self.path} written: {self.stats()}")
+
+    def _write_chunk(self, file) -> None:
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        for i, probe in enumerate(self.probes):
+            arrays = tuple(
+                np.concatenate([rows[i][field] for rows in self._blocks])
+                for field in range(len(self._blocks[0][i]))
+            )
+            chunk = encode_archive_chunk(
+                probe, self._offsets[i], arrays, self.codec, self.level
+            )
+            file.write(chunk)
+            self.raw_bytes += sum(array.nbytes for array in arrays)
+            self.compressed_bytes += len(chunk)
+        packets = self._next_offsets[0] - self._offsets[0]
+        self.archived += packets
+        self._blocks = []
+
+        cpu = time.thread_time() - cpu_start
+        self.cpu_time += cpu
+        budget = self.settings.cpu_budget * packets / self.FREQ
+        if cpu > budget and self.level > 1:
+            self.level -= 1
+        elif cpu < budget / 4 and self.level < self.settings.max_level:
+            self.level += 1
+        idle = cpu / self.settings.cpu_budget - (time.perf_counter() - wall_start)
+        if idle > 0:
+            self._closing.wait(idle)
+
+    def stats(self) -> dict:
+        """Returns the compression ratio, compression level, the number of packets
+        per probe that are archived, the number of dropped blocks and the fraction
+        of a core that is used."""
+        return {
+            "ratio": self.raw_bytes / max(self.compressed_bytes, 1),
+            "level": self.level,
+            "codec": self.codec,
+            "archived_packets": self.archived,
+            "dropped_blocks": self.dropped,
+            "cpu": self.cpu_time / (time.perf_counter() - self._start_time),
+        }
+
+
+@dataclass
+class StreamingProfile:
+    """
+    Parameters of the stream to Open Ephys.
+
+    Arguments:
+    - name: name of the profile
+    - num_samples: number of samples (packets) per block
+    - queue_depth: maximum number of blocks waiting between pipeline stages
+    - filter_dtype: precision of the filter bank, "float32" or "float64"
+    """
+
+    name: str = "default"
+    num_samples: int = 500
+    queue_depth: int = 4
+    filter_dtype: str = "float32"
+
+    def __post_init__(self):
+        if self.num_samples < 1:
+            raise ValueError("num_samples must be at least 1")
+        if self.queue_depth < 1:
+            raise ValueError("queue_depth must be at least 1")
+        if self.filter_dtype not in ("float32", "float64"):
+            raise ValueError("filter_dtype must be 'float32' or 'float64'")
+
+
+STREAMING_PROFILES = {
+    # 5 ms blocks for closed-loop display
+    "low_latency": StreamingProfile("low_latency", 100, 2, "float32"),
+    "default": StreamingProfile("default", 500, 4, "float32"),
+    # 100 ms blocks for many probes
+    "high_throughput": StreamingProfile("high_throughput", 2000, 8, "float32"),
+}
+
+AUTOTUNE_BLOCK_SIZES = (100, 200, 250, 500, 1000, 2000)
+
+
+def block_processor(
+    remap: ChannelRemap,
+    filter_settings: FilterSettings,
+    transport: str,
+    n_probes: int,
+    num_samples: int,
+    FREQ: int = 20000,
+    filter_dtype: str = "float32",
+) -> Callable[[], None]:
+    """Returns a function that remaps, filters and converts one block of random
+    data of n_probes probes, like the data thread does for every block."""
+    num_channels = remap.num_channels
+    rng = np.random.default_rng(0)
+    databuffer = rng.integers(
+        0, 2**12, (n_probes, num_samples, remap.chip_channels), dtype="uint16"
+    )
+    remapped = np.empty((num_channels * n_probes, num_samples), dtype="uint16")
+    sendbuffer = np.empty_like(remapped, dtype=OE_TRANSPORTS[transport][1])
+    filters = FilterBank(filter_settings, num_channels * n_probes, FREQ, filter_dtype)
+
+    def process() -> None:
+        for index in range(n_probes):
+            rows = slice(index * num_channels, (index + 1) * num_channels)
+            remap.apply(databuffer[index], out=remapped[rows])
+            convert_block(filters.apply(remapped[rows], rows), sendbuffer[rows])
+        sendbuffer.tobytes()
+
+    return process
+
+
+def autotune_profile(
+    make_processor: Callable[[int, str], Callable[[], None]],
+    FREQ: int = 20000,
+    block_sizes: Tuple[int, ...] = AUTOTUNE_BLOCK_SIZES,
+    headroom: float = 0.5,
+    repeats: int = 20,
+    filter_dtype: str = "float32",
+) -> Tuple[StreamingProfile, dict]:
+    """
+    Measures the processing time of a block for increasing block sizes and picks
+    the smallest block of which the processing takes at most headroom times the
+    duration of the block. The largest block size is used if none does.
+
+    The 95th percentile of the processing time is used, so that occasional slow
+    blocks are accounted for. The queue depth covers 100 ms of blocks.
+
+    Arguments:
+    - make_processor: returns a function that processes one block, given the block
+    size and filter dtype, see block_processor
+    - headroom: fraction of real time that processing may take
+
+    Returns the profile and the measured times in seconds per block size.
+    """
+    timings = {}
+    for num_samples in sorted(block_sizes):
+        process = make_processor(num_samples, filter_dtype)
+        process()
+        durations = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            process()
+            durations.append(time.perf_counter() - t0)
+        durations.sort()
+        timings[num_samples] = durations[int(0.95 * (repeats - 1))]
+        if timings[num_samples] <= headroom * num_samples / FREQ:
+            break
+    queue_depth = min(max(2, -(-FREQ // (10 * num_samples))), 16)
+    profile = StreamingProfile("auto", num_samples, queue_depth, filter_dtype)
+    logger.info(f"Auto-tuned streaming profile: {profile}, timings: {timings}")
+    return profile, timings
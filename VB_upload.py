@@ -0,0 +1,284 @@
+import logging
+import logging.handlers
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = logging.getLogger("VB_upload")
+logger.setLevel(logging.DEBUG)
+socketHandler = logging.handlers.SocketHandler(
+    "localhost", logging.handlers.DEFAULT_TCP_LOGGING_PORT
+)
+logger.addHandler(socketHandler)
+
+
+@dataclass
+class ProbeUpload:
+    """Result of the upload of the settings of one probe. seconds is the time of the
+    NVP calls, without waited, the time spent waiting for the lock of the box, and
+    queued, the time the upload waited for a thread of UploadExecutor."""
+
+    box: int
+    probe: int
+    seconds: float = 0.0
+    calls: int = 0
+    skipped: int = 0
+    error: str = ""
+    waited: float = 0.0
+    queued: float = 0.0
+
+    def __str__(self):
+        if self.error:
+            return f"box {self.box} probe {self.probe} failed: {self.error}"
+        return f"box {self.box} probe {self.probe}: {self.seconds * 1000:.1f} ms, \
+{self.waited * 1000:.1f} ms waiting for the box, {self.queued * 1000:.1f} ms queued"
+
+
+class UploadError(Exception):
+    """The upload of one or more probes failed, see results."""
+
+    def __init__(self, results: List[ProbeUpload]):
+        self.results = results
+        failed = [result for result in results if result.error]
+        super().__init__(
+            f"Upload of {len(failed)} of {len(results)} probes failed: "
+            + "; ".join(str(result) for result in failed)
+        )
+
+
+class UploadExecutor:
+    """
+    Uploads the settings of probes at the same time on a thread pool. The NVP calls
+    release the GIL while they wait for the ViperBox.
+
+    Every probe is uploaded by one task, so the calls for a probe keep their order.
+    The probes of one box share its handle: CommandBuffer.flush makes the calls
+    that use it one at a time, the calls that only stage settings of the probe are
+    made at the same time for all probes. With max_workers=1 all probes are
+    uploaded one after the other.
+
+    Arguments:
+    - max_workers: maximum number of probes that are uploaded at the same time
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="upload")
+
+    def run(
+        self, uploads: Dict[Tuple[int, int], Callable[[], ProbeUpload]]
+    ) -> List[ProbeUpload]:
+        """Runs the uploads by (box, probe), which return the ProbeUpload of their
+        flush, and waits until all are done. Raises UploadError if any upload
+        failed, after the other uploads are done."""
+        submitted = time.perf_counter()
+        futures = {
+            key: self._pool.submit(self._timed, *key, upload, submitted)
+            for key, upload in uploads.items()
+        }
+        results = [future.result() for future in futures.values()]
+        for result in results:
+            logger.debug(f"Upload of {result}")
+        if any(result.error for result in results):
+            raise UploadError(results)
+        return results
+
+    @staticmethod
+    def _timed(
+        box: int, probe: int, upload: Callable[[], ProbeUpload], submitted: float
+    ) -> ProbeUpload:
+        started = time.perf_counter()
+        try:
+            result = upload()
+        except Exception as e:
+            logger.error(
+                f"Upload of box {box} probe {probe} failed: {traceback.format_exc()}"
+            )
+            result = ProbeUpload(box, probe, error=repr(e))
+            result.seconds = time.perf_counter() - started
+        result.queued = started - submitted
+        return result
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
+
+
+# Calls that write the values set by other calls to the hardware, with those calls
+WRITES = {
+    "writeChannelConfiguration": {
+        "selectElectrode",
+        "setReference",
+        "setGain",
+        "setAZ",
+    },
+}
+# Calls that only stage a value in the configuration of the probe in NeuraviperPy,
+# without sending anything over the handle of the box
+STAGED = set().union(*WRITES.values())
+
+
+@dataclass
+class Command:
+    """Call of NeuraviperPy.<name>(handle of box, probe, *key, *args). key is what
+    the call sets, e.g. (channel,), and is None for writes."""
+
+    name: str
+    box: int
+    probe: int
+    key: tuple | None
+    args: tuple
+
+    def __str__(self):
+        return f"{self.name}(box {self.box}, probe {self.probe}, \
+{', '.join(map(repr, (self.key or ()) + self.args))})"
+
+
+@dataclass
+class _ProbeCommands:
+    # Pending sets by (name, key), in the order in which they were first added
+    sets: Dict[Tuple[str, tuple], Command] = field(default_factory=dict)
+    writes: Dict[str, Command] = field(default_factory=dict)
+    # Arguments of the flushed sets by (name, key)
+    state: Dict[Tuple[str, tuple], tuple] = field(default_factory=dict)
+    # Writes of which calls were flushed after the last write
+    unwritten: set = field(default_factory=set)
+    dropped: int = 0
+
+
+class CommandBuffer:
+    """
+    Collects calls of NeuraviperPy functions per probe and makes them on flush,
+    leaving out the calls that don't change anything:
+    - set: a call that sets a value, e.g. the gain of a channel. A later set of the
+      same name and key replaces it, and it is left out if the last flushed set of
+      the name and key had the same arguments.
+    - write: a call that writes values set by the calls in WRITES[name] to the
+      hardware, after the sets of the probe. It is left out if none of those calls
+      were flushed since the last time it was.
+
+    The calls of a flush that use the handle of the box, all but the STAGED calls,
+    are made while holding the lock of the box, so flushes of probes of the same box
+    from different threads don't use its handle at the same time. The STAGED calls
+    of the probes of a box are made at the same time. With dry_run, flush doesn't
+    call NeuraviperPy but only returns the calls, as if they were made.
+
+    Arguments:
+    - nvp: the NeuraviperPy module
+    - handles: device handles by box
+    - dry_run: don't call NeuraviperPy
+    """
+
+    def __init__(self, nvp: Any, handles: Dict[int, Any], dry_run: bool = False):
+        self.nvp = nvp
+        self.handles = handles
+        self.dry_run = dry_run
+        self._probes: Dict[Tuple[int, int], _ProbeCommands] = {}
+        self._box_locks: Dict[int, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _commands(self, box: int, probe: int) -> _ProbeCommands:
+        with self._lock:
+            return self._probes.setdefault((box, probe), _ProbeCommands())
+
+    def _box_lock(self, box: int) -> threading.Lock:
+        with self._lock:
+            return self._box_locks.setdefault(box, threading.Lock())
+
+    def set(self, name: str, box: int, probe: int, key: tuple, *args) -> None:
+        commands = self._commands(box, probe)
+        if (name, key) in commands.sets:
+            commands.dropped += 1
+        commands.sets[(name, key)] = Command(name, box, probe, key, args)
+
+    def write(self, name: str, box: int, probe: int, *args) -> None:
+        commands = self._commands(box, probe)
+        if name in commands.writes:
+            commands.dropped += 1
+        commands.writes[name] = Command(name, box, probe, None, args)
+
+    def forget(self, box: int | None = None, probe: int | None = None) -> None:
+        """Forgets the flushed values of a probe, e.g. after it is initialized, of
+        all probes of a box without probe, or of all boxes without box."""
+        with self._lock:
+            for key in list(self._probes):
+                if box in (None, key[0]) and probe in (None, key[1]):
+                    del self._probes[key]
+
+    def plan(self, box: int, probe: int) -> List[Command]:
+        """Returns the calls that a flush of the probe would make."""
+        commands = self._commands(box, probe)
+        plan = [
+            command
+            for key, command in commands.sets.items()
+            if commands.state.get(key) != command.args
+        ]
+        flushed = {command.name for command in plan}
+        plan += [
+            command
+            for name, command in commands.writes.items()
+            if name not in WRITES
+            or name in commands.unwritten
+            or flushed & WRITES[name]
+        ]
+        return plan
+
+    def flush(self, box: int, probe: int) -> Tuple[ProbeUpload, List[Command]]:
+        """Makes the calls of the probe, returns the number of calls that were made
+        and left out, the time they took, the time spent waiting for the lock of the
+        box and the calls. On an error, the calls that weren't made yet are dropped
+        and the error is raised."""
+        commands = self._commands(box, probe)
+        plan = self.plan(box, probe)
+        result = ProbeUpload(
+            box,
+            probe,
+            calls=len(plan),
+            skipped=commands.dropped
+            + len(commands.sets)
+            + len(commands.writes)
+            - len(plan),
+        )
+        commands.sets = {}
+        commands.writes = {}
+        commands.dropped = 0
+        box_lock = self._box_lock(box)
+        start = time.perf_counter()
+        for command in plan:
+            if command.key is not None:
+                # Unknown if the call fails
+                commands.state.pop((command.name, command.key), None)
+            if not self.dry_run:
+                self._call(command, box_lock, result)
+            if command.key is not None:
+                commands.state[(command.name, command.key)] = command.args
+                commands.unwritten.update(
+                    name for name, sets in WRITES.items() if command.name in sets
+                )
+            else:
+                commands.unwritten.discard(command.name)
+        result.seconds = time.perf_counter() - start - result.waited
+        logger.debug(f"Flushed {result}, {result.calls} calls")
+        return result, plan
+
+    def _call(
+        self, command: Command, box_lock: threading.Lock, result: ProbeUpload
+    ) -> None:
+        """Makes the call, holding the lock of the box unless it is STAGED, and adds
+        the time spent waiting for the lock to result.waited."""
+        call = getattr(self.nvp, command.name)
+        arguments = (
+            self.handles[command.box],
+            command.probe,
+            *(command.key or ()),
+            *command.args,
+        )
+        if command.name in STAGED:
+            call(*arguments)
+            return
+        start = time.perf_counter()
+        with box_lock:
+            result.waited += time.perf_counter() - start
+            call(*arguments)
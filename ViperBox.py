@@ -1,4 +1,6 @@
 import copy
+import functools
+import json
 import logging
 import logging.handlers
 import os
@@ -6,13 +8,15 @@ import socket
 import threading
 import time
 import traceback
+from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 from typing import Any, List, Tuple
 
 import numpy as np
 import requests
 from lxml import etree
-from scipy import signal
 
 import NeuraviperPy as NVP
 from defaults.defaults import Mappings
@@ -25,6 +29,19 @@ from VB_classes import (
     StatusTracking,
     parse_numbers,
 )
+from VB_convert import convert_recording
+from VB_jobs import JobQueue
+from VB_recordings import (
+    PREVIEW_FACTORS,
+    IntegrityScanner,
+    PreviewPyramid,
+    TimeIndex,
+    archive_path,
+    preview_path,
+    spikes_path,
+    zarr,
+)
+from VB_upload import CommandBuffer, ProbeUpload, UploadExecutor
 from XML_handler import (
     add_to_stimrec,
     check_xml_boxprobes_exist_and_verify_data_with_settings,
@@ -33,6 +50,27 @@ from XML_handler import (
     verify_params,
     verify_step_min_max,
 )
+from VB_streaming import (
+    ArchiveSettings,
+    ArchiveWriter,
+    BufferPool,
+    ChannelRemap,
+    FilterBank,
+    FilterSettings,
+    OE_TRANSPORTS,
+    STREAMING_PROFILES,
+    Pacer,
+    SpikeDetector,
+    SpikeSettings,
+    StreamingProfile,
+    StreamPipeline,
+    TailReader,
+    align_block,
+    align_streams,
+    autotune_profile,
+    block_processor,
+    convert_block,
+)
 
 # TODO: implement rotation of logs to not hog up memory
 
@@ -55,6 +93,8 @@ class ViperBox:
         self.uploaded_settings = GeneralSettings()
         self.tracking = StatusTracking()
         self._box_ptrs: Any = {}
+        # NVP calls of the settings, leaves out calls that don't change anything
+        self.commands = CommandBuffer(NVP, self._box_ptrs)
         self.mapping = Mappings("defaults/electrode_mapping_short_cables.xlsx")
 
         self._session_datetime = _session_datetime
@@ -77,10 +117,29 @@ class ViperBox:
             "localhost", logging.handlers.DEFAULT_TCP_LOGGING_PORT
         )
         self.logger.addHandler(socketHandler)
-        self.mtx = self._os2chip_mat()
+        self.remap = ChannelRemap(self.mapping.electrode_mapping, self.NUM_CHANNELS)
+        self.filter_settings = FilterSettings()
+        # Element type of the data sent to Open Ephys, one of OE_TRANSPORTS
+        self.transport = "U16"
+        self.stream_profile = STREAMING_PROFILES["default"]
+        self._autotune_timings: dict = {}
+        # Threshold crossing detection on the stream, None to disable
+        self.spike_settings: SpikeSettings | None = None
+        self.archive_settings: ArchiveSettings | None = None
+        # Created on first use, so that importing main doesn't start the job queue
+        self._jobs: JobQueue | None = None
+        # Settings of the probes of different boxes are uploaded at the same time
+        self.uploads = UploadExecutor()
 
         return None
 
+    @property
+    def jobs(self) -> JobQueue:
+        """Queue of the background jobs, started on first use."""
+        if self._jobs is None:
+            self._jobs = JobQueue(Path.cwd() / "Recordings" / "jobs.json")
+        return self._jobs
+
     def connect_oe(self, reset=False) -> Tuple[bool, str]:
         """
         Check if Open Ephys is running and start it if not.
@@ -110,7 +169,16 @@ class ViperBox:
             self.logger.info("Data thread exists")
         else:
             self.data_thread = _DataSenderThread(
-                self.NUM_SAMPLES, self.FREQ, self.NUM_CHANNELS, self.mtx
+                self.NUM_SAMPLES,
+                self.FREQ,
+                self.NUM_CHANNELS,
+                self.remap,
+                filter_settings=self.filter_settings,
+                transport=self.transport,
+                queue_depth=self.stream_profile.queue_depth,
+                filter_dtype=self.stream_profile.filter_dtype,
+                spike_settings=self.spike_settings,
+                archive_settings=self.archive_settings,
             )
             self.data_thread.start("", 0, empty=True)
             r = requests.put(
@@ -124,7 +192,16 @@ class ViperBox:
         if reset:
             self.data_thread.shutdown()
             self.data_thread = _DataSenderThread(
-                self.NUM_SAMPLES, self.FREQ, self.NUM_CHANNELS, self.mtx
+                self.NUM_SAMPLES,
+                self.FREQ,
+                self.NUM_CHANNELS,
+                self.remap,
+                filter_settings=self.filter_settings,
+                transport=self.transport,
+                queue_depth=self.stream_profile.queue_depth,
+                filter_dtype=self.stream_profile.filter_dtype,
+                spike_settings=self.spike_settings,
+                archive_settings=self.archive_settings,
             )
             self.data_thread.start("", 0, empty=True)
             r = requests.put(
@@ -267,6 +344,9 @@ boxless: {boxless}."
             try:
                 NVP.init(self._box_ptrs[box], int(probe))  # Initialize all probes
                 self.logger.info(f"Probe {probe} initialized: {self._box_ptrs[box]}")
+                self.commands.forget(box, probe)
+                self._set_os_flags(box, probe)
+                self.commands.flush(box, probe)
                 self.local_settings.boxes[0].probes[probe] = ProbeSettings()
                 self.connected.boxes[0].probes[probe] = True
             except Exception as error:
@@ -307,6 +387,7 @@ boxless: {boxless}."
             self._deviceId = 0
             self.tracking.box_connected = False
             self.uploaded_settings = GeneralSettings()
+            self.commands.forget()
             self.logger.info("ViperBox disconnected")
         except KeyError as e:
             self.logger.debug(
@@ -323,6 +404,9 @@ Please restart the ViperBox and the software and try again.",
 
     def shutdown(self) -> Tuple[bool, str]:
         self.disconnect()
+        if self._jobs is not None:
+            self._jobs.close()
+        self.uploads.shutdown()
         # if not self.headless:
         # try:
         #     _ = requests.put(
@@ -342,62 +426,116 @@ Please restart the ViperBox and the software and try again.",
         #     pass
         return True, "ViperBox shutdown"
 
-    def _upload_recording_settings(self, updated_tmp_settings):
+    def _upload_recording_settings(self, updated_tmp_settings) -> Tuple[int, int]:
+        """Uploads the channel settings that differ from uploaded_settings, probes
+        without changes aren't written. The probes of different boxes are uploaded at
+        the same time, see VB_upload.UploadExecutor. Returns the number of NVP calls
+        that were made and the number that were skipped because the settings didn't
+        change."""
         if self.boxless is True:
             self.logger.info(
                 "No box connected, skipping uploading recording settings \
 to ViperBox"
             )
-            return
+            return 0, 0
 
         # TODO multibox this should be added to general settings and loaded if the
         # instructions do not come from XML but from probably the GUI.
         self.mapping = Mappings("defaults/electrode_mapping_short_cables.xlsx")
+        channel_input = self.mapping.channel_input
 
-        for box in updated_tmp_settings.boxes.keys():
-            for probe in updated_tmp_settings.boxes[box].probes.keys():
-                for channel in (
-                    updated_tmp_settings.boxes[box].probes[probe].channel.keys()
-                ):
-                    try:
-                        NVP.selectElectrode(
-                            self._box_ptrs[box],
-                            probe,
-                            channel,
-                            self.mapping.channel_input[channel],
-                        )
-                    except KeyError:
-                        NVP.selectElectrode(self._box_ptrs[box], probe, channel, 0)
-                    NVP.setReference(
-                        self._box_ptrs[box],
-                        probe,
-                        channel,
-                        updated_tmp_settings.boxes[box]
-                        .probes[probe]
-                        .channel[channel]
-                        .get_refs,
-                    )
-                    NVP.setGain(
-                        self._box_ptrs[box],
-                        probe,
-                        channel,
-                        updated_tmp_settings.boxes[box]
-                        .probes[probe]
-                        .channel[channel]
-                        .gain,
-                    )
-                    NVP.setAZ(
-                        self._box_ptrs[box], probe, channel, False
-                    )  # see email Patrick 08/01/2024
+        results = self.uploads.run(
+            {
+                (box, probe): functools.partial(
+                    self._upload_probe_recording_settings,
+                    box,
+                    probe,
+                    updated_tmp_settings.boxes[box].probes[probe],
+                    channel_input,
+                )
+                for box in updated_tmp_settings.boxes.keys()
+                for probe in updated_tmp_settings.boxes[box].probes.keys()
+            }
+        )
+        calls = sum(result.calls for result in results)
+        skipped = sum(result.skipped for result in results)
+        self.logger.info(
+            f"Recording settings uploaded with {calls} NVP calls, {skipped} calls \
+skipped because the settings didn't change ({', '.join(map(str, results))})"
+        )
+        return calls, skipped
 
-                self.logger.debug(
-                    f"Writing Channel config: \
-{updated_tmp_settings.boxes[box].probes[probe]}"
+    def _upload_probe_recording_settings(
+        self,
+        box: int,
+        probe: int,
+        probe_settings: ProbeSettings,
+        channel_input: dict,
+    ) -> ProbeUpload:
+        uploaded = None
+        if box in self.uploaded_settings.boxes:
+            uploaded = self.uploaded_settings.boxes[box].probes.get(probe)
+        changes = probe_settings.changed_channels(uploaded)
+        # Electrode, reference, gain and AZ of every channel and the write
+        all_calls = 4 * len(probe_settings.channel) + (not self.emulation)
+        if not changes:
+            self.logger.debug(f"Channel config of box {box} probe {probe} unchanged")
+            return ProbeUpload(box, probe, skipped=all_calls)
+
+        for channel, changed in changes.items():
+            settings = probe_settings.channel[channel]
+            if "electrode" in changed:
+                self.commands.set(
+                    "selectElectrode",
+                    box,
+                    probe,
+                    (channel,),
+                    channel_input.get(channel, 0),
                 )
-                if not self.emulation:
-                    NVP.writeChannelConfiguration(self._box_ptrs[box], probe, False)
+            if "references" in changed:
+                self.commands.set(
+                    "setReference", box, probe, (channel,), settings.get_refs
+                )
+            if "gain" in changed:
+                self.commands.set("setGain", box, probe, (channel,), settings.gain)
+            if "electrode" in changed:
+                # see email Patrick 08/01/2024
+                self.commands.set("setAZ", box, probe, (channel,), False)
+        if not self.emulation:
+            self.commands.write("writeChannelConfiguration", box, probe, False)
 
-    def _upload_stimulation_settings(self, updated_tmp_settings: GeneralSettings):
+        self.logger.debug(
+            f"Writing Channel config of {len(changes)} changed channels: \
+{probe_settings}"
+        )
+        try:
+            result, _ = self.commands.flush(box, probe)
+        except Exception:
+            # The probe is partly configured, upload all channels next time
+            if uploaded is not None:
+                uploaded.channel = {}
+            raise
+        if uploaded is not None:
+            uploaded.channel = copy.deepcopy(probe_settings.channel)
+        result.skipped = all_calls - result.calls
+        return result
+
+    def _set_os_flags(self, box: int, probe: int) -> None:
+        """Disables discharge permission and enables stimulation blanking of every OS
+        of the probe, with the next flush of the commands. These flags never change,
+        so they are only sent when the probe is initialized."""
+        for OS in range(128):
+            self.commands.set("setOSDischargeperm", box, probe, (OS,), False)
+            self.commands.set("setOSStimblank", box, probe, (OS,), True)
+
+    def _upload_stimulation_settings(
+        self, updated_tmp_settings: GeneralSettings
+    ) -> Tuple[int, int]:
+        """Uploads the OS image and SU configurations that differ from the ones that
+        were last applied to the probes. The probes of different boxes are uploaded
+        at the same time, see VB_upload.UploadExecutor. Returns the number of NVP
+        calls that were made and the number that were skipped because the settings
+        didn't change."""
         self.logger.info(
             f"Writing stimulation settings to ViperBox: {updated_tmp_settings}"
         )
@@ -406,31 +544,44 @@ to ViperBox"
                 "No box connected, skipping uploading stimulation \
 settings to ViperBox"
             )
-            return
-        for box in updated_tmp_settings.boxes.keys():
-            for probe in updated_tmp_settings.boxes[box].probes.keys():
-                # Always set settings for entire probe at once.
-                NVP.setOSimage(
-                    self._box_ptrs[box],
-                    probe,
-                    updated_tmp_settings.boxes[box].probes[probe].os_data,
-                )
-                for OS in range(128):
-                    NVP.setOSDischargeperm(self._box_ptrs[box], probe, OS, False)
-                    NVP.setOSStimblank(self._box_ptrs[box], probe, OS, True)
+            return 0, 0
 
-            for SU in (
-                updated_tmp_settings.boxes[box].probes[probe].stim_unit_sett.keys()
-            ):
-                NVP.writeSUConfiguration(
-                    self._box_ptrs[box],
+        results = self.uploads.run(
+            {
+                (box, probe): functools.partial(
+                    self._upload_probe_stimulation_settings,
+                    box,
                     probe,
-                    SU,
-                    *updated_tmp_settings.boxes[box]
-                    .probes[probe]
-                    .stim_unit_sett[SU]
-                    .SUConfig(),
+                    updated_tmp_settings.boxes[box].probes[probe],
                 )
+                for box in updated_tmp_settings.boxes.keys()
+                for probe in updated_tmp_settings.boxes[box].probes.keys()
+            }
+        )
+        calls = sum(result.calls for result in results)
+        skipped = sum(result.skipped for result in results)
+        self.logger.info(
+            f"Stimulation settings uploaded with {calls} NVP calls, {skipped} calls \
+skipped because the settings didn't change ({', '.join(map(str, results))})"
+        )
+        return calls, skipped
+
+    def _upload_probe_stimulation_settings(
+        self, box: int, probe: int, probe_settings: ProbeSettings
+    ) -> ProbeUpload:
+        # Normally already set when the probe was initialized
+        self._set_os_flags(box, probe)
+        self.commands.set("setOSimage", box, probe, (), probe_settings.os_data)
+        for SU in probe_settings.stim_unit_sett.keys():
+            self.commands.set(
+                "writeSUConfiguration",
+                box,
+                probe,
+                (SU,),
+                *probe_settings.stim_unit_sett[SU].SUConfig(),
+            )
+        result, _ = self.commands.flush(box, probe)
+        return result
 
     def recording_settings(
         self,
@@ -488,9 +639,9 @@ custom XML settings, use the verify_xml API call.",
         )
 
         try:
-            # Always set settings for entire probe at once.
+            # Only channels that changed are set, the entire probe is written at once.
             # TODO boxfix: also loop over boxes
-            self._upload_recording_settings(updated_tmp_settings)
+            calls, skipped = self._upload_recording_settings(updated_tmp_settings)
         except Exception as e:
             return (
                 False,
@@ -501,6 +652,12 @@ reverted to previous settings. Error: {self._er(e)}",
         self.local_settings = updated_tmp_settings  # Why not deepcopy??
         self.logger.info("uploaded_settings = local_settings")
         self.uploaded_settings = copy.deepcopy(self.local_settings)
+        if skipped:
+            return (
+                True,
+                f"Recording settings loaded, {skipped} of {calls + skipped} calls to \
+the ViperBox skipped because the settings didn't change",
+            )
         return True, "Recording settings loaded"
 
     def _stimrec_write_recording_settings(self, settings_to_write, start_time, dt_time):
@@ -629,7 +786,7 @@ reverted to previous settings. Error: {self._er(e)}",
         # TODO boxfix: also loop over boxes
         start_time = self._time()
         try:
-            self._upload_stimulation_settings(updated_tmp_settings)
+            calls, skipped = self._upload_stimulation_settings(updated_tmp_settings)
             self.uploaded_settings = copy.deepcopy(updated_tmp_settings)
             self.tracking.stimulation_settings_uploaded = True
             self.tracking.stimulation_settings_written_to_stimrec = False
@@ -653,6 +810,12 @@ reverted to previous settings. Error: {self._er(e)}",
         #     if result is False:
         #         return result, feedback
 
+        if skipped:
+            return (
+                True,
+                f"Stimulation settings loaded, {skipped} of {calls + skipped} calls \
+to the ViperBox skipped because the settings didn't change",
+            )
         return True, "Stimulation settings loaded"
 
     def verify_xml_with_local_settings(
@@ -760,6 +923,188 @@ reverted to previous settings. Error: {self._er(e)}",
 
         return True, "Default recording and stimulation settings loaded"
 
+    def streaming_profile(
+        self, profile: str = "default", transport: str = "U16"
+    ) -> Tuple[bool, str]:
+        """Select the block size, queue depth, filter precision and element type of
+        the stream to Open Ephys.
+
+        Arguments:
+        - profile: one of STREAMING_PROFILES, or 'auto' to measure the processing
+        time per block for the connected probes and pick the smallest block that
+        leaves headroom under real time.
+        - transport: one of OE_TRANSPORTS, U16 only without high-pass and band-pass
+        filters
+        """
+        if self.tracking.recording is True:
+            return False, "Can't change the streaming profile while recording"
+        if transport not in OE_TRANSPORTS:
+            return (
+                False,
+                f"Unknown transport {transport}, choose from {list(OE_TRANSPORTS)}",
+            )
+        if transport == "U16" and self.filter_settings.removes_dc:
+            return (
+                False,
+                "The high-pass and band-pass filters output negative values, choose \
+transport S16 or F32",
+            )
+
+        if profile == "auto":
+            # TODO boxfix: only box 0 is streamed
+            n_probes = 1
+            if 0 in self.connected.boxes:
+                n_probes = max(1, sum(self.connected.boxes[0].probes.values()))
+            new_profile, self._autotune_timings = autotune_profile(
+                lambda num_samples, filter_dtype: block_processor(
+                    self.remap,
+                    self.filter_settings,
+                    transport,
+                    n_probes,
+                    num_samples,
+                    self.FREQ,
+                    filter_dtype,
+                ),
+                self.FREQ,
+            )
+        elif profile in STREAMING_PROFILES:
+            new_profile = STREAMING_PROFILES[profile]
+            self._autotune_timings = {}
+        else:
+            return (
+                False,
+                f"Unknown streaming profile {profile}, choose from \
+{list(STREAMING_PROFILES)} or 'auto'",
+            )
+
+        if hasattr(self, "data_thread"):
+            try:
+                self.data_thread.set_profile(new_profile, transport)
+            except RuntimeError as e:
+                return False, str(e)
+        self.stream_profile = new_profile
+        self.transport = transport
+        self.NUM_SAMPLES = new_profile.num_samples
+        self.logger.info(f"Streaming profile set to {new_profile}, {transport}")
+        return (
+            True,
+            f"Streaming profile set to {new_profile.name}: {new_profile.num_samples} \
+samples per block, queue depth {new_profile.queue_depth}, \
+{new_profile.filter_dtype} filters, {transport} samples",
+        )
+
+    def get_streaming_profile(self) -> dict:
+        """Returns the parameters of the streaming profile, the duration of a block
+        and the processing time per block size that was measured by 'auto'."""
+        return {
+            **asdict(self.stream_profile),
+            "transport": self.transport,
+            "block_duration": self.stream_profile.num_samples / self.FREQ,
+            "autotune_timings": self._autotune_timings,
+        }
+
+    def filters(
+        self,
+        highpass: float | None = None,
+        bandpass: Tuple[float, float] | None = None,
+        order: int = 2,
+        line_frequency: float | None = 50.0,
+        harmonics: int = 1,
+        Q: float = 30.0,
+    ) -> Tuple[bool, str]:
+        """Sets the filters of the stream to Open Ephys, see
+        VB_streaming.FilterSettings for the arguments."""
+        if self.tracking.recording is True:
+            return False, "Can't change the filters while recording"
+
+        try:
+            filter_settings = FilterSettings(
+                highpass, bandpass, order, line_frequency, harmonics, Q
+            )
+            # Cutoff frequencies above the Nyquist frequency are refused here
+            filter_settings.sos(self.FREQ)
+        except ValueError as e:
+            return False, f"Invalid filter settings: {e}"
+        if filter_settings.removes_dc and self.transport == "U16":
+            return (
+                False,
+                "The high-pass and band-pass filters output negative values, first \
+choose transport S16 or F32 with /streaming_profile/",
+            )
+        if hasattr(self, "data_thread"):
+            try:
+                self.data_thread.set_filter_settings(filter_settings)
+            except RuntimeError as e:
+                return False, str(e)
+        self.filter_settings = filter_settings
+        self.logger.info(f"Filters set to {filter_settings}")
+        return True, f"Filters set to {filter_settings}"
+
+    def spike_detection(
+        self,
+        enabled: bool = False,
+        threshold: float = 5.0,
+        refractory: float = 0.001,
+        send_events: bool = False,
+        band: Tuple[float, float] = (300.0, 3000.0),
+    ) -> Tuple[bool, str]:
+        """Enables or disables the threshold crossing detection on the stream to
+        Open Ephys, see VB_streaming.SpikeSettings for the arguments. The detection
+        runs on the remapped data with its own band-pass filter, not on the output of
+        the filters of the stream. The spikes of a recording are written next to it,
+        <name>_probe<probe>_spikes.dat."""
+        if self.tracking.recording is True:
+            return False, "Can't change the spike detection while recording"
+
+        spike_settings = None
+        if enabled:
+            try:
+                spike_settings = SpikeSettings(
+                    threshold, refractory, send_events=send_events, band=tuple(band)
+                )
+                spike_settings.filter_settings.sos(self.FREQ)
+            except ValueError as e:
+                return False, f"Invalid spike detection band: {e}"
+        if hasattr(self, "data_thread"):
+            try:
+                self.data_thread.set_spike_settings(spike_settings)
+            except RuntimeError as e:
+                return False, str(e)
+        self.spike_settings = spike_settings
+        self.logger.info(f"Spike detection set to {spike_settings}")
+        if spike_settings is None:
+            return True, "Spike detection disabled"
+        return (
+            True,
+            f"Spike detection enabled: {band[0]:g}-{band[1]:g} Hz, threshold \
+{threshold} x noise, refractory period {refractory * 1000:.1f} ms, events \
+{'sent' if send_events else 'not sent'} to Open Ephys",
+        )
+
+    def archive(
+        self, enabled: bool = False, cpu_budget: float = 0.25
+    ) -> Tuple[bool, str]:
+        """Enables or disables the compressed archive of the stream of a recording,
+        <name>.vbarch next to it, see VB_streaming.ArchiveWriter. The archive uses
+        at most cpu_budget of a core, the blocks that can't be compressed in time
+        are left out of it."""
+        if self.tracking.recording is True:
+            return False, "Can't change the archive while recording"
+
+        archive_settings = None
+        if enabled:
+            archive_settings = ArchiveSettings(cpu_budget)
+        if hasattr(self, "data_thread"):
+            try:
+                self.data_thread.set_archive_settings(archive_settings)
+            except RuntimeError as e:
+                return False, str(e)
+        self.archive_settings = archive_settings
+        self.logger.info(f"Archive set to {archive_settings}")
+        if archive_settings is None:
+            return True, "Archive disabled"
+        return True, f"Archive enabled with a CPU budget of {cpu_budget:.0%} of a core"
+
     def start_recording(self, recording_name: str = "") -> Tuple[bool, str]:
         """Start recording.
 
@@ -803,6 +1148,18 @@ reverted to previous settings. Error: {self._er(e)}",
 upload your custom settings and then try again.""",
                         )
 
+        # TODO boxfix: only box 0 is recorded, all its probes are in the same file
+        box = 0
+        probes = []
+        if box in self.connected.boxes:
+            probes = [
+                probe
+                for probe, connected in sorted(self.connected.boxes[box].probes.items())
+                if connected
+            ]
+        if not probes:
+            return False, "No connected probes to record, first connect the ViperBox"
+
         self._recording_datetime = time.strftime("%Y%m%d_%H%M%S")
 
         rec_folder = Path.cwd() / "Recordings"
@@ -902,14 +1259,18 @@ upload your custom settings and then try again.""",
         )
 
         self.tracking.recording = True
+        # Background jobs would compete with the recording for CPU and disk
+        self.jobs.pause()
 
-        # TODO fix probe number
-        # probably add a que for all data streams and be able to let open ephys
-        # switch between them
         self.oe_socket = True
-        probe = 0
-        self.logger.debug("Start sending data")
-        self.data_thread.start(self._rec_path, probe, empty=False)
+        self.logger.debug(f"Start sending data of probes {probes}")
+        self.data_thread.start(
+            self._rec_path,
+            probes,
+            empty=False,
+            follow=True,
+            start_time=self._rec_start_time,
+        )
 
         self.logger.info(f"Recording started: {recording_name}")
         return True, f"Recording started: {recording_name}"
@@ -950,12 +1311,6 @@ upload your custom settings and then try again.""",
         except Exception:
             os.startfile("C:\Program Files\Open Ephys\open-ephys.exe")
 
-    def _os2chip_mat(self):
-        mtx = np.zeros((64, 60), dtype="uint16")
-        for k, v in self.mapping.electrode_mapping.items():
-            mtx[k][v] = 1
-        return mtx
-
     def stop_recording(self) -> Tuple[bool, str]:
         if self.tracking.box_connected is False:
             return False, "Not connected to ViperBox"
@@ -973,6 +1328,9 @@ upload your custom settings and then try again.""",
         NVP.setFileStream(self._box_ptrs[box], "")
         dt_time = self._time() - start_time
         self.oe_socket = False
+        # The data thread follows the recording file to the end of the closed file
+        if hasattr(self, "data_thread"):
+            self.data_thread.finish()
 
         self.logger.debug("Write to stimrec")
         add_to_stimrec(
@@ -987,53 +1345,120 @@ upload your custom settings and then try again.""",
         self.tracking.recording = False
         self._rec_start_time = None
 
-        # TODO: combine stim history and recording into some file format
-        # self._convert_recording()
+        # Indexing, integrity checks and conversion run in the background
+        self._queue_post_recording_jobs()
+        self.jobs.resume()
 
         return True, "Recording stopped"
 
-    def _convert_recording(
-        self,
-    ) -> None:
-        """
-        Converts the raw recording into a numpy format.
+    def _conversion_args(
+        self, output_format: str = "zarr", output_path: Path | None = None
+    ) -> dict:
         """
-        # TODO: not implemented
+        Returns the arguments of VB_convert.convert_recording for the last
+        recording of all connected probes, by default next to the recording.
 
-        # convert_recording_read_handle = NVP.streamOpenFile(
-        #     str(self._rec_path), self._probe
-        # )
+        Arguments:
+        - output_format: 'zarr' for a chunked, compressed Zarr store (.zarr), see
+        VB_convert.convert_to_zarr, 'memmap' for memory-mappable files per probe
+        (<name>_probe<probe>.json/.dat), see VB_convert.convert_to_sidecar, or
+        'bundle' for a Zarr store (<name>_bundle.zarr) that also contains the
+        settings and the events of the stimulation record, see
+        VB_convert.write_bundle
+        - output_path: path of the Zarr store or base path of the memmap files
+        """
+        default_paths = {
+            "zarr": self._rec_path.with_suffix(".zarr"),
+            "memmap": self._rec_path.with_suffix(""),
+            "bundle": self._rec_path.with_name(f"{self._rec_path.stem}_bundle.zarr"),
+        }
+        if output_format not in default_paths:
+            raise ValueError("output_format must be 'zarr', 'memmap' or 'bundle'")
+
+        # TODO boxfix: only box 0 is recorded
+        box = 0
+        probes = [
+            probe
+            for probe, connected in sorted(self.connected.boxes[box].probes.items())
+            if connected
+        ]
+        gain = {}
+        if box in self.uploaded_settings.boxes:
+            for probe, settings in self.uploaded_settings.boxes[box].probes.items():
+                gain[str(probe)] = {
+                    str(channel): channel_settings.gain
+                    for channel, channel_settings in settings.channel.items()
+                }
+        args = {
+            "rec_path": str(self._rec_path),
+            "output_path": str(output_path or default_paths[output_format]),
+            "output_format": output_format,
+            "probes": probes,
+            "electrode_mapping": self.remap.electrode_mapping,
+            "FREQ": self.FREQ,
+            "num_channels": self.NUM_CHANNELS,
+            "attrs": {"recording_name": self.recording_name, "gain": gain},
+        }
+        if output_format == "bundle":
+            args["stimrec_path"] = str(self.stim_file_path)
+            args["settings"] = json.loads(
+                json.dumps(asdict(self.uploaded_settings), default=str)
+            )
+        return args
 
-        # mtx = self._os2chip_mat()
-        # while True:
-        #     # TODO: implement skipping of packages by checking:
-        #     # time = 0
-        #     # NAND
-        #     # session id is wrong
-
-        #     packets = NVP.streamReadData(
-        #         conver_recording_read_handle,
-        #         self.BUFFER_SIZE
-        #         )
-        #     count = len(packets)
-
-        #     if count < self.BUFFER_SIZE:
-        #         self.logger.warning("Out of packets")
-        #         break
-
-        #     # TODO: Rearrange data depening on selected gain
-        #     databuffer = np.asarray(
-        #         [packets[i].data for i in range(self.BUFFER_SIZE)], dtype="uint16"
-        #     )
-        #     databuffer = (databuffer @ mtx).T
-        #     databuffer = np.multiply(databuffer, self._settings.gain_vec[:, None])
-        #     self._add_to_zarr(databuffer)
-        pass
+    def _convert_recording(
+        self, output_format: str = "zarr", output_path: Path | None = None
+    ) -> Tuple[bool, str]:
+        """
+        Converts the raw recording of all connected probes and waits until it is
+        done, see _conversion_args for the arguments. After stop_recording the
+        recording is converted in the background, see get_jobs.
+        """
+        if self._rec_path is None:
+            return False, "No recording to convert"
+        if self.tracking.recording is True:
+            return False, "Can't convert the recording while recording"
+        try:
+            args = self._conversion_args(output_format, output_path)
+            self.logger.info(f"Converting {args['rec_path']} to {args['output_path']}")
+            stats = convert_recording(**args)
+        except (ImportError, ValueError) as e:
+            return False, str(e)
+        self.logger.info(f"Converted {args['rec_path']} to {args['output_path']}: \
+{stats}")
+        return (
+            True,
+            f"Recording converted to {args['output_path']} in \
+{stats['duration']:.1f} s ({stats['realtime_factor']:.1f}x real time)",
+        )
 
-    def _add_to_zarr(self, databuffer: np.ndarray) -> None:
-        """Adds the data to the zarr file."""
-        # TODO: not implemented
-        pass
+    def _queue_post_recording_jobs(self) -> None:
+        """Queues the time index, the integrity scan and the conversion to a bundle
+        of the last recording."""
+        args = self._conversion_args("bundle")
+        probe_args = {"rec_path": args["rec_path"], "probes": args["probes"]}
+        self.jobs.submit("index", probe_args, priority=0)
+        self.jobs.submit("scan", probe_args, priority=1)
+        if zarr is None:
+            self.logger.warning(
+                "Recording isn't converted to a bundle, zarr isn't installed"
+            )
+            return
+        # A conversion that is interrupted continues when the job is started again
+        self.jobs.submit("convert", {**args, "resume": True}, priority=2)
+
+    def get_jobs(self, job_id: int | None = None) -> Tuple[bool, Any]:
+        """Returns all background jobs, newest first, or the job with job_id."""
+        if job_id is None:
+            return True, self.jobs.list_jobs()
+        job = self.jobs.get_job(job_id)
+        if job is None:
+            return False, f"Job {job_id} doesn't exist"
+        return True, job
+
+    def cancel_job(self, job_id: int) -> Tuple[bool, str]:
+        """Cancels a queued background job or stops a running one."""
+        return self.jobs.cancel(job_id)
 
     def _SU_list_to_bitmask(self, SU_list: List[int]) -> int:
         # convert SUs to NVP format
@@ -1180,18 +1605,46 @@ for SU's {SU_dict}"
 
 class _DataSenderThread(threading.Thread):
     def __init__(
-        self, NUM_SAMPLES: int, FREQ: int, NUM_CHANNELS: int, mtx: np.ndarray, port=9001
+        self,
+        NUM_SAMPLES: int,
+        FREQ: int,
+        NUM_CHANNELS: int,
+        remap: ChannelRemap,
+        port=9001,
+        queue_depth: int = 4,
+        catch_up: str = "burst",
+        filter_settings: FilterSettings | None = None,
+        transport: str = "U16",
+        filter_dtype: str = "float32",
+        spike_settings: SpikeSettings | None = None,
+        archive_settings: ArchiveSettings | None = None,
     ):
         super().__init__()
         self.thread = None
         self.stop_stream = None
-        # self.logger = logger
+        self.writer_done = None
+        self.pipeline: StreamPipeline | None = None
+        self.queue_depth = queue_depth
+        self.logger = logging.getLogger(__name__)
 
         self.NUM_SAMPLES = NUM_SAMPLES
         self.FREQ = FREQ
         self.NUM_CHANNELS = NUM_CHANNELS
         self.bufferInterval = self.NUM_SAMPLES / self.FREQ
-        self._prep_lfilter(f0=50.0, Q=30.0, FREQ=self.FREQ)
+        self.pacer = Pacer(self.bufferInterval, catch_up=catch_up)
+        if transport not in OE_TRANSPORTS:
+            raise ValueError(f"transport must be one of {list(OE_TRANSPORTS)}")
+        self.transport = transport
+        self.filters = FilterBank(
+            filter_settings or FilterSettings(),
+            self.NUM_CHANNELS,
+            self.FREQ,
+            filter_dtype,
+        )
+        self.spike_settings = spike_settings
+        self.detectors: list = []
+        self.archive_settings = archive_settings
+        self.archive: ArchiveWriter | None = None
         self._create_header(
             NUM_CHANNELS=self.NUM_CHANNELS, NUM_SAMPLES=self.NUM_SAMPLES
         )
@@ -1204,7 +1657,7 @@ class _DataSenderThread(threading.Thread):
         #         "http://localhost:37497/api/processors/111/config",
         #         json={"text": config_string},
         #     )
-        self.mtx = mtx
+        self.remap = remap
         self.tcpServer = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
         self.tcpServer.bind(("localhost", port))
         self.tcpServer.listen(1)
@@ -1216,16 +1669,53 @@ class _DataSenderThread(threading.Thread):
         self.tcpClient = tcpClient
         self.socket_address = socket_address
 
-    def _prep_lfilter(self, f0: float = 50.0, Q: float = 30.0, FREQ: int = 20000):
-        b, a = signal.iirnotch(f0, Q, FREQ)
-        z = np.zeros((60, 2))
-        self.b, self.a, self.z = b, a, z
+    def set_profile(
+        self, profile: StreamingProfile, transport: str | None = None
+    ) -> None:
+        """Applies the block size, queue depth and filter precision of profile and
+        the element type transport, if given, to the next stream."""
+        if self.thread is not None and self.thread.is_alive():
+            raise RuntimeError("Can't change the streaming profile while streaming")
+        if transport is not None:
+            if transport not in OE_TRANSPORTS:
+                raise ValueError(f"transport must be one of {list(OE_TRANSPORTS)}")
+            self.transport = transport
+        self.NUM_SAMPLES = profile.num_samples
+        self.bufferInterval = self.NUM_SAMPLES / self.FREQ
+        self.pacer = Pacer(self.bufferInterval, catch_up=self.pacer.catch_up)
+        self.queue_depth = profile.queue_depth
+        self.filters = FilterBank(
+            self.filters.settings, self.NUM_CHANNELS, self.FREQ, profile.filter_dtype
+        )
+        self._create_header(self.NUM_CHANNELS, self.NUM_SAMPLES)
+
+    def set_filter_settings(self, filter_settings: FilterSettings) -> None:
+        """Sets the filters of the next stream."""
+        if self.thread is not None and self.thread.is_alive():
+            raise RuntimeError("Can't change the filters while streaming")
+        self.filters = FilterBank(
+            filter_settings, self.NUM_CHANNELS, self.FREQ, self.filters.dtype
+        )
+
+    def set_spike_settings(self, spike_settings: SpikeSettings | None) -> None:
+        """Sets the threshold crossing detection of the next stream, None to disable
+        it."""
+        if self.thread is not None and self.thread.is_alive():
+            raise RuntimeError("Can't change the spike detection while streaming")
+        self.spike_settings = spike_settings
+
+    def set_archive_settings(self, archive_settings: ArchiveSettings | None) -> None:
+        """Sets the compressed archive of the next recording, None to disable it."""
+        if self.thread is not None and self.thread.is_alive():
+            raise RuntimeError("Can't change the archive while streaming")
+        self.archive_settings = archive_settings
 
     def _create_header(self, NUM_CHANNELS: int = 60, NUM_SAMPLES: int = 500):
         # ---- DEFINE HEADER VALUES ---- #
         offset = 0  # Offset of bytes in this packet; only used for buffers > ~64 kB
-        dataType = 2  # Enumeration value based on OpenCV.Mat data types
-        elementSize = 2  # Number of bytes per element. elementSize = 2 for U16
+        # Enumeration value based on OpenCV.Mat data types
+        dataType, dtype = OE_TRANSPORTS[self.transport]
+        elementSize = dtype.itemsize  # Number of bytes per element
         # Data types:   [ U8, S8, U16, S16, S32, F32, F64 ]
         # Enum value:   [  0,  1,   2,   3,   4,   5,   6 ]
         # Element Size: [  1,  1,   2,   2,   4,   4,   8 ]
@@ -1236,64 +1726,334 @@ class _DataSenderThread(threading.Thread):
             + np.array([elementSize, NUM_CHANNELS, NUM_SAMPLES], dtype="i4").tobytes()
         )
 
-    def _time(self):
-        return time.time_ns() / (10**9)
-
-    def _prepare_databuffer(self, databuffer: np.ndarray, z) -> tuple:
-        databuffer = (databuffer @ self.mtx).T
-        databuffer, z = signal.lfilter(self.b, self.a, databuffer, axis=1, zi=z)
-        databuffer = databuffer.astype("uint16")
-        databuffer = databuffer.copy(order="C")
-        return databuffer.tobytes(), z
-
-    def send_data(self, rec_path, probe):
+    def _prepare_databuffer(self, index: int, databuffer: np.ndarray) -> None:
+        """Remaps and filters the block of the index-th probe into its rows of the
+        send buffer."""
+        rows = slice(index * self.NUM_CHANNELS, (index + 1) * self.NUM_CHANNELS)
+        remapped = self.remap.apply(databuffer, out=self._remapped[rows])
+        if self.previews:
+            for factor, bins in self.previews[index].update(remapped).items():
+                self._preview_files[index][factor].write(bins.tobytes())
+        if self.detectors:
+            self._detect_spikes(index, remapped)
+        filtered = self.filters.apply(remapped, rows)
+        convert_block(filtered, self._sendbuffer[rows])
+
+    def _detect_spikes(self, index: int, remapped: np.ndarray) -> None:
+        """Writes the spikes in the remapped block of the index-th probe to its
+        spikes file and, with send_events, to its event channel. The detector
+        band-pass filters the block itself."""
+        spikes = self.detectors[index].detect(remapped, self._streamed)
+        samples = spikes["sample"] - self._streamed
+        # Packet offset in the stream of the probe, of a repeated packet the one
+        # that is repeated
+        spikes["sample"] = self._positions[index][samples]
+        self._spike_files[index].write(spikes.tobytes())
+        self.spike_counts[self._probes[index]] += len(spikes)
+        if self.spike_settings.send_events:
+            events = self._sendbuffer[self.NUM_CHANNELS * len(self._probes) + index]
+            events[:] = 0
+            events[samples] = spikes["channel"] + 1
+
+    def _map(self, fn, count: int) -> list:
+        """Calls fn(i) for every probe, in parallel if there is more than one."""
+        if count == 1:
+            return [fn(0)]
+        return list(self._executor.map(fn, range(count)))
+
+    def send_data(
+        self,
+        rec_path,
+        probes: List[int],
+        follow: bool = False,
+        start_time: float | None = None,
+    ):
+        """Streams the recording to Open Ephys in three stages that run in their own
+        threads: reading from the file, remapping and filtering, and writing to the
+        socket. The stages are connected by queues of at most queue_depth blocks.
+
+        Every probe is read from its own stream, the streams are aligned on packet
+        Timestamp and sent as one buffer of NUM_CHANNELS channels per probe, in the
+        order of probes. When a stream drops packets, the streams are aligned again
+        in the block where that happened, see VB_streaming.align_block.
+
+        With follow, the file is still being written since start_time: reaching the
+        end of the file waits for more data instead of ending the stream, which then
+        only ends with stop(). The preview pyramid of every probe is then written
+        next to the recording while streaming, see VB_recordings.open_preview, and
+        with archive_settings the packets are also written to a compressed archive,
+        see ArchiveWriter.
+
+        With spike_settings, the threshold crossings of every probe are written next
+        to the recording, see VB_recordings.open_spikes, and with send_events one
+        event channel per probe is sent after the channels of the probes."""
         print("Started sending data to Open Ephys")
-        # TODO: How to handle data streams from multiple probes? align on timestamp?
-        send_data_read_handle = NVP.streamOpenFile(str(rec_path), probe)
-        counter = 0
-        t0 = self._time()
-        while not self.stop_stream.is_set():
-            counter += 1
-            packets = NVP.streamReadData(send_data_read_handle, self.NUM_SAMPLES)
-            count = len(packets)
-            if count < self.NUM_SAMPLES:
+        n_probes = len(probes)
+        self._probes = probes
+        event_channels = 0
+        if self.spike_settings is not None and self.spike_settings.send_events:
+            event_channels = n_probes
+        self._create_header(
+            self.NUM_CHANNELS * n_probes + event_channels, self.NUM_SAMPLES
+        )
+        self._remapped = np.empty(
+            (self.NUM_CHANNELS * n_probes, self.NUM_SAMPLES), dtype="uint16"
+        )
+        self._sendbuffer = np.empty(
+            (self.NUM_CHANNELS * n_probes + event_channels, self.NUM_SAMPLES),
+            dtype=OE_TRANSPORTS[self.transport][1],
+        )
+        self.filters.reset(self.NUM_CHANNELS * n_probes)
+        self.realigned_blocks = 0
+        self.filled_packets = {probe: 0 for probe in probes}
+        self._streamed = 0
+        self.scanners = {probe: IntegrityScanner() for probe in probes}
+        self.indices: dict = {}
+        self.previews: list = []
+        self.detectors = []
+        self.archive = None
+        self.spike_counts = {probe: 0 for probe in probes}
+        # Two extra buffers for the blocks that are being read and processed
+        self._pool = BufferPool(
+            [
+                (
+                    np.empty((n_probes, self.NUM_SAMPLES, 64), dtype="int16"),
+                    np.empty((n_probes, self.NUM_SAMPLES), dtype="uint32"),
+                    np.empty((n_probes, self.NUM_SAMPLES), dtype="uint16"),
+                    np.empty((n_probes, self.NUM_SAMPLES), dtype="uint8"),
+                    # Packet offset in the stream of every packet that is sent
+                    np.empty((n_probes, self.NUM_SAMPLES), dtype="i8"),
+                )
+                for _ in range(self.queue_depth + 2)
+            ]
+        )
+        with ExitStack() as stack, ThreadPoolExecutor(
+            max_workers=2 * n_probes, thread_name_prefix="probe"
+        ) as self._executor:
+            self._readers = [
+                stack.enter_context(
+                    NVP.StreamReader(str(rec_path), probe, self.NUM_SAMPLES)
+                )
+                for probe in probes
+            ]
+            if follow:
+                self._readers = [
+                    TailReader(
+                        reader,
+                        self.stop_stream,
+                        self.FREQ,
+                        start_time,
+                        writer_done=self.writer_done,
+                    )
+                    for reader in self._readers
+                ]
+                self.previews = [PreviewPyramid(self.NUM_CHANNELS) for _ in probes]
+                # Unbuffered, so the bins can be read while recording
+                self._preview_files = [
+                    {
+                        factor: stack.enter_context(
+                            open(preview_path(rec_path, probe, factor), "wb", 0)
+                        )
+                        for factor in PREVIEW_FACTORS
+                    }
+                    for probe in probes
+                ]
+                if self.archive_settings is not None:
+                    self.archive = ArchiveWriter(
+                        archive_path(rec_path), probes, self.FREQ, self.archive_settings
+                    )
+                    self.archive.start()
+                    stack.callback(self.archive.close)
+            if self.spike_settings is not None:
+                self.detectors = [
+                    SpikeDetector(self.spike_settings, self.NUM_CHANNELS, self.FREQ)
+                    for _ in probes
+                ]
+                self._spike_files = [
+                    stack.enter_context(open(spikes_path(rec_path, probe), "wb", 0))
+                    for probe in probes
+                ]
+            try:
+                heads, offsets = align_streams(self._readers)
+            except ValueError:
+                if self.stop_stream.is_set() or self.writer_done.is_set():
+                    # Stopped while waiting for the first packets
+                    return
+                raise
+            # Packets of every probe that were read but not sent yet, the first
+            # block starts with the packet that the streams are aligned on
+            self._carry = [
+                tuple(np.asarray(field)[None] for field in head) for head in heads
+            ]
+            self.indices = {
+                probe: TimeIndex(offset=offset)
+                for probe, offset in zip(probes, offsets)
+            }
+            self.pacer.start()
+            self.pipeline = StreamPipeline(
+                [
+                    ("reader", self._read_block),
+                    ("processor", self._process_block),
+                    ("writer", self._send_block),
+                ],
+                self.queue_depth,
+                self.stop_stream,
+                pace=self.pacer.wait,
+            )
+            self.pipeline.run()
+        # The time index of a followed recording isn't saved from here: the last
+        # block that isn't full is never streamed, and a stopped stream misses the
+        # rest of the file. The index job of stop_recording builds it from the file.
+
+    def _read_probe(self, index: int, block: tuple) -> int:
+        databuffer, timestamps, status, session_id = (
+            array[index] for array in block[:4]
+        )
+        start = 0
+        if self._carry[index] is not None:
+            start = len(self._carry[index][1])
+            for array, carried in zip(
+                (databuffer, timestamps, status, session_id), self._carry[index]
+            ):
+                array[:start] = carried
+            self._carry[index] = None
+        count = self._readers[index].readinto(
+            databuffer[start:], timestamps[start:], status[start:], session_id[start:]
+        )
+        return start + count
+
+    def _read_block(self) -> tuple | None:
+        block = self._pool.acquire(self.stop_stream)
+        if block is None:
+            return None
+        counts = self._map(lambda i: self._read_probe(i, block), len(self._readers))
+        if min(counts) < self.NUM_SAMPLES:
+            if not self.stop_stream.is_set():
                 print("Out of packets")
-                break
-
-            databuffer = np.asarray(
-                [packets[i].data for i in range(self.NUM_SAMPLES)], dtype="uint16"
+            self._pool.release(block)
+            return None
+        self._align_block(block)
+        return block
+
+    def _align_block(self, block: tuple) -> None:
+        """Adds the packets of the block that are sent to the integrity scans, time
+        indices and archive, and sets their offsets in the streams. If a stream
+        dropped packets, the streams are first aligned again on Timestamp: packets
+        are repeated where a stream has none and the packets after the block are
+        kept for the next one."""
+        databuffer, timestamps, status, session_id, positions = block
+        n = self.NUM_SAMPLES
+        used = [n] * len(self._probes)
+        aligned = None
+        if not (timestamps == timestamps[0]).all():
+            aligned = align_block(timestamps)
+            if aligned is None:
+                self.logger.warning(
+                    f"Timestamps of probes {self._probes} don't increase, the \
+streams can't be aligned at {timestamps[:, 0]}"
+                )
+            else:
+                used = aligned[2].tolist()
+        offsets = [self.indices[probe].packets for probe in self._probes]
+        for i, probe in enumerate(self._probes):
+            rows = slice(0, used[i])
+            self.scanners[probe].update(
+                timestamps[i, rows], status[i, rows], session_id[i, rows]
             )
-            databuffer, self.z = self._prepare_databuffer(databuffer, self.z)
-            self.tcpClient.sendto(self.header + databuffer, self.socket_address)
-            t2 = self._time()
-            while (t2 - t0) < counter * self.bufferInterval:
-                t2 = self._time()
-        NVP.streamClose(send_data_read_handle)
+            self.indices[probe].update(timestamps[i, rows])
+        if self.archive is not None:
+            self.archive.submit(block[:4], offsets, used)
+        positions[:] = np.arange(n)
+        if aligned is not None:
+            timeline, take, _ = aligned
+            positions[:] = take
+            self.realigned_blocks += 1
+            for i, probe in enumerate(self._probes):
+                rows = (databuffer[i], timestamps[i], status[i], session_id[i])
+                if used[i] < n:
+                    self._carry[i] = tuple(row[used[i] :].copy() for row in rows)
+                for row in rows:
+                    row[:] = row[take[i]]
+                timestamps[i] = timeline
+                self.filled_packets[probe] += n - used[i]
+            self.logger.warning(
+                f"Realigned probes {self._probes} at timestamp {timeline[0]}, \
+repeated {[n - count for count in used]} packets"
+            )
+        positions += np.array(offsets)[:, None]
+
+    def _process_block(self, block: tuple) -> bytes:
+        databuffer, timestamps, status, session_id, self._positions = block
+        self._map(
+            lambda i: self._prepare_databuffer(i, databuffer[i].view("uint16")),
+            len(databuffer),
+        )
+        self._streamed += databuffer.shape[1]
+        self._pool.release(block)
+        return self.header + self._sendbuffer.tobytes()
+
+    def _send_block(self, senddata: bytes) -> None:
+        self.tcpClient.sendto(senddata, self.socket_address)
+
+    def stats(self) -> dict:
+        """Returns queue depth and latency (in seconds) of each streaming stage, the
+        pacing jitter, the number of blocks in which the probes were aligned again
+        and the number of packets that were repeated for every probe."""
+        if self.pipeline is None:
+            return {"pacing": self.pacer.stats()}
+        stats = {
+            **self.pipeline.status(),
+            "pacing": self.pacer.stats(),
+            "realigned_blocks": self.realigned_blocks,
+            "filled_packets": self.filled_packets,
+            "integrity": {
+                probe: scanner.summary() for probe, scanner in self.scanners.items()
+            },
+        }
+        if self.detectors:
+            stats["spikes"] = self.spike_counts
+        if self.archive is not None:
+            stats["archive"] = self.archive.stats()
+        if isinstance(self._readers[0], TailReader):
+            # Samples that each probe is behind the writer of the recording file
+            stats["behind"] = {reader.probe: reader.behind for reader in self._readers}
+        return stats
 
     def _send_empty(self):
         print("Started sending empty data to Open Ephys")
-        counter = 0
-        t0 = self._time()
+        self._create_header(self.NUM_CHANNELS, self.NUM_SAMPLES)
+        dtype = OE_TRANSPORTS[self.transport][1]
+        databuffer = np.zeros((self.NUM_CHANNELS, self.NUM_SAMPLES), dtype).tobytes()
+        self.pacer.start()
         for i in range(10):
-            counter += 1
-            databuffer = np.zeros((60, 500), dtype="uint16").tobytes()
+            self.pacer.wait()
             self.tcpClient.sendto(self.header + databuffer, self.socket_address)
-            t2 = self._time()
-            while (t2 - t0) < counter * self.bufferInterval:
-                t2 = self._time()
 
-    def start(self, recording_path, probe, empty=False):
+    def start(
+        self,
+        recording_path,
+        probe: int | List[int],
+        empty=False,
+        follow: bool = False,
+        start_time: float | None = None,
+    ):
         if self.thread is not None and self.thread.is_alive():
             print("Thread already running")
             return
+        self.writer_done = threading.Event()
         if empty:
             self.stop_stream = threading.Event()
             self.thread = threading.Thread(target=self._send_empty, daemon=True)
             self.thread.start()
         else:
+            probes = [probe] if isinstance(probe, int) else list(probe)
+            if not probes:
+                raise ValueError("No probes to stream")
             self.stop_stream = threading.Event()
             self.thread = threading.Thread(
-                target=self.send_data, args=(recording_path, probe), daemon=True
+                target=self.send_data,
+                args=(recording_path, probes, follow, start_time),
+                daemon=True,
             )
             self.thread.start()
 
@@ -1301,6 +2061,19 @@ class _DataSenderThread(threading.Thread):
         self.stop_stream.set()
         self.thread.join()
 
+    def finish(self, timeout: float = 10.0) -> None:
+        """Ends a stream that follows a recording file once the writer has closed
+        it: the rest of the file is still sent. Stops the stream if that takes
+        longer than timeout seconds."""
+        self.writer_done.set()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            self.logger.warning(
+                f"Stream didn't reach the end of the recording in {timeout} s, \
+stopping it"
+            )
+            self.stop()
+
     def shutdown(self):
         self.stop()
         self.tcpServer.close()
@@ -499,6 +499,37 @@ def add_to_stimrec(
     return program
 
 
+def read_stimrec_events(path: Path) -> list:
+    """
+    Read the instructions, and the settings that were uploaded during the
+    recording, from a stimrec xml file. Converts from 1-indexing to 0-indexing,
+    the inverse of add_to_stimrec.
+
+    Arguments:
+    - path: path to the xml file
+
+    Returns a list of dictionaries with the attributes of every element, with
+    start_time and delta_time as float and event set to the instruction_type or
+    the tag of the setting.
+    """
+    events = []
+    for element in etree.parse(path).getroot().iter():
+        if "start_time" not in element.attrib:
+            continue
+        event = dict(element.attrib)
+        event["start_time"] = float(event["start_time"])
+        event["delta_time"] = float(event["delta_time"])
+        # settings from before the recording have start_time -1
+        if event["start_time"] < 0:
+            continue
+        event["event"] = event.pop("instruction_type", element.tag)
+        for key in ["box", "probe", "channel", "stimunit"]:
+            if key in event:
+                event[key] = int(event[key]) - 1
+        events.append(event)
+    return events
+
+
 # Testing code:
 if __name__ == "__main__":
     strixml = """<Program>
@@ -1,5 +1,5 @@
 import xml.etree.ElementTree as ET
-from typing import List
+from typing import List, Tuple
 
 from pydantic import BaseModel, field_validator
 from pydantic.dataclasses import dataclass
@@ -205,3 +205,78 @@ class apiVerifyXML(BaseModel):
         if check_topic not in ["all", "recording", "stimulation"]:
             raise ValueError("check_topic must be 'all', 'recording' or 'stimulation'")
         return check_topic
+
+
+@dataclass
+class apiStreamingProfile(BaseModel):
+    profile: str = "default"
+    transport: str = "U16"
+
+    @field_validator("profile")
+    @classmethod
+    def check_profile(cls, profile: str) -> str:
+        if profile not in ["low_latency", "default", "high_throughput", "auto"]:
+            raise ValueError(
+                "profile must be 'low_latency', 'default', 'high_throughput' or 'auto'"
+            )
+        return profile
+
+    @field_validator("transport")
+    @classmethod
+    def check_transport(cls, transport: str) -> str:
+        if transport not in ["U16", "S16", "F32"]:
+            raise ValueError("transport must be 'U16', 'S16' or 'F32'")
+        return transport
+
+
+@dataclass
+class apiFilterSettings(BaseModel):
+    highpass: float | None = None
+    bandpass: Tuple[float, float] | None = None
+    order: int = 2
+    line_frequency: float | None = 50.0
+    harmonics: int = 1
+    Q: float = 30.0
+
+
+@dataclass
+class apiSpikeDetection(BaseModel):
+    enabled: bool = False
+    threshold: float = 5.0
+    refractory: float = 0.001
+    send_events: bool = False
+    band: Tuple[float, float] = (300.0, 3000.0)
+
+    @field_validator("threshold")
+    @classmethod
+    def check_threshold(cls, threshold: float) -> float:
+        if threshold <= 0:
+            raise ValueError("threshold must be positive")
+        return threshold
+
+    @field_validator("refractory")
+    @classmethod
+    def check_refractory(cls, refractory: float) -> float:
+        if not 0 <= refractory <= 0.1:
+            raise ValueError("refractory must be between 0 and 0.1 seconds")
+        return refractory
+
+    @field_validator("band")
+    @classmethod
+    def check_band(cls, band: Tuple[float, float]) -> Tuple[float, float]:
+        if not 0 < band[0] < band[1]:
+            raise ValueError("band must be (low, high) with 0 < low < high")
+        return band
+
+
+@dataclass
+class apiArchive(BaseModel):
+    enabled: bool = False
+    cpu_budget: float = 0.25
+
+    @field_validator("cpu_budget")
+    @classmethod
+    def check_cpu_budget(cls, cpu_budget: float) -> float:
+        if not 0 < cpu_budget <= 1:
+            raise ValueError("cpu_budget must be between 0 and 1")
+        return cpu_budget
@@ -0,0 +1,50 @@
+"""
+Benchmark of the channel remap done on every block sent to Open Ephys.
+
+Compares the product with the one-hot (64, 60) matrix that was used before with the
+gather of ChannelRemap, and checks that both give bit-identical output. The mapping
+is read from the default electrode mapping spreadsheet when possible, otherwise a
+random mapping is used. Run from the repository root:
+
+    python -m benchmarks.bench_channel_remap
+"""
+
+import timeit
+
+import numpy as np
+
+from VB_streaming import ChannelRemap
+
+NUM_SAMPLES = 500
+NUM_CHANNELS = 60
+REPEATS = 2000
+
+
+def electrode_mapping() -> dict:
+    try:
+        from defaults.defaults import Mappings
+
+        mappings = Mappings("defaults/electrode_mapping_short_cables.xlsx")
+        return mappings.electrode_mapping
+    except ImportError:
+        rng = np.random.default_rng(0)
+        channels = rng.permutation(64)[:NUM_CHANNELS]
+        return {int(c): e for e, c in enumerate(channels)}
+
+
+if __name__ == "__main__":
+    remap = ChannelRemap(electrode_mapping(), NUM_CHANNELS)
+    mtx = remap.matrix()
+    rng = np.random.default_rng(1)
+    databuffer = rng.integers(0, 2**16, (NUM_SAMPLES, 64)).astype("uint16")
+    out = np.empty((NUM_CHANNELS, NUM_SAMPLES), dtype="uint16")
+
+    assert np.array_equal((databuffer @ mtx).T, remap.apply(databuffer, out=out))
+    print("Matrix product and gather output are bit-identical")
+
+    for name, fn in [
+        ("Matrix product", lambda: (databuffer @ mtx).T.copy(order="C")),
+        ("Gather", lambda: remap.apply(databuffer, out=out)),
+    ]:
+        t = timeit.timeit(fn, number=REPEATS)
+        print(f"{name:15s}: {t / REPEATS * 1e6:8.1f} us per {NUM_SAMPLES} samples")
@@ -0,0 +1,63 @@
+"""
+Benchmark of the NVP calls of recording and stimulation settings uploads.
+
+Plans the calls with a dry run CommandBuffer, so no ViperBox or NeuraviperPy is
+needed, for a first upload of 4 probes, the same upload again and an upload that
+changes one gain. Prints the number of calls that would be made, the number that
+are left out and the time the buffer takes per upload. Run from the repository root:
+
+    python -m benchmarks.bench_command_buffer
+"""
+
+import timeit
+
+from VB_upload import CommandBuffer
+
+PROBES = 4
+CHANNELS = 64
+SUS = 8
+REPEATS = 20
+
+
+def upload(buffer: CommandBuffer, gains: dict) -> tuple:
+    """Queues and flushes the calls of a settings upload like ViperBox does, returns
+    the number of calls made and left out."""
+    calls, skipped = 0, 0
+    for probe in range(PROBES):
+        for OS in range(128):
+            buffer.set("setOSDischargeperm", 0, probe, (OS,), False)
+            buffer.set("setOSStimblank", 0, probe, (OS,), True)
+        for channel in range(CHANNELS):
+            buffer.set("selectElectrode", 0, probe, (channel,), 0)
+            buffer.set("setReference", 0, probe, (channel,), 256)
+            buffer.set("setGain", 0, probe, (channel,), gains.get((probe, channel), 0))
+            buffer.set("setAZ", 0, probe, (channel,), False)
+        buffer.write("writeChannelConfiguration", 0, probe, False)
+        buffer.set("setOSimage", 0, probe, (), bytes(64))
+        for SU in range(SUS):
+            buffer.set("writeSUConfiguration", 0, probe, (SU,), False, 20, 1, 1)
+        result, _ = buffer.flush(0, probe)
+        calls += result.calls
+        skipped += result.skipped
+    return calls, skipped
+
+
+if __name__ == "__main__":
+    for name, uploads in [
+        ("First upload", [{}]),
+        ("Same upload", [{}, {}]),
+        ("One gain changed", [{}, {(1, 5): 2}]),
+    ]:
+
+        def run():
+            buffer = CommandBuffer(None, {0: None}, dry_run=True)
+            for gains in uploads:
+                result = upload(buffer, gains)
+            return result
+
+        calls, skipped = run()
+        t = timeit.timeit(run, number=REPEATS) / REPEATS / len(uploads)
+        print(
+            f"{name:17s}: {calls:5d} calls, {skipped:5d} left out, "
+            f"{t * 1e3:6.2f} ms per upload"
+        )
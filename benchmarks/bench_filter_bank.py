@@ -0,0 +1,56 @@
+"""
+Benchmark of the filtering done on every block sent to Open Ephys.
+
+Compares the 50 Hz notch filter that was applied with lfilter in float64 with the
+FilterBank, which runs second-order sections with sosfilt in float32, for 1, 2 and
+4 probes. The FilterBank is timed with the default settings (the same notch
+filter) and with a high-pass filter plus notch filters at 50, 100 and 150 Hz. Run
+from the repository root:
+
+    python -m benchmarks.bench_filter_bank
+"""
+
+import timeit
+
+import numpy as np
+from scipy import signal
+
+from VB_streaming import FilterBank, FilterSettings
+
+NUM_SAMPLES = 500
+FREQ = 20000
+REPEATS = 500
+
+
+def lfilter_block(b, a, databuffer, z):
+    databuffer, z[:] = signal.lfilter(b, a, databuffer, axis=1, zi=z)
+    return databuffer
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    b, a = signal.iirnotch(50.0, 30.0, FREQ)
+    cascade = FilterSettings(highpass=300.0, harmonics=3)
+    for num_channels in (60, 120, 240):
+        databuffer = rng.integers(0, 2**12, (num_channels, NUM_SAMPLES)).astype(
+            "uint16"
+        )
+        z = np.zeros((num_channels, 2))
+        default = FilterBank(FilterSettings(), num_channels, FREQ)
+        difference = np.abs(
+            lfilter_block(b, a, databuffer, z.copy()) - default.apply(databuffer)
+        ).max()
+        default.reset()
+        print(f"{num_channels} channels, max difference with lfilter: {difference:.4f}")
+        for name, fn in [
+            ("lfilter float64", lambda: lfilter_block(b, a, databuffer, z)),
+            ("sosfilt notch", lambda: default.apply(databuffer)),
+            (
+                f"sosfilt {len(FilterBank(cascade, 1).sos)} sections",
+                lambda bank=FilterBank(cascade, num_channels, FREQ): bank.apply(
+                    databuffer
+                ),
+            ),
+        ]:
+            t = timeit.timeit(fn, number=REPEATS)
+            print(f"  {name:18s}: {t / REPEATS * 1e6:8.1f} us per block")
@@ -0,0 +1,53 @@
+"""
+Microbenchmark of the packet decoding done after every NVP.streamReadData call.
+
+Compares the list-of-Packet path that the data thread used to take (one Packet per
+packet and np.asarray over all data lists) with the array path that views the
+ctypes buffers directly. No device is needed, the ctypes buffers are filled with
+random data. Run from the repository root:
+
+    python -m benchmarks.bench_packet_decoding
+"""
+
+import ctypes
+import timeit
+
+import numpy as np
+
+import NeuraviperPy as NVP
+
+NUM_SAMPLES = 500
+REPEATS = 200
+
+
+def make_buffers(packet_count: int):
+    info_arr = (NVP.PacketInfo * packet_count)()
+    data_arr = (ctypes.c_int16 * (packet_count * NVP.CHANNEL_COUNT))()
+    rng = np.random.default_rng(0)
+    info = np.frombuffer(info_arr, dtype=NVP.PACKETINFO_DTYPE)
+    info["Timestamp"] = np.arange(packet_count)
+    info["payloadlength"] = NVP.CHANNEL_COUNT
+    data = np.frombuffer(data_arr, dtype=np.int16)
+    data[:] = rng.integers(0, 4096, data.size)
+    return info_arr, data_arr
+
+
+def decode_packets(info_arr, data_arr, packet_count):
+    packets = NVP._packet_list(info_arr, data_arr, packet_count)
+    return np.asarray([packets[i].data for i in range(packet_count)], dtype="uint16")
+
+
+def decode_arrays(info_arr, data_arr, packet_count):
+    _, _, _, data = NVP._packet_arrays(info_arr, data_arr, packet_count)
+    return data.view("uint16")
+
+
+if __name__ == "__main__":
+    info_arr, data_arr = make_buffers(NUM_SAMPLES)
+    assert np.array_equal(
+        decode_packets(info_arr, data_arr, NUM_SAMPLES),
+        decode_arrays(info_arr, data_arr, NUM_SAMPLES),
+    )
+    for name, fn in [("Packet list", decode_packets), ("NumPy views", decode_arrays)]:
+        t = timeit.timeit(lambda: fn(info_arr, data_arr, NUM_SAMPLES), number=REPEATS)
+        print(f"{name:12s}: {t / REPEATS * 1e6:9.1f} us per {NUM_SAMPLES} packets")
@@ -0,0 +1,46 @@
+"""
+Benchmark of the conversion of the filter output into the buffer that is sent to
+Open Ephys, for every element type in OE_TRANSPORTS.
+
+The U16 conversion with astype and copy that was used before is timed as well.
+Throughput is the number of bytes sent to Open Ephys per second of conversion. Run
+from the repository root:
+
+    python -m benchmarks.bench_transports
+"""
+
+import timeit
+
+import numpy as np
+
+from VB_streaming import OE_TRANSPORTS, convert_block
+
+NUM_SAMPLES = 500
+REPEATS = 2000
+
+
+def astype_block(filtered: np.ndarray) -> bytes:
+    return filtered.astype("uint16").copy(order="C").tobytes()
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    for num_channels in (60, 240):
+        filtered = rng.normal(2048, 500, (num_channels, NUM_SAMPLES)).astype(
+            "float32"
+        )
+        print(f"{num_channels} channels")
+        tests = [("U16 astype", lambda: astype_block(filtered), 2)]
+        for name, (_, dtype) in OE_TRANSPORTS.items():
+            out = np.empty((num_channels, NUM_SAMPLES), dtype=dtype)
+            tests.append(
+                (
+                    name,
+                    lambda out=out: convert_block(filtered, out).tobytes(),
+                    dtype.itemsize,
+                )
+            )
+        for name, fn, itemsize in tests:
+            t = timeit.timeit(fn, number=REPEATS) / REPEATS
+            mb = num_channels * NUM_SAMPLES * itemsize / 1e6
+            print(f"  {name:10s}: {t * 1e6:8.1f} us per block, {mb / t:8.1f} MB/s")
@@ -1,9 +1,12 @@
+import hashlib
+import json
 import logging
 import logging.handlers
+import os
+import threading
 from dataclasses import dataclass
-
-import numpy as np
-import pandas as pd
+from pathlib import Path
+from typing import Dict, Tuple
 
 logger = logging.getLogger("defaults")
 logger.setLevel(logging.DEBUG)
@@ -12,6 +15,126 @@ socketHandler = logging.handlers.SocketHandler(
 )
 logger.addHandler(socketHandler)
 
+MAPPINGS_VERSION = 1
+MAPPING_NAMES = ["channel_input", "electrode_mapping", "probe_to_os_map"]
+
+# Mappings by spreadsheet path, with the mtime and size of the spreadsheet, shared by
+# all Mappings of the process
+_compiled_mappings: Dict[str, Tuple[Tuple[int, int], dict]] = {}
+_compiled_mappings_lock = threading.Lock()
+
+
+def mappings_cache_path(file_path) -> Path:
+    """JSON file next to the spreadsheet that its mappings are compiled to."""
+    return Path(file_path).with_suffix(".mapping.json")
+
+
+def _sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def compile_mappings(file_path) -> dict:
+    """Reads the mappings from the Excel file and writes them to
+    mappings_cache_path(file_path)."""
+    # pandas and openpyxl are slow to import, only needed when the file changed
+    import pandas as pd
+
+    path = Path(file_path)
+    stat = path.stat()
+    mapping = pd.read_excel(path, sheet_name=1)
+    stim_mapping = mapping[["Probe electrode", "EL_PAD#"]].copy()
+    rec_mapping = mapping[
+        [
+            "Resulting channel",
+            "Resulting input selection",
+            "Resulting electrode",
+        ]
+    ].copy()
+    rec_mapping.dropna(inplace=True)
+    rec_mapping = rec_mapping.map(int)
+    rec_mapping["Resulting channel"] = rec_mapping["Resulting channel"] - 1
+    rec_mapping["Resulting electrode"] = rec_mapping["Resulting electrode"] - 1
+    rec_mapping = rec_mapping.set_index("Resulting channel")
+    mappings = {
+        "channel_input": rec_mapping["Resulting input selection"].to_dict(),
+        "electrode_mapping": rec_mapping["Resulting electrode"].to_dict(),
+        "probe_to_os_map": stim_mapping.set_index("Probe electrode")["EL_PAD#"]
+        .map(int)
+        .to_dict(),
+    }
+    mappings = {
+        name: {int(k): int(v) for k, v in mappings[name].items()}
+        for name in MAPPING_NAMES
+    }
+    logger.info("Mappings read from excel file")
+
+    cache_path = mappings_cache_path(path)
+    compiled = {
+        "version": MAPPINGS_VERSION,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": _sha256(path),
+        **mappings,
+    }
+    try:
+        tmp_path = cache_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(compiled, indent=1))
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        # e.g. a read-only installation, the spreadsheet is read again next time
+        logger.warning(f"Couldn't write compiled mappings to {cache_path}: {e}")
+    return mappings
+
+
+def _read_compiled_mappings(path: Path, stat: os.stat_result) -> dict | None:
+    """Returns the mappings of the compiled JSON file of path, None if it doesn't
+    exist or belongs to another version of the spreadsheet."""
+    cache_path = mappings_cache_path(path)
+    try:
+        compiled = json.loads(cache_path.read_text())
+        if compiled["version"] != MAPPINGS_VERSION:
+            return None
+        if (compiled["mtime_ns"], compiled["size"]) != (
+            stat.st_mtime_ns,
+            stat.st_size,
+        ):
+            # Touched or copied, only different if the contents are
+            if compiled["sha256"] != _sha256(path):
+                return None
+            compiled["mtime_ns"], compiled["size"] = stat.st_mtime_ns, stat.st_size
+            cache_path.write_text(json.dumps(compiled, indent=1))
+        return {
+            name: {int(k): v for k, v in compiled[name].items()}
+            for name in MAPPING_NAMES
+        }
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        logger.warning(f"Couldn't read compiled mappings {cache_path}: {e}")
+        return None
+
+
+def load_mappings(file_path) -> dict:
+    """
+    Returns the mappings of the Excel file, see Mappings. Reading the Excel file is
+    slow, so its mappings are compiled to a JSON file next to it and kept in memory
+    for the whole process. Both are used as long as the modification time and size
+    of the Excel file, or else its SHA-256 hash, are unchanged.
+    """
+    path = Path(file_path).resolve()
+    stat = path.stat()
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _compiled_mappings_lock:
+        if str(path) in _compiled_mappings:
+            compiled_key, mappings = _compiled_mappings[str(path)]
+            if compiled_key == key:
+                return mappings
+        mappings = _read_compiled_mappings(path, stat)
+        if mappings is None:
+            mappings = compile_mappings(path)
+        _compiled_mappings[str(path)] = (key, mappings)
+        return mappings
+
 
 class Mappings:
     """
@@ -19,6 +142,9 @@ class Mappings:
     Excel file is 1-indexed, but the properties are 0-indexed, except probe electrode
     and EL_PAD# numbering. Probe electrode is 1-indexed. EL_PAD# is used to provide
     values for the XML which is also 1-indexed.
+
+    The mappings are read once per process and version of the Excel file, see
+    load_mappings.
     """
 
     def __init__(self, file_path):
@@ -26,66 +152,30 @@ class Mappings:
         self.get_mappings()
 
     def get_mappings(self):
-        hardcoded_mapping = pd.DataFrame(
-            {
-                "Probe electrode": np.arange(60),
-                "EL_PAD#": np.arange(60),
-                "Resulting channel": np.arange(60),
-                "Resulting input selection": np.zeros(60),
-                "Resulting electrode": np.arange(60),
-            },
-            dtype=int,
-        )
         try:
-            self.mapping = pd.read_excel(self.file_path, sheet_name=1)
-            self.stim_mapping = self.mapping[
-                [
-                    "Probe electrode",
-                    "EL_PAD#",
-                ]
-            ].copy()
-            self.rec_mapping = self.mapping[
-                [
-                    "Resulting channel",
-                    "Resulting input selection",
-                    "Resulting electrode",
-                ]
-            ].copy()
-            self.rec_mapping.dropna(inplace=True)
-            self.rec_mapping = self.rec_mapping.map(int)
-            self.rec_mapping["Resulting channel"] = (
-                self.rec_mapping["Resulting channel"] - 1
-            )
-            self.rec_mapping["Resulting electrode"] = (
-                self.rec_mapping["Resulting electrode"] - 1
-            )
-
-            logger.info("Mappings read from excel file")
+            self._mappings = load_mappings(self.file_path)
         except Exception as e:
-            self.rec_mapping = hardcoded_mapping.copy()
+            self._mappings = {
+                "channel_input": {channel: 0 for channel in range(60)},
+                "electrode_mapping": {channel: channel for channel in range(60)},
+                "probe_to_os_map": {electrode: electrode for electrode in range(60)},
+            }
             logger.warning(
                 f"Couldn't read mappings from excel file, using defaults. Error: {e}"
             )
 
     @property
     def channel_input(self):
-        return self.rec_mapping.set_index("Resulting channel")[
-            "Resulting input selection"
-        ].to_dict()
+        return dict(self._mappings["channel_input"])
 
     @property
     def electrode_mapping(self):
-        return self.rec_mapping.set_index("Resulting channel")[
-            "Resulting electrode"
-        ].to_dict()
+        return dict(self._mappings["electrode_mapping"])
 
     @property
     def probe_to_os_map(self):
-        logger.info(
-            f"probe to os map: "
-            f"{self.stim_mapping.set_index('Probe electrode')['EL_PAD#'].to_dict()}"
-        )
-        return self.stim_mapping.set_index("Probe electrode")["EL_PAD#"].to_dict()
+        logger.info(f"probe to os map: {self._mappings['probe_to_os_map']}")
+        return dict(self._mappings["probe_to_os_map"])
 
 
 @dataclass
@@ -93,6 +183,8 @@ class Snappings:
     # at initialization, get values from the excel file
 
     def __init__(self):
+        import pandas as pd
+
         try:
             self.mapping = pd.read_excel(
                 "defaults/electrode_mapping_short_cables.xlsx", sheet_name=1
@@ -14,10 +14,14 @@ import gui
 import VB_logger
 from api_classes import (
     Connect,
+    apiArchive,
+    apiFilterSettings,
     apiRecSettings,
+    apiSpikeDetection,
     apiStartRec,
     apiStartStim,
     apiStimSettings,
+    apiStreamingProfile,
     apiVerifyXML,
 )
 from ViperBox import ViperBox
@@ -80,6 +84,13 @@ app = FastAPI(
 VB = ViperBox(_session_datetime=session_datetime, start_oe=True)
 
 
+@app.on_event("startup")
+async def start_jobs():
+    """Starts the background jobs with the server, so that processes that import
+    this module don't start them."""
+    VB.jobs
+
+
 @app.post("/connect")  # , tags=["connect"])
 async def init(connect: Connect):
     """
@@ -279,8 +290,11 @@ async def start_recording(api_start_rec: apiStartRec):
     return {"result": result, "feedback": feedback}
 
 
+# Not async: the stream to Open Ephys is sent to the end of the recording file
+# before this returns, FastAPI runs it in its thread pool so that the other
+# endpoints keep responding meanwhile
 @app.post("/stop_recording")  # , tags=["stop_recording"])
-async def stop_recording():
+def stop_recording():
     """
     Stops the recording.
 
@@ -322,6 +336,186 @@ async def start_stimulation(api_start_stim: apiStartStim):
     return {"result": result, "feedback": feedback}
 
 
+@app.post("/streaming_profile/")
+async def streaming_profile(api_streaming_profile: apiStreamingProfile):
+    """
+    Select the streaming profile and the element type of the data that is sent to
+    Open Ephys. Can't be changed during a recording.
+
+    Args:
+    - profile (default: "default"): one of
+        - "low_latency": blocks of 100 samples (5 ms), for closed-loop display.
+        - "default": blocks of 500 samples (25 ms).
+        - "high_throughput": blocks of 2000 samples (100 ms), for many probes.
+        - "auto": measures the processing time per block and picks the smallest
+        block that is processed in half its duration.
+    - transport (default: "U16"): element type of the samples, one of
+        - "U16": unsigned 16 bit, the raw samples. Can't be used with a high-pass
+        or band-pass filter, of which the output is centered around zero.
+        - "S16": signed 16 bit.
+        - "F32": 32 bit float, the filter output without rounding.
+
+    Returns:
+    - boolean: true if correctly executed, otherwise false.
+    - feedback: More information on execution.
+    """
+    logger.info(f"/streaming_profile called with {api_streaming_profile.__dict__}")
+    result, feedback = VB.streaming_profile(
+        profile=api_streaming_profile.profile,
+        transport=api_streaming_profile.transport,
+    )
+    logger.info(f"/streaming_profile returned with {result}; {feedback}")
+    return {"result": result, "feedback": feedback}
+
+
+@app.get("/streaming_profile")
+async def get_streaming_profile():
+    """
+    Returns the parameters of the selected streaming profile: block size
+    (num_samples), queue_depth, filter_dtype, transport, the duration of a block in
+    seconds and, for "auto", the measured processing time per block size.
+    """
+    return {"result": True, "feedback": VB.get_streaming_profile()}
+
+
+@app.post("/filter_settings/")
+async def filter_settings(api_filter_settings: apiFilterSettings):
+    """
+    Set the filters of the data that is sent to Open Ephys, applied in this order.
+    Can't be changed during a recording.
+
+    Args:
+    - highpass (default: null): cutoff frequency (Hz) of the high-pass filter, null
+    to disable.
+    - bandpass (default: null): [low, high] cutoff frequencies (Hz) of the band-pass
+    filter, null to disable.
+    - order (default: 2): order of the high-pass and band-pass Butterworth filters.
+    - line_frequency (default: 50): frequency (Hz) of the mains, 50 or 60, null to
+    disable the notch filters.
+    - harmonics (default: 1): number of notch filters, at the line frequency and its
+    harmonics.
+    - Q (default: 30): quality factor of the notch filters.
+
+    Returns:
+    - boolean: true if correctly executed, otherwise false.
+    - feedback: More information on execution.
+    """
+    logger.info(f"/filter_settings called with {api_filter_settings.__dict__}")
+    result, feedback = VB.filters(
+        highpass=api_filter_settings.highpass,
+        bandpass=api_filter_settings.bandpass,
+        order=api_filter_settings.order,
+        line_frequency=api_filter_settings.line_frequency,
+        harmonics=api_filter_settings.harmonics,
+        Q=api_filter_settings.Q,
+    )
+    logger.info(f"/filter_settings returned with {result}; {feedback}")
+    return {"result": result, "feedback": feedback}
+
+
+@app.post("/spike_detection/")
+async def spike_detection(api_spike_detection: apiSpikeDetection):
+    """
+    Detect spikes as threshold crossings in the data that is sent to Open Ephys,
+    band-pass filtered for the detection only, independent of /filter_settings/.
+    The spikes are written next to the recording as <name>_probe<probe>_spikes.dat
+    (sample, channel and amplitude of every spike). Can't be changed during a
+    recording.
+
+    Args:
+    - enabled (default: false): enables the detection.
+    - threshold (default: 5.0): a spike is a crossing below -threshold times the
+    noise level (median absolute deviation) of the channel.
+    - refractory (default: 0.001): seconds after a spike in which crossings on the
+    same channel are ignored.
+    - send_events (default: false): also send one event channel per probe to Open
+    Ephys, after the channels of the probes, with the channel (1 indexed) of a
+    spike at its first sample.
+    - band (default: [300, 3000]): cutoff frequencies (Hz) of the band-pass filter
+    of the detection.
+
+    Returns:
+    - boolean: true if correctly executed, otherwise false.
+    - feedback: More information on execution.
+    """
+    logger.info(f"/spike_detection called with {api_spike_detection.__dict__}")
+    result, feedback = VB.spike_detection(
+        enabled=api_spike_detection.enabled,
+        threshold=api_spike_detection.threshold,
+        refractory=api_spike_detection.refractory,
+        send_events=api_spike_detection.send_events,
+        band=api_spike_detection.band,
+    )
+    logger.info(f"/spike_detection returned with {result}; {feedback}")
+    return {"result": result, "feedback": feedback}
+
+
+@app.post("/archive/")
+async def archive(api_archive: apiArchive):
+    """
+    Write the packets of a recording also to a compressed archive, <name>.vbarch next
+    to the recording, while it is streamed to Open Ephys. The archive is compressed
+    on a background thread that never delays the stream: blocks that can't be
+    compressed within the CPU budget are left out of the archive, the recording
+    itself is complete. Can't be changed during a recording.
+
+    Args:
+    - enabled (default: false): enables the archive.
+    - cpu_budget (default: 0.25): fraction of one CPU core that compressing may use.
+
+    Returns:
+    - boolean: true if correctly executed, otherwise false.
+    - feedback: More information on execution.
+    """
+    logger.info(f"/archive called with {api_archive.__dict__}")
+    result, feedback = VB.archive(
+        enabled=api_archive.enabled, cpu_budget=api_archive.cpu_budget
+    )
+    logger.info(f"/archive returned with {result}; {feedback}")
+    return {"result": result, "feedback": feedback}
+
+
+@app.get("/jobs")
+async def get_jobs():
+    """
+    Returns the background jobs, newest first. After a recording is stopped, its
+    time index is built, its packets are checked for anomalies and it is
+    converted to a bundle with the stimulation record. Jobs don't run during a
+    recording.
+
+    Returns:
+    - boolean: true if correctly executed, otherwise false.
+    - feedback: list of jobs with their kind, state ("queued", "running", "done",
+    "failed" or "cancelled"), progress (0 to 1) and result.
+    """
+    result, feedback = VB.get_jobs()
+    return {"result": result, "feedback": feedback}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int):
+    """
+    Returns the background job with job_id, see /jobs.
+    """
+    result, feedback = VB.get_jobs(job_id)
+    return {"result": result, "feedback": feedback}
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int):
+    """
+    Cancels a queued job or stops a running job.
+
+    Returns:
+    - boolean: true if correctly executed, otherwise false.
+    - feedback: More information on execution.
+    """
+    logger.info(f"/jobs/{job_id}/cancel called")
+    result, feedback = VB.cancel_job(job_id)
+    logger.info(f"/jobs/{job_id}/cancel returned with {result}; {feedback}")
+    return {"result": result, "feedback": feedback}
+
+
 # @app.post("/TTL_start/")#, tags=["TTL_start"])
 # async def TTL_start(api_TTL_start: apiTTLStart):
 #     result, feedback = VB.TTL_start(
@@ -1,4 +1,4 @@
-$fileList = @("main.py", "gui.py", "api_classes.py", "XML_handler.py", "ViperBox.py", "VB_logger.py", "VB_classes.py")
+$fileList = @("main.py", "gui.py", "api_classes.py", "XML_handler.py", "ViperBox.py", "VB_logger.py", "VB_classes.py", "NeuraviperPy.py", "VB_streaming.py", "VB_recordings.py", "VB_convert.py", "VB_jobs.py", "VB_upload.py")
 $scriptPath = Split-Path -Parent $MyInvocation.MyCommand.Path
 $mainFolderPath = Split-Path -Parent $scriptPath
 foreach ($file in $fileList) {